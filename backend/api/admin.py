@@ -1,7 +1,17 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Student, Expense, ExpenseShare
+from . import search
+from .models import Student, Expense, ExpenseShare, Settlement
+from .pagination import EstimatedCountPaginator
+
+
+class LargeTableMixin:
+    # Changelists that stay fast with millions of rows: no COUNT(*) over the
+    # whole table, neither for the pages nor for the "N total" link.
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 # -------------------------
 # Student Inline in UserAdmin
@@ -11,9 +21,10 @@ class StudentInline(admin.StackedInline):
     can_delete = False
     verbose_name_plural = "Student Info"
     fk_name = "user"
+    autocomplete_fields = ("friends",)
 
 
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(LargeTableMixin, BaseUserAdmin):
     inlines = (StudentInline,)
     list_display = ("username", "email", "first_name", "last_name", "get_department", "get_wallet")
     list_select_related = ("student_profile",)
@@ -35,27 +46,69 @@ admin.site.register(User, UserAdmin)
 # Student Admin
 # -------------------------
 @admin.register(Student)
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ("user", "department", "wallet_balance")
+    list_select_related = ("user",)
     search_fields = ("user__username", "user__email", "department")
-    filter_horizontal = ("friends",)  # friends is ManyToManyField
+    # Searched as you type instead of rendering every student in the page
+    autocomplete_fields = ("user", "friends")
 
 
 # -------------------------
 # Expense Admin
 # -------------------------
 @admin.register(Expense)
-class ExpenseAdmin(admin.ModelAdmin):
+class ExpenseAdmin(LargeTableMixin, admin.ModelAdmin):
     list_display = ("title", "amount", "payer", "created_at")
-    list_filter = ("created_at",)
-    search_fields = ("title", "payer__username", "payer__email")
+    list_select_related = ("payer",)
+    date_hierarchy = "created_at"
+    autocomplete_fields = ("payer",)
+    # Titles are searched through the full-text index, see get_search_results
+    search_fields = ("payer__username", "payer__email")
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(pk__in=search.get_backend().matching_ids(search_term))
+        return results, may_have_duplicates
 
 
 # -------------------------
 # ExpenseShare Admin
 # -------------------------
 @admin.register(ExpenseShare)
-class ExpenseShareAdmin(admin.ModelAdmin):
-    list_display = ("expense", "payee", "amount")
-    search_fields = ("expense__title", "payee__username", "payee__email")
-    list_filter = ("expense",)
+class ExpenseShareAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ("expense", "payee", "amount", "settled")
+    # An expense's __str__ shows its payer too
+    list_select_related = ("expense__payer", "payee")
+    list_filter = ("settled",)
+    autocomplete_fields = ("expense", "payee")
+    # Expense titles through the full-text index, as in ExpenseAdmin
+    search_fields = ("payee__username", "payee__email")
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            results |= queryset.filter(expense_id__in=search.get_backend().matching_ids(search_term))
+        return results, may_have_duplicates
+
+
+# -------------------------
+# Settlement Admin
+# -------------------------
+@admin.register(Settlement)
+class SettlementAdmin(LargeTableMixin, admin.ModelAdmin):
+    list_display = ("from_user", "to_user", "amount", "created_at")
+    list_select_related = ("from_user", "to_user")
+    search_fields = ("from_user__username", "to_user__username")
+
+    # Read-only: settlements must go through api.settlements, which also
+    # moves the wallets and the ledger
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,235 @@
+# api/analytics.py
+"""
+Monthly spending rollups behind the /analytics/ endpoint.
+
+Like the balance ledger, the rollups are kept up to date from signals and bulk
+writes by applying deltas. Expense rows are ``(payer_id, created_at, amount)``
+and share rows ``(payer_id, payee_id, created_at, amount)``, where
+``created_at`` is the expense's and decides the month both are counted in.
+Department totals follow a student's current department; changing it moves
+their history along (see ``move_department``).
+
+Unlike the ledger, nothing reads the rollups right after a write, so writes
+only queue their deltas as a job (see api/jobs.py) and the worker applies
+them, merged per batch. Deltas add up in any order, which is why rows may
+be created by a reversal too. A job also records each user's department,
+for users deleted before it runs; while a user's delete cascades, their
+department is the one kept by ``deleting_user()``, as their profile may
+already be gone when their shares are.
+"""
+import threading
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import jobs
+from .ledger import apply_deltas
+from .models import (
+    Student, Expense, ExpenseShare, ArchivedExpense, ArchivedExpenseShare,
+    UserMonthlySpend, DepartmentMonthlySpend, MonthlyCoSpend,
+)
+
+ROLLUP_JOB = "analytics.rollups"
+
+TOTAL_FIELDS = ("paid", "lent", "owed")
+# SQLite sums decimals as floats, which drift off the cent over many rows
+CENT = Decimal("0.01")
+
+
+def month_of(value):
+    return timezone.localtime(value).date().replace(day=1)
+
+
+def recent_months(count):
+    """The first days of the last ``count`` months, oldest first, ending with the current one."""
+    months = [month_of(timezone.now())]
+    while len(months) < count:
+        months.append((months[-1] - timedelta(days=1)).replace(day=1))
+    return months[::-1]
+
+
+def add(expenses=(), shares=()):
+    _enqueue(_deltas(expenses, shares, sign=1))
+
+
+def remove(expenses=(), shares=()):
+    _enqueue(_deltas(expenses, shares, sign=-1))
+
+
+def replace(old_expenses=(), old_shares=(), new_expenses=(), new_shares=()):
+    # An edit in one pass; an unchanged row nets out to no job at all
+    totals, pairs = _deltas(old_expenses, old_shares, sign=-1)
+    _deltas(new_expenses, new_shares, sign=1, into=(totals, pairs))
+    _enqueue((totals, pairs))
+
+
+def move_department(user_id, old_department, new_department):
+    deltas = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, Decimal("0")))
+    for month, *values in UserMonthlySpend.objects.filter(user_id=user_id).values_list("month", *TOTAL_FIELDS):
+        for field, value in zip(TOTAL_FIELDS, values):
+            deltas[old_department, month][field] -= value
+            deltas[new_department, month][field] += value
+    if deltas:
+        with transaction.atomic(savepoint=False):
+            apply_deltas(DepartmentMonthlySpend, ("department", "month"), _nonzero(deltas), create=True)
+
+
+def compute_rollups():
+    """Recompute every rollup from scratch as (users, departments, pairs) dicts of field values."""
+    users = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, Decimal("0")))
+    pairs = defaultdict(lambda: {"amount": Decimal("0"), "shares": 0})
+
+    # Archived history counts like the rest, see api/archive.py
+    for expense_model, share_model in ((Expense, ExpenseShare), (ArchivedExpense, ArchivedExpenseShare)):
+        paid = (
+            expense_model.objects.annotate(month=TruncMonth("created_at", output_field=DateField()))
+            .values_list("payer_id", "month")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        for payer_id, month, total in paid:
+            users[payer_id, month]["paid"] += total.quantize(CENT)
+
+        shares = (
+            share_model.objects.exclude(payee_id=F("expense__payer_id"))
+            .annotate(month=TruncMonth("expense__created_at", output_field=DateField()))
+            .values_list("expense__payer_id", "payee_id", "month")
+            .annotate(total=Sum("amount"), count=Count("id"))
+            .order_by()
+        )
+        for payer_id, payee_id, month, total, count in shares:
+            total = total.quantize(CENT)
+            users[payer_id, month]["lent"] += total
+            users[payee_id, month]["owed"] += total
+            for key in ((payer_id, payee_id, month), (payee_id, payer_id, month)):
+                pairs[key]["amount"] += total
+                pairs[key]["shares"] += count
+
+    departments = dict(Student.objects.values_list("user_id", "department"))
+    return users, _by_department(users, departments), pairs
+
+
+def _deltas(expenses, shares, sign, into=None):
+    totals, pairs = into or (
+        defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, Decimal("0"))),
+        defaultdict(lambda: {"amount": Decimal("0"), "shares": 0}),
+    )
+    for payer_id, created_at, amount in expenses:
+        totals[payer_id, month_of(created_at)]["paid"] += sign * Decimal(amount)
+    for payer_id, payee_id, created_at, amount in shares:
+        if payer_id == payee_id:
+            continue
+        month = month_of(created_at)
+        amount = sign * Decimal(amount)
+        totals[payer_id, month]["lent"] += amount
+        totals[payee_id, month]["owed"] += amount
+        for key in ((payer_id, payee_id, month), (payee_id, payer_id, month)):
+            pairs[key]["amount"] += amount
+            pairs[key]["shares"] += sign
+    return totals, pairs
+
+
+def _nonzero(deltas):
+    return {key: delta for key, delta in deltas.items() if any(delta.values())}
+
+
+def _by_department(users, departments=None):
+    if departments is None:
+        departments = dict(
+            Student.objects.filter(user_id__in={user_id for user_id, _ in users})
+            .values_list("user_id", "department")
+        )
+    totals = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, Decimal("0")))
+    for (user_id, month), values in users.items():
+        for field, value in values.items():
+            totals[departments.get(user_id, ""), month][field] += value
+    return totals
+
+
+# ---------------------------
+# Rollup jobs
+# ---------------------------
+
+_deleting = threading.local()
+
+
+def _deleting_departments():
+    if not hasattr(_deleting, "departments"):
+        _deleting.departments = {}
+    return _deleting.departments
+
+
+def deleting_user(user_id):
+    """Keep ``user_id``'s department for the jobs queued until ``deleted_user()``."""
+    department = Student.objects.filter(user_id=user_id).values_list("department", flat=True).first()
+    if department is not None:
+        _deleting_departments()[user_id] = department
+
+
+def deleted_user(user_id):
+    _deleting_departments().pop(user_id, None)
+
+
+def _enqueue(deltas):
+    users, pairs = (_nonzero(deltas[0]), _nonzero(deltas[1]))
+    if not users and not pairs:
+        return
+    user_ids = {user_id for user_id, _ in users}
+    departments = {
+        user_id: department for user_id, department in _deleting_departments().items() if user_id in user_ids
+    }
+    departments.update(Student.objects.filter(user_id__in=user_ids).values_list("user_id", "department"))
+    jobs.enqueue(ROLLUP_JOB, {
+        "users": [
+            [user_id, month.isoformat(), *(str(values[field]) for field in TOTAL_FIELDS)]
+            for (user_id, month), values in users.items()
+        ],
+        "pairs": [
+            [user_id, other_id, month.isoformat(), str(values["amount"]), values["shares"]]
+            for (user_id, other_id, month), values in pairs.items()
+        ],
+        # Pairs rather than an object, whose keys JSON would turn into strings
+        "departments": [[user_id, department] for user_id, department in departments.items()],
+    })
+
+
+@jobs.handler(ROLLUP_JOB)
+def apply_rollups(payloads):
+    users = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, Decimal("0")))
+    pairs = defaultdict(lambda: {"amount": Decimal("0"), "shares": 0})
+    recorded = {}
+    for payload in payloads:
+        for user_id, month, *values in payload["users"]:
+            for field, value in zip(TOTAL_FIELDS, values):
+                users[user_id, date.fromisoformat(month)][field] += Decimal(value)
+        for user_id, other_id, month, amount, shares in payload["pairs"]:
+            pairs[user_id, other_id, date.fromisoformat(month)]["amount"] += Decimal(amount)
+            pairs[user_id, other_id, date.fromisoformat(month)]["shares"] += shares
+        recorded.update(payload["departments"])
+
+    user_ids = {user_id for user_id, _ in users} | {user_id for user_id, _, _ in pairs}
+    existing = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True))
+    departments = {
+        **recorded,
+        **dict(Student.objects.filter(user_id__in=user_ids).values_list("user_id", "department")),
+    }
+    with transaction.atomic(savepoint=False):
+        # A deleted user's own rows went with them; their department's did not
+        apply_deltas(
+            UserMonthlySpend, ("user_id", "month"),
+            _nonzero({key: values for key, values in users.items() if key[0] in existing}), create=True,
+        )
+        apply_deltas(
+            DepartmentMonthlySpend, ("department", "month"),
+            _nonzero(_by_department(users, departments)), create=True,
+        )
+        apply_deltas(
+            MonthlyCoSpend, ("user_id", "other_id", "month"),
+            _nonzero({key: values for key, values in pairs.items() if existing.issuperset(key[:2])}), create=True,
+        )
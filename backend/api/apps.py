@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ApiConfig(AppConfig):
@@ -6,4 +7,7 @@ class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self):
-        import api.signals 
\ No newline at end of file
+        import api.signals
+        from api import search
+
+        post_migrate.connect(search.ensure_index, sender=self) 
\ No newline at end of file
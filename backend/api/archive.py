@@ -0,0 +1,109 @@
+# api/archive.py
+"""
+Archiving: settled history moved out of the hot expense tables.
+
+An expense is archivable once it is older than ``API_ARCHIVE_AFTER_DAYS``
+and none of its shares is unsettled. ``archive()`` copies such expenses and
+their shares to ArchivedExpense and ArchivedExpenseShare under the same
+ids, and deletes them from the hot tables, ``API_ARCHIVE_BATCH_SIZE``
+expenses per short transaction so writers are never held up for long.
+
+Archiving moves rows rather than deleting them:
+
+* The ledger and analytics rollups are left alone, and their rebuilds
+  count archived rows. Settlements count archived shares as covered.
+* The delete receivers are skipped (``signals.archiving()``), so no
+  tombstone tells /sync/ clients to drop the rows, and no event is
+  published. Archived rows no longer change, and clients find them at
+  /expenses/history/ and in the export.
+* The search index triggers still drop them from search.
+
+Deleting a user deletes their archived rows too, and reverses them in the
+ledger and rollups like live ones (see api/signals.py).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from . import response_cache, signals
+from .models import ArchivedExpense, ArchivedExpenseShare, Expense, ExpenseShare
+
+HOT_TABLES = (Expense, ExpenseShare)
+
+EXPENSE_COLUMNS = ("id", "payer_id", "title", "amount", "created_at", "updated_at")
+SHARE_COLUMNS = ("id", "expense_id", "payee_id", "amount", "settled", "updated_at")
+
+
+def cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, "API_ARCHIVE_AFTER_DAYS", 365))
+
+
+def archivable(before):
+    return Expense.objects.filter(created_at__lt=before).exclude(
+        Exists(ExpenseShare.objects.filter(expense_id=OuterRef("pk"), settled=False))
+    )
+
+
+def archive(before=None, batch_size=None):
+    """Archive every expense archivable ``before`` (default: the cutoff); yields ``(expenses, shares)`` per batch."""
+    before = before or cutoff()
+    batch_size = batch_size or getattr(settings, "API_ARCHIVE_BATCH_SIZE", 500)
+    candidates = archivable(before).order_by("pk").values_list("pk", flat=True)
+    last_id = 0
+    while expense_ids := list(candidates.filter(pk__gt=last_id)[:batch_size]):
+        last_id = expense_ids[-1]
+        yield archive_batch(expense_ids, before)
+
+
+def archive_batch(expense_ids, before):
+    """Move those of ``expense_ids`` still archivable; returns ``(expenses, shares)`` moved."""
+    with transaction.atomic():
+        # Checked again now that the transaction holds the rows: a share may
+        # have been added or unsettled since they were picked. A share
+        # written concurrently waits on the lock (SQLite: the write lock)
+        # and then fails its foreign key rather than being left behind.
+        expenses = archivable(before).filter(pk__in=expense_ids)
+        if connection.features.has_select_for_update:
+            expenses = expenses.select_for_update()
+        expenses = list(expenses.values(*EXPENSE_COLUMNS))
+        if not expenses:
+            return 0, 0
+        expense_ids = [row["id"] for row in expenses]
+        shares = list(ExpenseShare.objects.filter(expense_id__in=expense_ids).values(*SHARE_COLUMNS))
+
+        ArchivedExpense.objects.bulk_create(ArchivedExpense(**row) for row in expenses)
+        ArchivedExpenseShare.objects.bulk_create(ArchivedExpenseShare(**row) for row in shares)
+        # Nothing is gone, so none of the delete receivers apply
+        with signals.archiving(expense_ids):
+            Expense.objects.filter(pk__in=expense_ids).delete()
+
+        response_cache.invalidate(
+            {*(row["payer_id"] for row in expenses), *(row["payee_id"] for row in shares)}, response_cache.EXPENSES
+        )
+    return len(expenses), len(shares)
+
+
+def table_bytes(models=HOT_TABLES):
+    """Bytes the tables of ``models`` take with their indexes, or None where the database cannot tell."""
+    tables = [model._meta.db_table for model in models]
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT SUM(pg_total_relation_size(name::regclass)) FROM unnest(%s) AS name", [tables])
+        elif connection.vendor == "sqlite":
+            # Pages freed by deletes go to the freelist for new rows; the file
+            # itself only shrinks with VACUUM
+            try:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name IN "
+                    f"(SELECT name FROM sqlite_master WHERE tbl_name IN ({', '.join(['%s'] * len(tables))}))",
+                    tables,
+                )
+            except DatabaseError:
+                return None  # built without the dbstat table
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
@@ -0,0 +1,178 @@
+"""
+Async versions of the read-heavy views, mounted instead of the sync ones when
+``API_ASYNC_VIEWS`` is on (backend/asgi.py turns it on).
+
+GET requests are authenticated, queried and cached with the async ORM and
+cache APIs, so a request waiting on I/O does not hold a worker thread.
+Responses are the same bytes the DRF views produce; every other method is
+handed to the sync view for the same URL.
+"""
+from asgiref.sync import sync_to_async
+from django.core.exceptions import PermissionDenied as DjangoPermissionDenied
+from django.db.models import Prefetch
+from django.http import Http404, StreamingHttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from backend.routers import reads_from_replica
+
+from . import events, fast_serializers, views
+from .authentication import CachedJWTAuthentication
+from .models import Student, Expense
+from .pagination import ExpenseCursorPagination
+from .renderers import JSONResponse
+from .response_cache import EXPENSES, FRIENDS, PROFILE, cached_response
+from .serializers import StudentSerializer, ExpenseSerializer
+
+
+class AsyncAPIView(View):
+    sync_view = None
+    fallback = None
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        fallback = cls.sync_view.as_view() if cls.sync_view else None
+        view = super().as_view(fallback=fallback, **initkwargs)
+        return csrf_exempt(view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method != "GET":
+            if self.fallback is None:
+                return await self.http_method_not_allowed(request, *args, **kwargs)
+            return await sync_to_async(self.fallback)(request, *args, **kwargs)
+        try:
+            await self.authenticate(request)
+            return await self.get(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(request, exc)
+
+    async def authenticate(self, request):
+        # Only IsAuthenticated views are ported, so no credentials means 401
+        result = await CachedJWTAuthentication().aauthenticate(request)
+        if result is None:
+            raise exceptions.NotAuthenticated()
+        request.user, request.auth = result
+
+    def handle_exception(self, request, exc):
+        # DRF's exception_handler, for the exceptions these views raise
+        if isinstance(exc, Http404):
+            exc = exceptions.NotFound(*exc.args)
+        elif isinstance(exc, DjangoPermissionDenied):
+            exc = exceptions.PermissionDenied(*exc.args)
+        if not isinstance(exc, exceptions.APIException):
+            raise exc
+
+        if isinstance(exc.detail, (list, dict)):
+            data = exc.detail
+        else:
+            data = {"detail": exc.detail}
+        response = JSONResponse(data, status=exc.status_code)
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response["WWW-Authenticate"] = CachedJWTAuthentication().authenticate_header(request)
+        return response
+
+
+# ---------------------------
+# Authentication / Profile
+# ---------------------------
+
+class StudentProfileView(AsyncAPIView):
+    sync_view = views.StudentProfileView
+
+    @cached_response(PROFILE)
+    @reads_from_replica
+    async def get(self, request):
+        students = Student.objects.filter(user=request.user)
+        if fast_serializers.enabled():
+            data = await fast_serializers.astudents_data(students)
+            if not data:
+                raise exceptions.PermissionDenied("Profile does not exist.")
+            return JSONResponse(data[0])
+
+        student = await (
+            students.select_related("user")
+            .prefetch_related(Prefetch("friends", queryset=Student.objects.order_by("pk")))
+            .afirst()
+        )
+        if student is None:
+            raise exceptions.PermissionDenied("Profile does not exist.")
+        return JSONResponse(StudentSerializer(student).data)
+
+
+# ---------------------------
+# Friends Management
+# ---------------------------
+
+class FriendListView(AsyncAPIView):
+    sync_view = views.FriendListView
+
+    @cached_response(FRIENDS)
+    @reads_from_replica
+    async def get(self, request):
+        friends = Student.objects.filter(friend_of__user=request.user)
+        if fast_serializers.enabled():
+            return JSONResponse(await fast_serializers.astudents_data(friends))
+        friends = friends.select_related("user").prefetch_related(
+            Prefetch("friends", queryset=Student.objects.order_by("pk"))
+        )
+        serializer = StudentSerializer([friend async for friend in friends], many=True)
+        return JSONResponse(serializer.data)
+
+
+# ---------------------------
+# Expenses
+# ---------------------------
+
+class ExpenseListCreateView(AsyncAPIView):
+    sync_view = views.ExpenseListCreateView
+
+    @cached_response(EXPENSES)
+    @reads_from_replica
+    async def get(self, request):
+        expenses = Expense.objects.visible_to(request.user)
+        paginator = ExpenseCursorPagination()
+        if fast_serializers.enabled():
+            page = await paginator.apaginate_queryset(
+                fast_serializers.expense_values(expenses), Request(request), view=self
+            )
+            return JSONResponse(paginator.get_paginated_data(fast_serializers.expenses_data(page)))
+        page = await paginator.apaginate_queryset(expenses.select_related("payer"), Request(request), view=self)
+        serializer = ExpenseSerializer(page, many=True)
+        return JSONResponse(paginator.get_paginated_data(serializer.data))
+
+
+class ExpenseDetailView(AsyncAPIView):
+    sync_view = views.ExpenseDetailView
+
+    @cached_response(EXPENSES)
+    @reads_from_replica
+    async def get(self, request, pk):
+        expense = await Expense.objects.visible_to(request.user).select_related("payer").filter(pk=pk).afirst()
+        if expense is None:
+            raise Http404("No Expense matches the given query.")
+        return JSONResponse(ExpenseSerializer(expense).data)
+
+
+# ---------------------------
+# Events
+# ---------------------------
+
+class EventStreamView(AsyncAPIView):
+    # Only mounted under ASGI: a stream holds no thread while it waits
+    http_method_names = ["get"]
+
+    async def authenticate(self, request):
+        # EventSource cannot send headers, so the access token may come in the query string
+        token = request.GET.get("token")
+        if token and "HTTP_AUTHORIZATION" not in request.META:
+            request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        await super().authenticate(request)
+
+    async def get(self, request):
+        response = StreamingHttpResponse(events.stream(request.user.pk), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"  # nginx would hold events back otherwise
+        return response
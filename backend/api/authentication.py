@@ -0,0 +1,162 @@
+# api/authentication.py
+"""
+JWT authentication that keeps the database out of the hot path.
+
+The user and their student profile are loaded together and cached for a
+short TTL (``AUTH_CACHE_TTL``), invalidated from api/signals.py whenever either
+row changes. With ``AUTH_TRUST_TOKEN_CLAIMS`` enabled, tokens carrying the
+``username`` and ``student_id`` claims are authenticated without any lookup at
+all; such users only carry ids and the username, and a deactivated account
+keeps working until its access token expires.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .instrumentation import phase
+from .models import Student
+
+
+def _cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def _ttl():
+    return getattr(settings, "AUTH_CACHE_TTL", 60)
+
+
+def _user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def _blacklist_key(jti):
+    return f"auth:blacklisted:{jti}"
+
+
+def get_cached_user(user_id):
+    """The user with ``student_profile`` already loaded, or None."""
+    key = _user_key(user_id)
+    user = _cache().get(key)
+    if user is None:
+        user = User.objects.select_related("student_profile").filter(pk=user_id).first()
+        if user is not None:
+            _cache().set(key, user, _ttl())
+    return user
+
+
+async def aget_cached_user(user_id):
+    key = _user_key(user_id)
+    user = await _cache().aget(key)
+    if user is None:
+        user = await User.objects.select_related("student_profile").filter(pk=user_id).afirst()
+        if user is not None:
+            await _cache().aset(key, user, _ttl())
+    return user
+
+
+def invalidate_user(user_id):
+    _cache().delete(_user_key(user_id))
+
+
+def mark_blacklisted(jti, exp=None):
+    # Blacklisting is permanent, so keep the flag until the token expires anyway
+    timeout = max(int(exp - timezone.now().timestamp()), 1) if exp else None
+    _cache().set(_blacklist_key(jti), True, timeout)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        with phase("auth"):
+            return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        user = self.get_trusted_user(validated_token)
+        if user is None:
+            user = self.check_user(get_cached_user(self.get_user_id(validated_token)), validated_token)
+        return user
+
+    async def aauthenticate(self, request):
+        # authenticate() for async views; only the user lookup does any I/O
+        with phase("auth"):
+            header = self.get_header(request)
+            if header is None:
+                return None
+            raw_token = self.get_raw_token(header)
+            if raw_token is None:
+                return None
+            validated_token = self.get_validated_token(raw_token)
+
+            user = self.get_trusted_user(validated_token)
+            if user is None:
+                user = self.check_user(await aget_cached_user(self.get_user_id(validated_token)), validated_token)
+            return user, validated_token
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+    def check_user(self, user, validated_token):
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
+
+    def get_trusted_user(self, validated_token):
+        if getattr(settings, "AUTH_TRUST_TOKEN_CLAIMS", False):
+            return self.get_user_from_claims(validated_token)
+        return None
+
+    def get_user_from_claims(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+            username = validated_token["username"]
+            student_id = validated_token["student_id"]
+        except KeyError:
+            return None
+
+        user = User(pk=user_id, username=username, is_active=True)
+        user._state.adding = False
+        if student_id is not None:
+            student = Student(pk=student_id)
+            student._state.adding = False
+            student.user = user  # also caches user.student_profile
+        return user
+
+
+class CachedRefreshToken(RefreshToken):
+    def check_blacklist(self):
+        jti = self.payload[api_settings.JTI_CLAIM]
+        key = _blacklist_key(jti)
+        blacklisted = _cache().get(key)
+        if blacklisted is None:
+            blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+            if blacklisted:
+                mark_blacklisted(jti, self.payload.get("exp"))
+            else:
+                # Tokens blacklisted outside this process are picked up within the TTL
+                _cache().set(key, False, _ttl())
+        if blacklisted:
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        mark_blacklisted(self.payload[api_settings.JTI_CLAIM], self.payload.get("exp"))
+        return blacklisted
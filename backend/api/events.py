@@ -0,0 +1,268 @@
+# api/events.py
+"""
+Server-sent events: expense and share changes pushed to the users they
+concern, as soon as they are committed.
+
+Signals and the bulk write paths call ``publish()``, which hands the events
+to the broker when the transaction commits. The broker carries them to every
+server process, where ``hub`` passes each one to the open streams of the
+users it names. Events only say what changed; clients fetch the rows with
+/sync/, which also catches up on whatever a client missed while it was not
+connected.
+
+The broker is picked with ``API_EVENTS_BROKER``:
+
+* ``LocalBroker``: this process only, enough for a single ASGI process.
+  Nothing is published while the process has no open stream.
+* ``CacheBroker``: through the shared cache (Redis, Memcached, ...). Events
+  go into a numbered log that one task per process polls every
+  ``API_EVENTS_POLL_INTERVAL`` seconds while it has open streams.
+
+An idle stream is a coroutine waiting on a bounded queue, plus a comment
+line every ``API_EVENTS_KEEPALIVE`` seconds so proxies keep it open. A
+stream that falls ``API_EVENTS_QUEUE_SIZE`` events behind gets a single
+``resync`` event instead.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+RESYNC = {"type": "resync"}
+KEEPALIVE = object()  # queued by a stream's timer when it has been idle
+# Seconds an announced CacheBroker event may stay unwritten before it is skipped
+MISSING_GRACE = 1.0
+
+_brokers = {}
+
+
+def _cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def get_broker():
+    path = getattr(settings, "API_EVENTS_BROKER", None)
+    if not path:
+        return None
+    if path not in _brokers:
+        _brokers[path] = import_string(path)()
+    return _brokers[path]
+
+
+def enabled():
+    """Whether events published now could reach anyone; saves building them otherwise."""
+    broker = get_broker()
+    return broker is not None and broker.active()
+
+
+def publish(messages):
+    """Send ``(user_ids, event)`` messages once the current transaction commits."""
+    broker = get_broker()
+    if broker is None:
+        return
+    messages = [
+        (sorted({user_id for user_id in user_ids if user_id is not None}), event) for user_ids, event in messages
+    ]
+    messages = [(user_ids, event) for user_ids, event in messages if user_ids]
+    if messages:
+        # A broker that is down must not fail the write
+        transaction.on_commit(partial(broker.publish, messages), robust=True)
+
+
+def share_messages(kind, shares):
+    """Messages for ``(share_id, expense_id, payer_id, payee_id)`` rows, each to its payer and payee."""
+    return [
+        ([payer_id, payee_id], {"type": f"share.{kind}", "id": share_id, "expense": expense_id})
+        for share_id, expense_id, payer_id, payee_id in shares
+    ]
+
+
+# ---------------------------
+# Streams
+# ---------------------------
+
+class Stream:
+    __slots__ = ("user_id", "loop", "queue")
+
+    def __init__(self, user_id, loop):
+        self.user_id, self.loop = user_id, loop
+        self.queue = asyncio.Queue(maxsize=getattr(settings, "API_EVENTS_QUEUE_SIZE", 100))
+
+    def put(self, event):
+        # Runs on the stream's own loop
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC
+        self.queue.put_nowait(event)
+
+    def ping(self):
+        if self.queue.empty():
+            self.queue.put_nowait(KEEPALIVE)
+
+
+class Hub:
+    """The open streams of this process, by user."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.streams = defaultdict(set)
+        self.loops = defaultdict(int)  # loop -> open streams
+
+    def __len__(self):
+        with self.lock:
+            return sum(self.loops.values())
+
+    def open(self, user_id):
+        stream = Stream(user_id, asyncio.get_running_loop())
+        with self.lock:
+            self.streams[user_id].add(stream)
+            self.loops[stream.loop] += 1
+        return stream
+
+    def close(self, stream):
+        with self.lock:
+            streams = self.streams.get(stream.user_id, set())
+            if stream not in streams:
+                return
+            streams.discard(stream)
+            if not streams:
+                del self.streams[stream.user_id]
+            self.loops[stream.loop] -= 1
+            if not self.loops[stream.loop]:
+                del self.loops[stream.loop]
+
+    def open_on(self, loop):
+        with self.lock:
+            return loop in self.loops
+
+    def deliver(self, messages):
+        """Hand events to their streams; callable from any thread."""
+        by_loop = defaultdict(list)
+        with self.lock:
+            for user_ids, event in messages:
+                for user_id in user_ids:
+                    for stream in self.streams.get(user_id, ()):
+                        by_loop[stream.loop].append((stream, event))
+        for loop, targets in by_loop.items():
+            # One wake-up per loop, however many streams it serves
+            loop.call_soon_threadsafe(_put_all, targets)
+
+
+def _put_all(targets):
+    for stream, event in targets:
+        stream.put(event)
+
+
+hub = Hub()
+
+
+async def stream(user_id):
+    """The ``text/event-stream`` body for one connection of ``user_id``."""
+    keepalive = getattr(settings, "API_EVENTS_KEEPALIVE", 15)
+    subscription = hub.open(user_id)
+    loop = subscription.loop
+    try:
+        broker = get_broker()
+        if broker is not None:
+            await broker.listen()
+        yield ": connected\n\n"
+        while True:
+            # A timer rather than asyncio.wait_for: no task per wait, and a
+            # disconnect's cancellation cannot be lost to an event that
+            # arrived at the same moment
+            timer = loop.call_later(keepalive, subscription.ping)
+            try:
+                event = await subscription.queue.get()
+            finally:
+                timer.cancel()
+            if event is KEEPALIVE:
+                yield ": keepalive\n\n"
+            else:
+                yield f"data: {json.dumps(event, separators=(',', ':'))}\n\n"
+    finally:
+        hub.close(subscription)
+
+
+# ---------------------------
+# Brokers
+# ---------------------------
+
+class LocalBroker:
+    def active(self):
+        return len(hub) > 0
+
+    def publish(self, messages):
+        hub.deliver(messages)
+
+    async def listen(self):
+        pass
+
+
+class CacheBroker:
+    SEQUENCE_KEY = "api:events:sequence"
+    EVENT_KEY = "api:events:{}"
+    EVENT_TIMEOUT = 60
+
+    def __init__(self):
+        self.pollers = {}  # loop -> polling task
+
+    def active(self):
+        return True
+
+    def publish(self, messages):
+        cache = _cache()
+        cache.add(self.SEQUENCE_KEY, 0, None)
+        last = cache.incr(self.SEQUENCE_KEY, len(messages))
+        first = last - len(messages) + 1
+        cache.set_many(
+            {self.EVENT_KEY.format(seq): message for seq, message in enumerate(messages, start=first)},
+            self.EVENT_TIMEOUT,
+        )
+
+    async def listen(self):
+        # One poller per event loop, started by its first stream. The starting
+        # position is read before the stream reports itself connected, so it
+        # gets everything published from then on.
+        loop = asyncio.get_running_loop()
+        poller = self.pollers.get(loop)
+        if poller is not None and not poller.done():
+            return
+        position = await _cache().aget(self.SEQUENCE_KEY) or 0
+        poller = self.pollers.get(loop)
+        if poller is None or poller.done():
+            self.pollers = {other: task for other, task in self.pollers.items() if not task.done()}
+            self.pollers[loop] = loop.create_task(self.poll(loop, position))
+
+    async def poll(self, loop, position):
+        cache = _cache()
+        interval = getattr(settings, "API_EVENTS_POLL_INTERVAL", 0.25)
+        missing = {}  # seq -> when first found unwritten
+        while hub.open_on(loop):
+            await asyncio.sleep(interval)
+            last = await cache.aget(self.SEQUENCE_KEY) or 0
+            if last < position:
+                position = last  # the cache was cleared
+            if last == position:
+                continue
+            found = await cache.aget_many([self.EVENT_KEY.format(seq) for seq in range(position + 1, last + 1)])
+            messages = []
+            for seq in range(position + 1, last + 1):
+                message = found.get(self.EVENT_KEY.format(seq))
+                if message is None:
+                    # Numbered by a publisher that has not written it yet, or expired
+                    if time.monotonic() - missing.setdefault(seq, time.monotonic()) < MISSING_GRACE:
+                        break
+                else:
+                    messages.append(message)
+                missing.pop(seq, None)
+                position = seq
+            if messages:
+                hub.deliver(messages)
@@ -0,0 +1,121 @@
+"""
+Streaming export of a user's full expense history as CSV or NDJSON.
+
+Expenses visible to the user are read in keyset batches on ``id`` and their
+shares in keyset batches on ``(expense_id, id)``; the two streams are merged
+as they are read, so memory stays bounded by the batch sizes however many
+rows the history holds. Archived expenses (see api/archive.py) come first,
+read the same way from their own tables. Output is yielded in chunks of
+about ``CHUNK_BYTES``.
+"""
+import csv
+import io
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+
+from . import fast_serializers
+from .models import ArchivedExpense, ArchivedExpenseShare, Expense, ExpenseShare
+from .renderers import ORJSONRenderer
+
+EXPENSE_BATCH_SIZE = 500
+SHARE_BATCH_SIZE = 2000
+CHUNK_BYTES = 64 * 1024
+
+CSV_COLUMNS = (
+    "expense_id", "title", "amount", "created_at", "payer_id", "payer_username",
+    "share_id", "payee_id", "payee_username", "share_amount", "share_settled",
+)
+NO_SHARE = ("", "", "", "", "")
+
+
+def _expense_batches(model, user):
+    expenses = fast_serializers.expense_values(model.objects.visible_to(user)).order_by("id")
+    last_id = 0
+    while batch := list(expenses.filter(id__gt=last_id)[:EXPENSE_BATCH_SIZE]):
+        yield batch
+        last_id = batch[-1]["id"]
+
+
+def _shares(model, expense_ids):
+    shares = fast_serializers.share_values(model.objects.filter(expense_id__in=expense_ids))
+    shares = shares.order_by("expense_id", "id")
+    after = Q()
+    while batch := list(shares.filter(after)[:SHARE_BATCH_SIZE]):
+        yield from batch
+        last = batch[-1]
+        after = Q(expense_id__gt=last["expense_id"]) | Q(expense_id=last["expense_id"], id__gt=last["id"])
+
+
+def history(user):
+    """Yield ("expense", data) for each expense, followed by ("share", data) for each of its shares."""
+    for expense_model, share_model in ((ArchivedExpense, ArchivedExpenseShare), (Expense, ExpenseShare)):
+        for batch in _expense_batches(expense_model, user):
+            shares = _shares(share_model, [row["id"] for row in batch])
+            share = next(shares, None)
+            for row in batch:
+                yield "expense", fast_serializers.expense_data(row)
+                while share is not None and share["expense_id"] == row["id"]:
+                    yield "share", fast_serializers.share_data(share)
+                    share = next(shares, None)
+
+
+def ndjson_chunks(user):
+    renderer = ORJSONRenderer()
+    lines, size = [], 0
+    for kind, data in history(user):
+        line = renderer.render({"type": kind, **data})
+        lines.append(line)
+        size += len(line) + 1
+        if size >= CHUNK_BYTES:
+            yield b"\n".join(lines) + b"\n"
+            lines, size = [], 0
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+def csv_chunks(user):
+    # One row per share with its expense's columns repeated; expenses without
+    # shares get a single row with the share columns left empty.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    expense, pending = None, False
+    for kind, data in history(user):
+        if kind == "expense":
+            if pending:
+                writer.writerow(expense + NO_SHARE)
+            expense = (
+                data["id"], data["title"], data["amount"], data["created_at"],
+                data["payer_id"], data["payer_username"],
+            )
+            pending = True
+        else:
+            writer.writerow(
+                expense + (data["id"], data["payee"], data["payee_username"], data["amount"], data["settled"])
+            )
+            pending = False
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if pending:
+        writer.writerow(expense + NO_SHARE)
+    yield buffer.getvalue().encode()
+
+
+async def _aiterate(chunks):
+    # Each chunk is produced in the request's thread, which keeps its database
+    # connection, while the event loop is free between chunks.
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+def streaming_content(request, chunks):
+    """``chunks`` in the form StreamingHttpResponse can stream under ``request``'s server."""
+    # Under ASGI, Django reads a sync iterator fully into memory before sending it
+    if isinstance(request, ASGIRequest):
+        return _aiterate(chunks)
+    return chunks
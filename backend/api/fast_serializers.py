@@ -0,0 +1,129 @@
+# api/fast_serializers.py
+"""
+Read-only fast path for the hot list endpoints.
+
+Rows are fetched with ``values()`` and turned into plain dicts with exactly the
+shape ExpenseSerializer, ExpenseShareSerializer and StudentSerializer produce,
+skipping per-row field binding and model instantiation. Enabled with the
+``API_FAST_READS`` setting.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Student
+
+CENTS = Decimal("0.01")
+
+EXPENSE_FIELDS = ("id", "title", "amount", "created_at", "payer_id", "payer__username")
+SHARE_FIELDS = ("id", "expense_id", "payee_id", "payee__username", "amount", "settled")
+STUDENT_FIELDS = (
+    "id", "department", "wallet_balance",
+    "user_id", "user__username", "user__email", "user__first_name", "user__last_name",
+)
+
+
+def enabled():
+    return getattr(settings, "API_FAST_READS", False)
+
+
+def _decimal(value):
+    # Same as DRF's DecimalField with decimal_places=2 and COERCE_DECIMAL_TO_STRING
+    return format(value.quantize(CENTS), "f")
+
+
+def _datetime(value):
+    # Same as DRF's DateTimeField with the default ISO 8601 output format
+    value = timezone.localtime(value).isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+# ---------------------------
+# Expense
+# ---------------------------
+
+def expense_values(queryset):
+    return queryset.values(*EXPENSE_FIELDS)
+
+
+def expense_data(row):
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "amount": _decimal(row["amount"]),
+        "created_at": _datetime(row["created_at"]),
+        "payer_id": row["payer_id"],
+        "payer_username": row["payer__username"],
+    }
+
+
+def expenses_data(rows):
+    return [expense_data(row) for row in rows]
+
+
+def share_values(queryset):
+    return queryset.values(*SHARE_FIELDS)
+
+
+def share_data(row):
+    return {
+        "id": row["id"],
+        "expense": row["expense_id"],
+        "payee": row["payee_id"],
+        "payee_username": row["payee__username"],
+        "amount": _decimal(row["amount"]),
+        "settled": row["settled"],
+    }
+
+
+def shares_data(rows):
+    return [share_data(row) for row in rows]
+
+
+# ---------------------------
+# Student
+# ---------------------------
+
+def _friend_links(rows):
+    return (
+        Student.friends.through.objects.filter(from_student_id__in=[row["id"] for row in rows])
+        .order_by("to_student_id")
+        .values_list("from_student_id", "to_student_id")
+    )
+
+
+def students_data(queryset):
+    rows = list(queryset.values(*STUDENT_FIELDS))
+    return _students(rows, _friend_links(rows))
+
+
+async def astudents_data(queryset):
+    rows = [row async for row in queryset.values(*STUDENT_FIELDS)]
+    return _students(rows, [link async for link in _friend_links(rows)])
+
+
+def _students(rows, links):
+    friends = defaultdict(list)
+    for student_id, friend_id in links:
+        friends[student_id].append(friend_id)
+
+    return [
+        {
+            "id": row["id"],
+            "user": {
+                "id": row["user_id"],
+                "username": row["user__username"],
+                "email": row["user__email"],
+                "first_name": row["user__first_name"],
+                "last_name": row["user__last_name"],
+            },
+            "department": row["department"],
+            "wallet_balance": _decimal(row["wallet_balance"]),
+            "friends": friends[row["id"]],
+        }
+        for row in rows
+    ]
@@ -0,0 +1,121 @@
+# api/friend_graph.py
+"""
+Friend lists as compact sorted id arrays, cached per student.
+
+``Student.friends`` is one-way: a student's friends are the students they
+added. Each student's friend ids are cached as the bytes of a sorted
+``array("q")``, so mutual friends and friend-of-friend suggestions are worked
+out in memory from a few cache round trips instead of self-joins over the
+through table.
+
+Entries are keyed on a per-student version token, as in api/response_cache.py:
+receivers in api/signals.py bump it when the student's friend list changes,
+and bulk writes that skip ``m2m_changed`` call ``invalidate`` themselves.
+"""
+import heapq
+import uuid
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Student
+
+Friendship = Student.friends.through
+
+# Keeps the IN list of a cache-miss query below SQLite's variable limit
+LOAD_CHUNK_SIZE = 5000
+
+
+def _cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def _version_key(student_id):
+    return f"api:friend-ids:version:{student_id}"
+
+
+def _entry_key(student_id, version):
+    return f"api:friend-ids:{student_id}:{version}"
+
+
+def _versions(student_ids):
+    cache = _cache()
+    keys = {_version_key(student_id): student_id for student_id in student_ids}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for student_id in student_ids:
+        if student_id not in versions:
+            # add(), not set(): a concurrent invalidation must win
+            cache.add(_version_key(student_id), uuid.uuid4().hex, None)
+            versions[student_id] = cache.get(_version_key(student_id))
+    return versions
+
+
+def friend_ids(student_ids):
+    """``{student_id: sorted array("q") of friend ids}`` for each of ``student_ids``."""
+    student_ids = list(dict.fromkeys(student_ids))
+    if not student_ids:
+        return {}
+    versions = _versions(student_ids)
+    keys = {_entry_key(student_id, versions[student_id]): student_id for student_id in student_ids}
+
+    adjacency = {}
+    for key, value in _cache().get_many(keys).items():
+        adjacency[keys[key]] = ids = array("q")
+        ids.frombytes(value)
+
+    missing = [student_id for student_id in student_ids if student_id not in adjacency]
+    if missing:
+        loaded = _load(missing)
+        _cache().set_many(
+            {_entry_key(student_id, versions[student_id]): ids.tobytes() for student_id, ids in loaded.items()},
+            getattr(settings, "API_FRIEND_GRAPH_TIMEOUT", 60 * 60 * 24),
+        )
+        adjacency.update(loaded)
+    return adjacency
+
+
+def _load(student_ids):
+    adjacency = {student_id: array("q") for student_id in student_ids}
+    for start in range(0, len(student_ids), LOAD_CHUNK_SIZE):
+        links = (
+            Friendship.objects.filter(from_student_id__in=student_ids[start:start + LOAD_CHUNK_SIZE])
+            .order_by("from_student_id", "to_student_id")
+            .values_list("from_student_id", "to_student_id")
+        )
+        for student_id, friend_id in links:
+            adjacency[student_id].append(friend_id)
+    return adjacency
+
+
+def invalidate(student_ids):
+    student_ids = set(student_ids)
+    if not student_ids:
+        return
+    # After commit, for the same reason as response_cache.invalidate
+    transaction.on_commit(lambda: _cache().set_many(
+        {_version_key(student_id): uuid.uuid4().hex for student_id in student_ids}, None
+    ))
+
+
+def mutual_friends(student_id, other_id):
+    """Sorted ids of the students both of them have added as friends."""
+    adjacency = friend_ids([student_id, other_id])
+    return sorted(set(adjacency[student_id]).intersection(adjacency[other_id]))
+
+
+def suggestions(student_id, limit):
+    """
+    Up to ``limit`` ``(student_id, mutual_friends)`` pairs: students that the
+    student's friends have added but the student has not, most shared friends
+    first.
+    """
+    own = friend_ids([student_id])[student_id]
+    counts = Counter()
+    for ids in friend_ids(own).values():
+        counts.update(ids)
+    for excluded in (student_id, *own):
+        counts.pop(excluded, None)
+    return heapq.nsmallest(limit, counts.items(), key=lambda item: (-item[1], item[0]))
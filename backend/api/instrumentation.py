@@ -0,0 +1,291 @@
+# api/instrumentation.py
+"""
+Per-request timing: where the time of a request went, in production.
+
+``RequestTimingMiddleware`` counts and times every query on every database
+alias, and code that wants its own line in the breakdown wraps itself in
+``phase()`` (authentication and JSON rendering do). The result goes out as a
+``Server-Timing`` header that browser dev tools understand, is logged as one
+JSON line on the ``api.requests`` logger when the request is slow, and is
+added to per-route counters.
+
+Counters are kept in process and written to the cache every
+``API_REQUEST_STATS_FLUSH`` seconds under a key per process, so the
+``request-stats`` endpoint and the ``request_stats`` command can merge all
+workers. That needs a cache shared between processes; with locmem each
+process only sees its own counters.
+
+The middleware runs sync or async, whichever the handler is, so under ASGI
+it does not force the request chain onto one thread. Queries are counted by
+a wrapper installed on each connection as it opens, which finds the request
+through a context variable: ``sync_to_async`` carries it into the threads
+that run an async view's queries.
+
+With ``API_REQUEST_TIMING`` off the middleware removes itself at startup and
+``phase()`` costs one context variable lookup.
+"""
+import copy
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger("api.requests")
+
+_current = ContextVar("api_request_timing", default=None)
+
+# Upper bounds in ms of the latency histogram kept per route
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+COUNTERS = ("requests", "errors", "slow", "total_ms", "queries", "query_ms")
+TOP_SQL = 5
+
+STATS_KEY = "api:request-stats:{}"
+PROCESSES_KEY = "api:request-stats:processes"
+STATS_TIMEOUT = 60 * 60 * 24
+
+
+def _cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+class RequestTiming:
+    """What one request spent, filled in as it runs."""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_ms = 0.0
+        self.phases = {}
+        self.sql = {}  # statement -> [count, ms]
+
+    def record(self, sql, elapsed):
+        self.queries += 1
+        self.query_ms += elapsed
+        entry = self.sql.get(sql)
+        if entry is None:
+            self.sql[sql] = [1, elapsed]
+        else:
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def add(self, name, elapsed):
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def top_sql(self, count=TOP_SQL):
+        """The statements that took longest in total; repeated ones add up."""
+        ranked = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        return [{"sql": sql, "count": calls, "ms": round(ms, 2)} for sql, (calls, ms) in ranked]
+
+    def server_timing(self, total):
+        metrics = [f'db;dur={self.query_ms:.1f};desc="{self.queries} queries"']
+        metrics += (f"{name};dur={elapsed:.1f}" for name, elapsed in self.phases.items())
+        metrics.append(f"total;dur={total:.1f}")
+        return ", ".join(metrics)
+
+
+def _time_query(execute, sql, params, many, context):
+    # The execute_wrapper of every connection, whichever thread it belongs to
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.record(sql, (time.perf_counter() - started) * 1000)
+
+
+def _install(sender=None, connection=None, **kwargs):
+    # Also sent when a closed connection reopens
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+@contextmanager
+def phase(name):
+    """Time the block as ``name`` in the current request's breakdown, if any."""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, (time.perf_counter() - started) * 1000)
+
+
+# ---------------------------
+# Per-route counters
+# ---------------------------
+
+def _empty_counters():
+    return {**dict.fromkeys(COUNTERS, 0), "max_ms": 0.0, "histogram": [0] * len(BUCKETS)}
+
+
+class RouteStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.process = f"{socket.gethostname()}:{os.getpid()}"
+        self.flushed = time.monotonic()
+
+    def record(self, route, status, total, timing, slow):
+        with self.lock:
+            counters = self.routes.get(route)
+            if counters is None:
+                counters = self.routes[route] = _empty_counters()
+            counters["requests"] += 1
+            counters["errors"] += status >= 500
+            counters["slow"] += slow
+            counters["total_ms"] += total
+            counters["max_ms"] = max(counters["max_ms"], total)
+            counters["queries"] += timing.queries
+            counters["query_ms"] += timing.query_ms
+            counters["histogram"][next(i for i, bound in enumerate(BUCKETS) if total <= bound)] += 1
+        if time.monotonic() - self.flushed >= getattr(settings, "API_REQUEST_STATS_FLUSH", 10):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            snapshot = copy.deepcopy(self.routes)
+            self.flushed = time.monotonic()
+        cache = _cache()
+        cache.set(STATS_KEY.format(self.process), snapshot, STATS_TIMEOUT)
+        processes = cache.get(PROCESSES_KEY) or []
+        if self.process not in processes:
+            cache.set(PROCESSES_KEY, [*processes, self.process], STATS_TIMEOUT)
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+        cache = _cache()
+        cache.delete_many([STATS_KEY.format(process) for process in cache.get(PROCESSES_KEY) or []])
+        cache.delete(PROCESSES_KEY)
+
+
+stats = RouteStats()
+
+
+def collect():
+    """Counters of every process, merged per route, busiest total time first."""
+    stats.flush()
+    cache = _cache()
+    keys = [STATS_KEY.format(process) for process in cache.get(PROCESSES_KEY) or []]
+    merged = {}
+    for snapshot in cache.get_many(keys).values():
+        for route, counters in snapshot.items():
+            into = merged.setdefault(route, _empty_counters())
+            for name in COUNTERS:
+                into[name] += counters[name]
+            into["max_ms"] = max(into["max_ms"], counters["max_ms"])
+            into["histogram"] = [a + b for a, b in zip(into["histogram"], counters["histogram"])]
+
+    rows = []
+    for route, counters in merged.items():
+        requests = counters["requests"]
+        rows.append({
+            "route": route,
+            "requests": requests,
+            "errors": counters["errors"],
+            "slow": counters["slow"],
+            "total_ms": round(counters["total_ms"], 1),
+            "mean_ms": round(counters["total_ms"] / requests, 2),
+            "p50_ms": _bucket_percentile(counters["histogram"], requests, 50),
+            "p95_ms": _bucket_percentile(counters["histogram"], requests, 95),
+            "max_ms": round(counters["max_ms"], 2),
+            "queries_mean": round(counters["queries"] / requests, 2),
+            "query_ms_mean": round(counters["query_ms"] / requests, 2),
+        })
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+
+def _bucket_percentile(histogram, requests, percent):
+    # The upper bound of the bucket the percentile falls in; None past the last bound
+    seen = 0
+    for bound, count in zip(BUCKETS, histogram):
+        seen += count
+        if seen * 100 >= requests * percent:
+            return bound if bound != float("inf") else None
+    return None
+
+
+# ---------------------------
+# Middleware
+# ---------------------------
+
+class RequestTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "API_REQUEST_TIMING", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        connection_created.connect(_install, dispatch_uid="api.instrumentation")
+        # Connections opened before the middleware loaded
+        for connection in connections.all(initialized_only=True):
+            _install(connection=connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, started)
+
+    def finish(self, request, response, timing, started):
+        # A streamed body is still to come; this covers producing the headers
+        total = (time.perf_counter() - started) * 1000
+
+        response["Server-Timing"] = timing.server_timing(total)
+        match = request.resolver_match
+        route = f"{request.method} /{match.route}" if match else f"{request.method} (unmatched)"
+        slow = (
+            total >= getattr(settings, "API_SLOW_REQUEST_MS", 500)
+            or timing.queries >= getattr(settings, "API_SLOW_REQUEST_QUERIES", 50)
+        )
+        if slow:
+            logger.warning(json.dumps({
+                "event": "slow_request",
+                "route": route,
+                # Not the query string: the event stream takes its token there
+                "path": request.path,
+                "status": response.status_code,
+                "user_id": getattr(getattr(request, "user", None), "pk", None),
+                "total_ms": round(total, 1),
+                "queries": timing.queries,
+                "query_ms": round(timing.query_ms, 1),
+                "phases": {name: round(elapsed, 1) for name, elapsed in timing.phases.items()},
+                "top_sql": timing.top_sql(),
+            }))
+        stats.record(route, response.status_code, total, timing, slow)
+        return response
@@ -0,0 +1,187 @@
+# api/jobs.py
+"""
+Background jobs: side effects of a write that its request need not wait for.
+
+``enqueue(kind, payload)`` adds a Job row in the caller's transaction, so a
+job becomes visible exactly when the write that queued it commits (and is
+dropped with it on rollback), and survives restarts. ``manage.py run_jobs``,
+the ``worker`` process of the Procfile, claims due jobs, oldest first, a
+batch of one kind at a time, and hands their payloads to the handler
+registered for the kind::
+
+    @jobs.handler("analytics.rollups")
+    def apply_rollups(payloads):
+        ...
+
+A batch runs in one transaction with the deletion of its jobs, so a handler
+that only writes the database takes effect exactly once. A batch that fails
+is retried job by job, each with exponential backoff, until
+``API_JOBS_MAX_ATTEMPTS``; a job that still fails is kept, no longer due,
+with its error. Claims are leases: the jobs of a worker that died become due
+again after ``API_JOBS_LEASE`` seconds.
+
+Payloads are JSON. Batches of one kind may run concurrently, so handlers must
+not depend on the order jobs were queued in.
+"""
+import random
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .models import Job
+
+_handlers = {}
+
+
+class LeaseExpired(Exception):
+    """Another worker claimed the jobs after this one's lease ran out."""
+
+
+def handler(kind):
+    """Register ``function(payloads)`` as the handler of ``kind`` jobs."""
+    def register(function):
+        _handlers[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, payload):
+    if kind not in _handlers:
+        raise ValueError(f"No handler for {kind!r} jobs.")
+    Job.objects.create(kind=kind, payload=payload)
+
+
+def batch_size():
+    return getattr(settings, "API_JOBS_BATCH_SIZE", 100)
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a job that failed its ``attempts``-th run."""
+    delay = getattr(settings, "API_JOBS_RETRY_DELAY", 5) * 2 ** (attempts - 1)
+    delay = min(delay, getattr(settings, "API_JOBS_MAX_RETRY_DELAY", 3600))
+    # Jittered, so jobs that failed together do not retry in lockstep
+    return delay * random.uniform(0.8, 1.2)
+
+
+# ---------------------------
+# Running
+# ---------------------------
+
+def claim(kinds=None, limit=None):
+    """
+    Lease up to ``limit`` due jobs of the kind of the oldest due one (among
+    ``kinds``): ``(token, kind, [(id, payload, created_at, attempts), ...])``,
+    or None when nothing is due.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        due = Job.objects.filter(run_at__lte=now).order_by("run_at", "pk")
+        if kinds is not None:
+            due = due.filter(kind__in=kinds)
+        if connection.features.has_select_for_update_skip_locked:
+            # Workers pass over each other's rows; on SQLite the IMMEDIATE
+            # transaction serializes claims instead
+            due = due.select_for_update(skip_locked=True)
+        kind = due.values_list("kind", flat=True).first()
+        if kind is None:
+            return None
+        rows = list(due.filter(kind=kind).values_list("pk", "payload", "created_at", "attempts")[:limit or batch_size()])
+        Job.objects.filter(pk__in=[row[0] for row in rows]).update(
+            claimed_by=token,
+            attempts=F("attempts") + 1,
+            run_at=now + timedelta(seconds=getattr(settings, "API_JOBS_LEASE", 300)),
+        )
+    return token, kind, [(pk, payload, created_at, attempts + 1) for pk, payload, created_at, attempts in rows]
+
+
+def run(token, kind, jobs):
+    """Run a claimed batch; returns the jobs that were done. The others are rescheduled or failed."""
+    try:
+        _run(token, kind, jobs)
+        return jobs
+    except LeaseExpired:
+        if len(jobs) == 1:
+            return []
+    except Exception as error:
+        if len(jobs) == 1:
+            _retry(token, jobs[0], error)
+            return []
+
+    # One by one, so a bad job does not hold the rest of its batch back
+    done = []
+    for job in jobs:
+        try:
+            _run(token, kind, [job])
+        except LeaseExpired:
+            continue
+        except Exception as error:
+            _retry(token, job, error)
+        else:
+            done.append(job)
+    return done
+
+
+def _run(token, kind, jobs):
+    with transaction.atomic():
+        # Deleting first also checks the lease is still ours
+        deleted, _ = Job.objects.filter(pk__in=[job[0] for job in jobs], claimed_by=token).delete()
+        if deleted != len(jobs):
+            raise LeaseExpired
+        _handlers[kind]([job[1] for job in jobs])
+
+
+def _retry(token, job, error):
+    pk, _, _, attempts = job
+    now = timezone.now()
+    if attempts >= getattr(settings, "API_JOBS_MAX_ATTEMPTS", 8):
+        changes = {"run_at": None, "failed_at": now}
+    else:
+        changes = {"run_at": now + timedelta(seconds=backoff(attempts))}
+    Job.objects.filter(pk=pk, claimed_by=token).update(
+        claimed_by="", last_error="".join(traceback.format_exception(error)), **changes
+    )
+
+
+def run_pending(kinds=None):
+    """Run every due job (of ``kinds``) in this thread; returns how many were done."""
+    done = 0
+    while (batch := claim(kinds)) is not None:
+        done += len(run(*batch))
+    return done
+
+
+def retry_failed(kinds=None):
+    """Make failed jobs (of ``kinds``) due again with fresh attempts; returns how many."""
+    failed = Job.objects.filter(run_at__isnull=True)
+    if kinds is not None:
+        failed = failed.filter(kind__in=kinds)
+    return failed.update(run_at=timezone.now(), failed_at=None, attempts=0)
+
+
+# ---------------------------
+# Queue depth
+# ---------------------------
+
+def queue_stats():
+    """Per kind: jobs queued, due now, failed for good, and the age in seconds of the oldest due one."""
+    now = timezone.now()
+    rows = (
+        Job.objects.values("kind")
+        .annotate(
+            queued=Count("pk", filter=Q(run_at__isnull=False)),
+            due=Count("pk", filter=Q(run_at__lte=now)),
+            failed=Count("pk", filter=Q(run_at__isnull=True)),
+            oldest=Min("created_at", filter=Q(run_at__lte=now)),
+        )
+        .order_by("kind")
+    )
+    return [
+        {**row, "oldest": round((now - row["oldest"]).total_seconds(), 1) if row["oldest"] else None}
+        for row in rows
+    ]
@@ -0,0 +1,127 @@
+# api/ledger.py
+"""
+Incrementally maintained balances derived from ExpenseShare rows.
+
+A share of `amount` on an expense paid by P and owed by Q means Q owes P
+`amount`. Share rows are passed around as ``(payer_id, payee_id, amount)``
+tuples so the same code serves per-row signals and bulk writes.
+
+A settlement of `amount` from Q to P (see api/settlements.py) counts like
+removing a share of `amount` that Q owed P.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from .models import ArchivedExpenseShare, ExpenseShare, PairBalance, Settlement, UserBalance
+
+# Keeps the OR-ed lookup below SQLite's expression depth limit.
+LOOKUP_CHUNK_SIZE = 200
+
+
+def add_shares(rows):
+    _apply(rows, sign=1, create=True)
+
+
+def remove_shares(rows):
+    # Rows being reversed were created when the share was added, so nothing is
+    # created here. This also keeps us from re-inserting balances for a user
+    # whose rows are being cascade-deleted.
+    _apply(rows, sign=-1, create=False)
+
+
+def add_settlements(transfers):
+    # A payment beyond the pair's own debt (see api/settlements.py) may start a row
+    _apply(((to_id, from_id, amount) for from_id, to_id, amount in transfers), sign=-1, create=True)
+
+
+def remove_settlements(transfers):
+    # Like remove_shares: only reverses rows created along the way
+    _apply(((to_id, from_id, amount) for from_id, to_id, amount in transfers), sign=1, create=False)
+
+
+def compute_balances():
+    """Recompute pair and user balances from scratch."""
+    pairs = defaultdict(Decimal)
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    rows = [
+        # Archived shares still count, see api/archive.py
+        row
+        for model in (ExpenseShare, ArchivedExpenseShare)
+        for row in (
+            model.objects.exclude(payee_id=F("expense__payer_id"))
+            .values_list("expense__payer_id", "payee_id")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+    ]
+    settlements = (
+        Settlement.objects.values_list("to_user_id", "from_user_id")
+        .annotate(total=-Sum("amount"))
+        .order_by()
+    )
+    for payer_id, payee_id, total in (*rows, *settlements):
+        pairs[payer_id, payee_id] += total
+        pairs[payee_id, payer_id] -= total
+        totals[payer_id][0] += total
+        totals[payee_id][1] += total
+    return pairs, totals
+
+
+def _apply(rows, sign, create):
+    pair_deltas = defaultdict(Decimal)
+    user_deltas = defaultdict(lambda: {"lent": Decimal("0"), "borrowed": Decimal("0")})
+    for payer_id, payee_id, amount in rows:
+        if payer_id == payee_id:
+            continue
+        amount = sign * Decimal(amount)
+        pair_deltas[payer_id, payee_id] += amount
+        pair_deltas[payee_id, payer_id] -= amount
+        user_deltas[payer_id]["lent"] += amount
+        user_deltas[payee_id]["borrowed"] += amount
+
+    if not pair_deltas:
+        return
+
+    with transaction.atomic():
+        apply_deltas(
+            PairBalance,
+            ("user_id", "other_id"),
+            {key: {"amount": delta} for key, delta in pair_deltas.items()},
+            create,
+        )
+        apply_deltas(
+            UserBalance,
+            ("user_id",),
+            {(key,): delta for key, delta in user_deltas.items()},
+            create,
+        )
+
+
+def apply_deltas(model, key_fields, deltas, create):
+    # Ensure rows exist, lock them, then write the new values back in a single
+    # bulk_update: a constant number of queries however many pairs changed.
+    if create:
+        model.objects.bulk_create(
+            [model(**dict(zip(key_fields, key))) for key in deltas],
+            ignore_conflicts=True,
+        )
+
+    keys = list(deltas)
+    changed = []
+    update_fields = set()
+    for start in range(0, len(keys), LOOKUP_CHUNK_SIZE):
+        condition = Q()
+        for key in keys[start:start + LOOKUP_CHUNK_SIZE]:
+            condition |= Q(**dict(zip(key_fields, key)))
+        for row in model.objects.select_for_update().filter(condition).order_by("pk"):
+            key = tuple(getattr(row, field) for field in key_fields)
+            for field, delta in deltas[key].items():
+                setattr(row, field, getattr(row, field) + delta)
+                update_fields.add(field)
+            changed.append(row)
+
+    if changed:
+        model.objects.bulk_update(changed, sorted(update_fields))
@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api import archive
+
+
+def _megabytes(size):
+    return f"{size / 1024 / 1024:.1f} MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Move settled expenses older than API_ARCHIVE_AFTER_DAYS, with their shares, to the archive tables "
+        "in short batches (see api/archive.py). Reports the rows moved and the space freed in the hot tables."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than", type=int, default=settings.API_ARCHIVE_AFTER_DAYS, metavar="DAYS",
+            help="Archive settled expenses created more than this many days ago.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.API_ARCHIVE_BATCH_SIZE, help="Expenses per transaction."
+        )
+        parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived.")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options["older_than"])
+        if options["dry_run"]:
+            self.stdout.write(f"{archive.archivable(before).count()} expense(s) would be archived.")
+            return
+
+        size_before = archive.table_bytes()
+        started = time.perf_counter()
+        expenses = shares = batches = 0
+        for moved_expenses, moved_shares in archive.archive(before, options["batch_size"]):
+            expenses += moved_expenses
+            shares += moved_shares
+            batches += 1
+            if options["verbosity"] > 1:
+                self.stdout.write(f"batch {batches}: {moved_expenses} expense(s), {moved_shares} share(s)")
+            if options["pause"]:
+                time.sleep(options["pause"])
+        size_after = archive.table_bytes()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {expenses} expense(s) and {shares} share(s) in {batches} batch(es) "
+            f"({time.perf_counter() - started:.1f} s)."
+        ))
+        if size_before is not None and size_after is not None:
+            self.stdout.write(
+                f"Hot tables: {_megabytes(size_before)} -> {_megabytes(size_after)}, "
+                f"{_megabytes(size_before - size_after)} freed for new rows."
+            )
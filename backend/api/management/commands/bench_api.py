@@ -0,0 +1,409 @@
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+
+from api import sync, urls
+from api.authentication import CachedRefreshToken
+from api.models import Student, Expense, ExpenseShare, PairBalance
+
+# Every (route name, method) driven, in order: routes that create something
+# come before the ones that delete it again
+ROUTES = (
+    ("register", "POST"),
+    ("login", "POST"),
+    ("token-refresh", "POST"),
+    ("logout", "POST"),
+    ("profile", "GET"),
+    ("profile-update", "PATCH"),
+    ("friend-list", "GET"),
+    ("friend-add", "POST"),
+    ("friend-remove", "DELETE"),
+    ("friend-add-batch", "POST"),
+    ("friend-remove-batch", "POST"),
+    ("friend-mutual", "GET"),
+    ("friend-suggestions", "GET"),
+    ("expense-list-create", "GET"),
+    ("expense-list-create", "POST"),
+    ("expense-bulk-create", "POST"),
+    ("expense-search", "GET"),
+    ("expense-export", "GET"),
+    ("expense-history", "GET"),
+    ("expense-detail", "GET"),
+    ("expense-detail", "PATCH"),
+    ("expense-detail", "DELETE"),
+    ("expense-split", "PUT"),
+    ("expense-share-list-create", "GET"),
+    ("expense-share-list-create", "POST"),
+    ("expense-share-detail", "GET"),
+    ("expense-share-detail", "PATCH"),
+    ("balances", "GET"),
+    ("balances-settle-up", "GET"),
+    ("settlement-list-create", "GET"),
+    ("settlement-list-create", "POST"),
+    ("settlement-batch", "POST"),
+    ("analytics", "GET"),
+    ("sync", "GET"),
+)
+# Not driven: staff-only stats, and the event stream, which never completes
+SKIPPED_ROUTES = ("request-stats", "events")
+SEARCH_TERMS = ("pizza", "rent", "taxi dinner", "coff", "trip hotel", "gro")
+
+
+def _percentile(timings, percent):
+    return timings[min(int(len(timings) * percent / 100), len(timings) - 1)]
+
+
+class Session:
+    """One authenticated client, with the ids its requests are built from."""
+
+    def __init__(self, user, password, rng, strangers):
+        self.user, self.password, self.rng = user, password, rng
+        self.client = Client()
+        self.headers = {"authorization": f"Bearer {CachedRefreshToken.for_user(user).access_token}"}
+        student = user.student_profile
+        self.friends = list(student.friends.values_list("pk", "user_id", "user__username"))
+        self.strangers = [row for row in strangers if row[1] != user.pk and row not in self.friends]
+        self.expense_ids = list(Expense.objects.filter(payer=user).order_by("-id").values_list("pk", flat=True)[:100])
+        self.share_ids = list(
+            ExpenseShare.objects.filter(expense__payer=user).order_by("-id").values_list("pk", flat=True)[:100]
+        )
+        # Settlements only pay back what the user owes
+        self.creditors = list(
+            PairBalance.objects.filter(other=user, amount__gte=1)
+            .order_by("-amount").values_list("user_id", flat=True)[:5]
+        )
+        self.added_friends, self.created_expenses = [], []
+        # As if the client last synced a day ago
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+        self.sync_cursor = sync.encode_cursor(dict.fromkeys(sync.STREAMS, (yesterday, 0)))
+
+    def request(self, name, method):
+        """Send one request; returns (milliseconds, queries, error or None)."""
+        path, body = getattr(self, f"{name}_{method}".replace("-", "_").lower())()
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            response = self.client.generic(
+                method, path, json.dumps(body) if body is not None else "",
+                content_type="application/json", headers=self.headers,
+            )
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            elapsed = (time.perf_counter() - started) * 1000
+
+        if response.status_code >= 400:
+            return elapsed, queries, f"{response.status_code} {response.content[:200].decode(errors='replace')}"
+        self.record(name, method, response)
+        return elapsed, queries, None
+
+    def record(self, name, method, response):
+        if (name, method) == ("expense-list-create", "POST"):
+            self.created_expenses.append(response.json()["id"])
+        elif (name, method) == ("sync", "GET"):
+            self.sync_cursor = response.json()["cursor"]
+
+    # Requests, as (path, JSON body)
+
+    def register_post(self):
+        username = f"bench-{uuid.uuid4().hex[:12]}"
+        return reverse("register"), {"username": username, "email": "", "password": f"Bench-{uuid.uuid4().hex}"}
+
+    def login_post(self):
+        return reverse("login"), {"username": self.user.username, "password": self.password}
+
+    def token_refresh_post(self):
+        return reverse("token-refresh"), {"refresh": str(CachedRefreshToken.for_user(self.user))}
+
+    def logout_post(self):
+        return reverse("logout"), {"refresh": str(CachedRefreshToken.for_user(self.user))}
+
+    def profile_get(self):
+        return reverse("profile"), None
+
+    def profile_update_patch(self):
+        return reverse("profile-update"), {"first_name": self.rng.choice(("Ada", "Alan", "Grace", "Edsger"))}
+
+    def friend_list_get(self):
+        return reverse("friend-list"), None
+
+    def friend_add_post(self):
+        stranger = self.strangers.pop()
+        self.added_friends.append(stranger)
+        return reverse("friend-add"), {"username": stranger[2]}
+
+    def friend_remove_delete(self):
+        student_id, _, _ = self.added_friends.pop()
+        return reverse("friend-remove", args=[student_id]), None
+
+    def friend_add_batch_post(self):
+        return reverse("friend-add-batch"), {"usernames": [row[2] for row in self.strangers[-20:]]}
+
+    def friend_remove_batch_post(self):
+        return reverse("friend-remove-batch"), {"usernames": [row[2] for row in self.strangers[-20:]]}
+
+    def friend_mutual_get(self):
+        return reverse("friend-mutual", args=[self.rng.choice(self.friends)[0]]), None
+
+    def friend_suggestions_get(self):
+        return reverse("friend-suggestions"), None
+
+    def expense_list_create_get(self):
+        return reverse("expense-list-create"), None
+
+    def expense_list_create_post(self):
+        return reverse("expense-list-create"), {"title": "bench lunch", "amount": "12.50"}
+
+    def expense_bulk_create_post(self):
+        payees = self.rng.sample(self.friends, min(3, len(self.friends)))
+        return reverse("expense-bulk-create"), {
+            "title": "bench dinner",
+            "amount": "40.00",
+            "shares": [{"payee": user_id, "amount": "10.00"} for _, user_id, _ in payees],
+        }
+
+    def expense_search_get(self):
+        return f"{reverse('expense-search')}?{urlencode({'q': self.rng.choice(SEARCH_TERMS)})}", None
+
+    def expense_export_get(self):
+        return reverse("expense-export", args=["csv"]), None
+
+    def expense_history_get(self):
+        return reverse("expense-history"), None
+
+    def expense_detail_get(self):
+        return reverse("expense-detail", args=[self.rng.choice(self.expense_ids)]), None
+
+    def expense_detail_patch(self):
+        return reverse("expense-detail", args=[self.rng.choice(self.expense_ids)]), {"title": "bench edited"}
+
+    def expense_detail_delete(self):
+        return reverse("expense-detail", args=[self.created_expenses.pop()]), None
+
+    def expense_split_put(self):
+        payees = self.rng.sample(self.friends, min(3, len(self.friends)))
+        return reverse("expense-split", args=[self.rng.choice(self.expense_ids)]), {
+            "strategy": "weighted",
+            "shares": [{"payee": user_id, "value": self.rng.randint(1, 3)} for _, user_id, _ in payees],
+        }
+
+    def expense_share_list_create_get(self):
+        return reverse("expense-share-list-create", args=[self.rng.choice(self.expense_ids)]), None
+
+    def expense_share_list_create_post(self):
+        return reverse("expense-share-list-create", args=[self.rng.choice(self.expense_ids)]), {
+            "payee": self.rng.choice(self.friends)[1], "amount": "0.50",
+        }
+
+    def expense_share_detail_get(self):
+        return reverse("expense-share-detail", args=[self.rng.choice(self.share_ids)]), None
+
+    def expense_share_detail_patch(self):
+        return reverse("expense-share-detail", args=[self.rng.choice(self.share_ids)]), {"amount": "1.00"}
+
+    def balances_get(self):
+        return reverse("balances"), None
+
+    def balances_settle_up_get(self):
+        return reverse("balances-settle-up"), None
+
+    def settlement_list_create_get(self):
+        return reverse("settlement-list-create"), None
+
+    def settlement_list_create_post(self):
+        return reverse("settlement-list-create"), {"to_user": self.rng.choice(self.creditors), "amount": "0.01"}
+
+    def settlement_batch_post(self):
+        return reverse("settlement-batch"), {
+            "transfers": [{"to_user": user_id, "amount": "0.01"} for user_id in self.creditors],
+        }
+
+    def analytics_get(self):
+        return reverse("analytics"), None
+
+    def sync_get(self):
+        return f"{reverse('sync')}?{urlencode({'since': self.sync_cursor})}", None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every API route in-process with concurrent authenticated clients and report latency "
+        "percentiles, throughput and queries per request. Run it against a database filled by seed_data: "
+        "it writes (registers users, adds expenses, settles debts). Use --output to save the results as "
+        "JSON and --baseline to compare with an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients, each its own user.")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per route, spread over the clients.")
+        parser.add_argument("--warmup", type=int, default=1, help="Untimed GET requests per client and route first.")
+        parser.add_argument("--route", action="append", dest="routes", help="Only this route name; repeat for more.")
+        parser.add_argument("--read-only", action="store_true", help="Only drive GET routes.")
+        parser.add_argument("--prefix", default="seed-", help="Username prefix of the seeded students.")
+        parser.add_argument("--password", default="password", help="Password of the seeded students.")
+        parser.add_argument("--output", help="Write the results to this JSON file.")
+        parser.add_argument("--baseline", help="Compare with the results of an earlier run.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        routes = [
+            (name, method) for name, method in ROUTES
+            if (not options["routes"] or name in options["routes"]) and (method == "GET" or not options["read_only"])
+        ]
+        uncovered = {pattern.name for pattern in urls.urlpatterns} - {name for name, _ in ROUTES} - set(SKIPPED_ROUTES)
+        if uncovered:
+            self.stderr.write(f"No requests defined for route(s): {', '.join(sorted(uncovered))}")
+        if not routes:
+            raise CommandError("No routes selected.")
+
+        sessions = self.sessions(rng, options)
+        per_client = max(1, options["requests"] // len(sessions))
+        self.stdout.write(
+            f"clients={len(sessions)} requests/route={per_client * len(sessions)} "
+            f"database={connection.vendor} users={User.objects.count()} expenses={Expense.objects.count()}"
+        )
+        self.stdout.write(
+            f"{'route':<28}{'method':<8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'errors':>8}"
+        )
+
+        results = []
+        for name, method in routes:
+            if method == "GET" and options["warmup"]:
+                self.drive(sessions, name, method, options["warmup"])
+            elapsed, samples = self.drive(sessions, name, method, per_client)
+            results.append(self.summarize(name, method, elapsed, samples))
+            self.write_row(results[-1])
+
+        report = {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "database": connection.vendor,
+            "settings": {"API_RESPONSE_CACHE": settings.API_RESPONSE_CACHE, "API_FAST_READS": settings.API_FAST_READS},
+            "clients": len(sessions),
+            "requests_per_route": per_client * len(sessions),
+            "routes": results,
+        }
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2) + "\n")
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["baseline"]:
+            self.compare(json.loads(Path(options["baseline"]).read_text()), results)
+
+    def sessions(self, rng, options):
+        candidates = list(
+            User.objects.filter(username__startswith=options["prefix"], student_profile__friends__isnull=False)
+            .filter(pk__in=Expense.objects.values("payer_id"))
+            .filter(pk__in=ExpenseShare.objects.values("expense__payer_id"))
+            .filter(pk__in=PairBalance.objects.filter(amount__gte=1).values("other_id"))
+            .distinct().order_by("pk").values_list("pk", flat=True)[:10_000]
+        )
+        if len(candidates) < options["concurrency"]:
+            raise CommandError(
+                f"Need {options['concurrency']} {options['prefix']}* students with friends, expenses, shares and debts; "
+                f"found {len(candidates)}. Run seed_data first."
+            )
+        users = User.objects.select_related("student_profile").in_bulk(rng.sample(candidates, options["concurrency"]))
+        strangers = list(
+            Student.objects.filter(user__username__startswith=options["prefix"])
+            .order_by("?").values_list("pk", "user_id", "user__username")[:200 + options["requests"]]
+        )
+        return [
+            Session(user, options["password"], random.Random(rng.random()), rng.sample(strangers, len(strangers)))
+            for user in users.values()
+        ]
+
+    def drive(self, sessions, name, method, count):
+        samples = [[] for _ in sessions]
+
+        def client(session, out):
+            for _ in range(count):
+                out.append(session.request(name, method))
+
+        started = time.perf_counter()
+        if len(sessions) == 1:
+            client(sessions[0], samples[0])
+        else:
+            threads = [threading.Thread(target=self.in_thread, args=(client, session, out))
+                       for session, out in zip(sessions, samples)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return time.perf_counter() - started, [sample for out in samples for sample in out]
+
+    def in_thread(self, client, session, out):
+        try:
+            client(session, out)
+        finally:
+            connections.close_all()
+
+    def summarize(self, name, method, elapsed, samples):
+        errors = [error for _, _, error in samples if error]
+        timings = sorted(ms for ms, _, error in samples if not error)
+        queries = [count for _, count, error in samples if not error]
+        result = {
+            "route": name,
+            "method": method,
+            "path": str(next(pattern.pattern for pattern in urls.urlpatterns if pattern.name == name)),
+            "requests": len(samples),
+            "errors": len(errors),
+            "throughput": round(len(timings) / elapsed, 1),
+        }
+        if timings:
+            result.update({
+                "mean_ms": round(sum(timings) / len(timings), 2),
+                "p50_ms": round(_percentile(timings, 50), 2),
+                "p95_ms": round(_percentile(timings, 95), 2),
+                "p99_ms": round(_percentile(timings, 99), 2),
+                "max_ms": round(timings[-1], 2),
+                "queries_mean": round(sum(queries) / len(queries), 2),
+                "queries_max": max(queries),
+            })
+        if errors:
+            result["first_error"] = errors[0]
+        return result
+
+    def write_row(self, result):
+        if "p50_ms" not in result:
+            self.stdout.write(
+                f"{result['route']:<28}{result['method']:<8}{'all requests failed':>44}{result['errors']:>8}"
+            )
+        else:
+            self.stdout.write(
+                f"{result['route']:<28}{result['method']:<8}{result['throughput']:>8.0f}{result['p50_ms']:>9.1f}"
+                f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['queries_mean']:>9.1f}{result['errors']:>8}"
+            )
+        if result["errors"] and self.verbosity > 1:
+            self.stdout.write(f"  first error: {result['first_error']}")
+
+    def compare(self, baseline, results):
+        before = {(row["route"], row["method"]): row for row in baseline["routes"]}
+        self.stdout.write(f"\nAgainst the baseline from {baseline.get('started_at', '?')}:")
+        self.stdout.write(f"{'route':<28}{'method':<8}{'p95 ms':>18}{'change':>9}{'queries':>14}")
+        for result in results:
+            old = before.get((result["route"], result["method"]))
+            if not old or "p95_ms" not in old or "p95_ms" not in result:
+                continue
+            change = (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100 if old["p95_ms"] else 0
+            self.stdout.write(
+                f"{result['route']:<28}{result['method']:<8}{old['p95_ms']:>8.1f} -> {result['p95_ms']:<6.1f}"
+                f"{change:>+8.0f}%{old['queries_mean']:>6.1f} -> {result['queries_mean']:<5.1f}"
+            )
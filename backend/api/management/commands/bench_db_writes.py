@@ -0,0 +1,85 @@
+import sqlite3
+import tempfile
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from backend.db import SQLITE_BUSY_TIMEOUT, SQLITE_PRAGMAS
+
+SCHEMA = (
+    "CREATE TABLE balance (id INTEGER PRIMARY KEY, amount INTEGER NOT NULL)",
+    "CREATE TABLE expense (id INTEGER PRIMARY KEY, payer INTEGER NOT NULL, amount INTEGER NOT NULL)",
+)
+
+
+def _connect(path, tuned):
+    if not tuned:
+        # What Django used before backend/db.py: rollback journal, deferred
+        # transactions and sqlite3's 5 second default timeout.
+        return sqlite3.connect(path, isolation_level=None)
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _worker(args):
+    path, tuned, worker, transactions = args
+    conn = _connect(path, tuned)
+    committed = failed = 0
+    for i in range(transactions):
+        try:
+            # The shape of an expense write: insert, then read-modify-write a
+            # balance row, like the ledger does.
+            conn.execute("BEGIN IMMEDIATE" if tuned else "BEGIN")
+            conn.execute("INSERT INTO expense (payer, amount) VALUES (?, ?)", (worker, i))
+            (amount,) = conn.execute("SELECT amount FROM balance WHERE id = ?", (i % 10,)).fetchone()
+            conn.execute("UPDATE balance SET amount = ? WHERE id = ?", (amount + 1, i % 10))
+            conn.execute("COMMIT")
+            committed += 1
+        except sqlite3.OperationalError:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            failed += 1
+    conn.close()
+    return committed, failed
+
+
+class Command(BaseCommand):
+    help = "Measure concurrent SQLite write throughput with and without the tuning in backend/db.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent writer processes.")
+        parser.add_argument("--transactions", type=int, default=500, help="Transactions per worker.")
+
+    def handle(self, *args, **options):
+        workers, transactions = options["workers"], options["transactions"]
+        self.stdout.write(f"{workers} writer process(es) x {transactions} transaction(s)")
+        for tuned in (False, True):
+            with tempfile.TemporaryDirectory() as directory:
+                path = str(Path(directory) / "bench.sqlite3")
+                conn = _connect(path, tuned)
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                conn.executemany("INSERT INTO balance (id, amount) VALUES (?, 0)", [(i,) for i in range(10)])
+                conn.close()
+
+                started = time.perf_counter()
+                with Pool(workers) as pool:
+                    results = pool.map(_worker, [(path, tuned, w, transactions) for w in range(workers)])
+                elapsed = time.perf_counter() - started
+
+                committed = sum(result[0] for result in results)
+                failed = sum(result[1] for result in results)
+                conn = _connect(path, tuned)
+                (total,) = conn.execute("SELECT SUM(amount) FROM balance").fetchone()
+                conn.close()
+
+            label = "tuned (WAL, IMMEDIATE, busy timeout)" if tuned else "before (defaults)"
+            self.stdout.write(
+                f"{label:38} {committed / elapsed:8.0f} commits/s  "
+                f"{failed} failed with 'database is locked'  "
+                f"balance total {total} (expected {committed})"
+            )
@@ -0,0 +1,58 @@
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import export
+from api.models import Expense, ExpenseShare
+
+SEED_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = "Stream the CSV and NDJSON exports of a user with many share rows and report throughput and peak memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shares", type=int, default=1_000_000)
+        parser.add_argument("--expenses", type=int, default=2000)
+        parser.add_argument("--payees", type=int, default=100)
+
+    def handle(self, *args, **options):
+        shares, expenses = options["shares"], options["expenses"]
+
+        # Seed inside a transaction that is rolled back, leaving the database untouched
+        with transaction.atomic():
+            payer = User.objects.create_user("bench-export-payer")
+            payees = User.objects.bulk_create(
+                User(username=f"bench-export-payee-{i}") for i in range(options["payees"])
+            )
+            created = Expense.objects.bulk_create(
+                Expense(payer=payer, title=f"Expense {i}", amount=1000) for i in range(expenses)
+            )
+            for start in range(0, shares, SEED_BATCH_SIZE):
+                ExpenseShare.objects.bulk_create(
+                    ExpenseShare(
+                        expense=created[i % expenses], payee=payees[i % len(payees)], amount=i % 97 + 0.5
+                    )
+                    for i in range(start, min(start + SEED_BATCH_SIZE, shares))
+                )
+            self.stdout.write(f"expenses={expenses} shares={shares}")
+
+            for name, chunks in (("csv", export.csv_chunks), ("ndjson", export.ndjson_chunks)):
+                started = time.perf_counter()
+                size = sum(len(chunk) for chunk in chunks(payer))
+                elapsed = time.perf_counter() - started
+
+                tracemalloc.start()
+                for _ in chunks(payer):
+                    pass
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+                self.stdout.write(
+                    f"{name:<7} {size / 2**20:8.1f} MiB  {elapsed:6.1f} s  "
+                    f"{(expenses + shares) / elapsed:9.0f} rows/s  peak Python memory {peak / 2**20:6.2f} MiB"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,121 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+
+from api import friend_graph
+from api.models import Student
+
+Friendship = Student.friends.through
+SEED_BATCH_SIZE = 20000
+BENCH_CACHE = "bench-friends"
+
+
+class Command(BaseCommand):
+    help = "Compare mutual friends and friend suggestions from SQL with the cached friend graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--students", type=int, default=100_000)
+        parser.add_argument("--friends", type=int, default=20, help="Friends added per student.")
+        parser.add_argument("--community", type=int, default=500, help="Students per tightly knit group.")
+        parser.add_argument("--samples", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        count, community = options["students"], options["community"]
+
+        # A private cache, so benchmark ids never leak into the real one
+        caches_setting = {BENCH_CACHE: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": BENCH_CACHE,
+            "OPTIONS": {"MAX_ENTRIES": 4 * count},
+        }}
+        with override_settings(CACHES=caches_setting, API_CACHE_ALIAS=BENCH_CACHE), transaction.atomic():
+            started = time.perf_counter()
+            users = []
+            for start in range(0, count, SEED_BATCH_SIZE):
+                users += User.objects.bulk_create(
+                    User(username=f"bench-friends-{i}") for i in range(start, min(start + SEED_BATCH_SIZE, count))
+                )
+            students = Student.objects.bulk_create(
+                (Student(user=user, department="Bench") for user in users), batch_size=SEED_BATCH_SIZE
+            )
+            ids = [student.pk for student in students]
+
+            # Mostly friends within one's own group, some anywhere
+            links, total = [], 0
+            for index, student_id in enumerate(ids):
+                group = index - index % community
+                for _ in range(options["friends"]):
+                    if rng.random() < 0.8:
+                        friend = ids[min(group + rng.randrange(community), count - 1)]
+                    else:
+                        friend = rng.choice(ids)
+                    if friend != student_id:
+                        links.append(Friendship(from_student_id=student_id, to_student_id=friend))
+                if len(links) >= SEED_BATCH_SIZE or index == count - 1:
+                    Friendship.objects.bulk_create(links, ignore_conflicts=True)
+                    links, total = [], total + len(links)
+            self.stdout.write(
+                f"students={count} friendships={total} (seeded in {time.perf_counter() - started:.1f} s)"
+            )
+
+            # Pairs from the same group, which do have friends in common
+            pairs = []
+            for _ in range(options["samples"]):
+                index = rng.randrange(count)
+                other = min(index - index % community + rng.randrange(community), count - 1)
+                pairs.append((ids[index], ids[other]))
+
+            rows = []
+            for label, mutual, suggest in (
+                ("sql", self.sql_mutual, self.sql_suggestions),
+                ("cache, cold", friend_graph.mutual_friends, friend_graph.suggestions),
+                ("cache, warm", friend_graph.mutual_friends, friend_graph.suggestions),
+            ):
+                if label == "cache, cold":
+                    caches[BENCH_CACHE].clear()
+                started = time.perf_counter()
+                mutual_results = [mutual(a, b) for a, b in pairs]
+                mutual_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+                if label == "cache, cold":
+                    caches[BENCH_CACHE].clear()
+                started = time.perf_counter()
+                suggestion_results = [suggest(a, 20) for a, _ in pairs]
+                suggestion_ms = (time.perf_counter() - started) * 1000 / len(pairs)
+                rows.append((label, mutual_ms, suggestion_ms, mutual_results, suggestion_results))
+
+            self.stdout.write(f"{'':<14}{'mutual friends':>18}{'suggestions':>18}")
+            for label, mutual_ms, suggestion_ms, *_ in rows:
+                self.stdout.write(f"{label:<14}{mutual_ms:>15.2f} ms{suggestion_ms:>15.2f} ms")
+            if any(row[3:] != rows[0][3:] for row in rows):
+                self.stderr.write(self.style.ERROR("The cached graph disagrees with SQL."))
+            transaction.set_rollback(True)
+
+    def sql_mutual(self, student_id, other_id):
+        return list(
+            Friendship.objects.filter(
+                from_student_id=student_id,
+                to_student_id__in=Friendship.objects.filter(from_student_id=other_id).values("to_student_id"),
+            )
+            .order_by("to_student_id")
+            .values_list("to_student_id", flat=True)
+        )
+
+    def sql_suggestions(self, student_id, limit):
+        own = Friendship.objects.filter(from_student_id=student_id).values("to_student_id")
+        return list(
+            Friendship.objects.filter(from_student_id__in=own)
+            .exclude(to_student_id__in=own)
+            .exclude(to_student_id=student_id)
+            .values("to_student_id")
+            .annotate(mutual=Count("id"))
+            .order_by("-mutual", "to_student_id")
+            .values_list("to_student_id", "mutual")[:limit]
+        )
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _percentile(timings, percent):
+    return timings[min(int(len(timings) * percent / 100), len(timings) - 1)]
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while size := int((await reader.readline()).split(b";")[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    elif "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif status not in (204, 304):
+        await reader.read()
+        headers["connection"] = "close"
+    return status, headers.get("connection", "").lower() != "close"
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test GET endpoints on running servers, e.g. gunicorn with sync workers "
+        "(WSGI) against gunicorn with uvicorn workers (ASGI), and report requests/s "
+        "and latency percentiles for each."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "targets", nargs="+", metavar="NAME=URL",
+            help="Servers to compare, e.g. wsgi=http://127.0.0.1:8000 asgi=http://127.0.0.1:8001",
+        )
+        parser.add_argument("--path", action="append", dest="paths", help="Path to GET; repeat to mix (default: /api/expenses/)")
+        parser.add_argument("--concurrency", type=int, default=200)
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--warmup", type=int, default=200)
+        parser.add_argument("--token", help="Access token to send")
+        parser.add_argument("--username", help="Log in as this user to get a token")
+        parser.add_argument("--password")
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["targets"]:
+            name, sep, url = target.partition("=")
+            if not sep:
+                name, url = target, target
+            parts = urlsplit(url)
+            if parts.scheme != "http":
+                raise CommandError(f"Only plain http:// targets are supported: {url}")
+            targets.append((name, parts.hostname, parts.port or 80, parts.path.rstrip("/")))
+
+        token = options["token"] or self.login(options, targets[0])
+        paths = options["paths"] or ["/api/expenses/"]
+
+        self.stdout.write(
+            f"requests={options['requests']} concurrency={options['concurrency']} paths={', '.join(paths)}"
+        )
+        self.stdout.write(f"{'target':<12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+        for name, host, port, prefix in targets:
+            requests = [
+                f"GET {prefix}{path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                f"Authorization: Bearer {token}\r\nAccept: application/json\r\n\r\n".encode()
+                for path in paths
+            ]
+            if options["warmup"]:
+                asyncio.run(self.run(host, port, requests, options["warmup"], options["concurrency"]))
+            elapsed, timings, errors = asyncio.run(
+                self.run(host, port, requests, options["requests"], options["concurrency"])
+            )
+            if not timings:
+                self.stdout.write(f"{name:<12}{'all requests failed':>40}{errors:>8}")
+                continue
+            timings.sort()
+            self.stdout.write(
+                f"{name:<12}{len(timings) / elapsed:>10.0f}{_percentile(timings, 50):>10.1f}"
+                f"{_percentile(timings, 99):>10.1f}{timings[-1]:>10.1f}{errors:>8}"
+            )
+
+    def login(self, options, target):
+        if not options["username"]:
+            raise CommandError("Pass --token, or --username and --password to log in.")
+        _, host, port, prefix = target
+        body = json.dumps({"username": options["username"], "password": options["password"]}).encode()
+        request = Request(
+            f"http://{host}:{port}{prefix}/api/login/", body, {"Content-Type": "application/json"}
+        )
+        with urlopen(request) as response:
+            return json.load(response)["access"]
+
+    async def run(self, host, port, requests, total, concurrency):
+        remaining = iter(range(total))
+        timings = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            reader = writer = None
+            for i in remaining:
+                started = time.perf_counter()
+                try:
+                    # Sync gunicorn workers close the connection after each response
+                    if writer is None:
+                        reader, writer = await asyncio.open_connection(host, port)
+                    writer.write(requests[i % len(requests)])
+                    status, keep_alive = await _read_response(reader)
+                except (OSError, ValueError, asyncio.IncompleteReadError):
+                    errors += 1
+                    keep_alive = False
+                else:
+                    if status in (200, 304):
+                        timings.append((time.perf_counter() - started) * 1000)
+                    else:
+                        errors += 1
+                if not keep_alive and writer is not None:
+                    writer.close()
+                    reader = writer = None
+            if writer is not None:
+                writer.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - started, timings, errors
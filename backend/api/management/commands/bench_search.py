@@ -0,0 +1,73 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api import search
+from api.models import Expense
+
+WORDS = (
+    "pizza", "rent", "groceries", "taxi", "dinner", "lunch", "coffee", "books", "tickets", "concert",
+    "trip", "hotel", "fuel", "gift", "snacks", "laundry", "internet", "electricity", "movie", "gym",
+)
+SEED_BATCH_SIZE = 50000
+
+
+class Command(BaseCommand):
+    help = "Compare the full-text search backend with icontains scans over many expense titles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=2_000_000)
+        parser.add_argument("--repeat", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+        rng = random.Random(options["seed"])
+        # A long tail of rare made-up words next to a few very common ones
+        vocabulary = [*WORDS, *(f"w{rng.getrandbits(32):x}" for _ in range(50000))]
+
+        # Seed inside a transaction that is rolled back, leaving the database untouched
+        with transaction.atomic():
+            payer = User.objects.create_user("bench-search-payer")
+            started = time.perf_counter()
+            for start in range(0, rows, SEED_BATCH_SIZE):
+                Expense.objects.bulk_create(
+                    Expense(
+                        payer=payer,
+                        title=" ".join(rng.choice(WORDS if rng.random() < 0.5 else vocabulary) for _ in range(3)),
+                        amount=1,
+                    )
+                    for _ in range(start, min(start + SEED_BATCH_SIZE, rows))
+                )
+            self.stdout.write(f"rows={rows} (seeded and indexed in {time.perf_counter() - started:.1f} s)")
+
+            rare = vocabulary[len(WORDS) + 7]
+            queries = ("pizza", "pizza taxi", "conc", rare, rare[:5])
+            backends = (("index", search.get_backend()), ("icontains", search.LikeBackend()))
+            queryset = Expense.objects.filter(payer=payer)
+
+            self.stdout.write(f"{'query':<22}" + "".join(f"{name:>16}" for name, _ in backends) + f"{'matches':>10}")
+            for query in queries:
+                timings = []
+                for _, backend in backends:
+                    def first_page():
+                        # What the search view runs: a count, then the first page
+                        count = backend.filter(queryset, query).count()
+                        return count, list(backend.search(queryset, query).values_list("id", flat=True)[:20])
+                    timings.append(self.best_of(first_page, repeat))
+                count = search.LikeBackend().search(queryset, query).count()
+                self.stdout.write(
+                    f"{query:<22}" + "".join(f"{ms:>13.1f} ms" for ms in timings) + f"{count:>10}"
+                )
+            transaction.set_rollback(True)
+
+    def best_of(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings)
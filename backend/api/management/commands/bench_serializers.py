@@ -0,0 +1,57 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api import fast_serializers
+from api.models import Expense
+from api.renderers import ORJSONRenderer
+from api.serializers import ExpenseSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare ExpenseSerializer + JSONRenderer with the fast read path + ORJSONRenderer."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows, repeat = options["rows"], options["repeat"]
+
+        # Seed inside a transaction that is rolled back, leaving the database untouched
+        with transaction.atomic():
+            payer = User.objects.create_user("bench-serializers-payer")
+            Expense.objects.bulk_create(
+                Expense(payer=payer, title=f"Expense {i}", amount=i % 997 + 0.25) for i in range(rows)
+            )
+            queryset = Expense.objects.filter(payer=payer).order_by("-created_at", "-id")
+
+            def slow():
+                data = ExpenseSerializer(queryset.select_related("payer"), many=True).data
+                return JSONRenderer().render(data)
+
+            def fast():
+                data = fast_serializers.expenses_data(fast_serializers.expense_values(queryset))
+                return ORJSONRenderer().render(data)
+
+            if slow() != fast():
+                self.stderr.write(self.style.ERROR("Outputs differ."))
+            slow_ms = self.best_of(slow, repeat)
+            fast_ms = self.best_of(fast, repeat)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"rows={rows} (best of {repeat}, including the query)")
+        self.stdout.write(f"ExpenseSerializer + JSONRenderer:  {slow_ms:8.1f} ms  {slow_ms * 1000 / rows:6.2f} us/row")
+        self.stdout.write(f"fast path + ORJSONRenderer:        {fast_ms:8.1f} ms  {fast_ms * 1000 / rows:6.2f} us/row")
+        self.stdout.write(f"speedup: {slow_ms / fast_ms:.1f}x")
+
+    def best_of(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return min(timings)
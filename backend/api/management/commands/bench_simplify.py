@@ -0,0 +1,58 @@
+import random
+import time
+from array import array
+
+from django.core.management.base import BaseCommand
+
+from api.simplify import simplify
+
+
+class Command(BaseCommand):
+    help = "Benchmark debt simplification on a synthetic group of users and shares."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=5000)
+        parser.add_argument("--shares", type=int, default=300000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        users, shares = options["users"], options["shares"]
+
+        # Shares as parallel arrays, the same compact shape net_balances() hands
+        # to simplify() after the database has done the aggregation.
+        payers = array("q", (rng.randrange(users) for _ in range(shares)))
+        payees = array("q", (rng.randrange(users) for _ in range(shares)))
+        cents = array("q", (rng.randint(1, 50000) for _ in range(shares)))
+
+        started = time.perf_counter()
+        nets = array("q", bytes(8 * users))
+        for payer, payee, amount in zip(payers, payees, cents):
+            if payer != payee:
+                nets[payer] += amount
+                nets[payee] -= amount
+        aggregate_ms = (time.perf_counter() - started) * 1000
+
+        ids = array("q", range(users))
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            transfers = simplify(ids, nets)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        # Every balance must be cleared exactly by the proposed transfers
+        remaining = array("q", nets)
+        for debtor, creditor, amount in transfers:
+            remaining[debtor] += amount
+            remaining[creditor] -= amount
+        if any(remaining):
+            self.stderr.write(self.style.ERROR("Transfers do not settle every balance."))
+
+        self.stdout.write(f"users={users} shares={shares}")
+        self.stdout.write(f"in-memory aggregation: {aggregate_ms:.1f} ms (done in SQL in production)")
+        self.stdout.write(
+            f"simplify: best {min(timings):.1f} ms, mean {sum(timings) / len(timings):.1f} ms "
+            f"over {len(timings)} run(s)"
+        )
+        self.stdout.write(f"transfers: {len(transfers)} (upper bound {users - 1})")
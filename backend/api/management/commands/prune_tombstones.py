@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import sync
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete sync tombstones older than API_SYNC_TOMBSTONE_DAYS, past which /sync/ rejects "
+        "cursors anyway. Run it daily."
+    )
+
+    def handle(self, *args, **options):
+        deleted = sync.prune()
+        self.stdout.write(f"Deleted {deleted} tombstone(s) older than {settings.API_SYNC_TOMBSTONE_DAYS} days.")
@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api import ledger
+from api.models import PairBalance, UserBalance
+
+
+class Command(BaseCommand):
+    help = "Rebuild the balance ledger from expense shares, or report drift with --verify."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Only compare the stored ledger with a fresh computation; write nothing.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            pairs, totals = ledger.compute_balances()
+            drift = self.find_drift(pairs, totals)
+
+            for line in drift[:50]:
+                self.stdout.write(line)
+            if len(drift) > 50:
+                self.stdout.write(f"... and {len(drift) - 50} more")
+
+            if options["verify"]:
+                if drift:
+                    # A non-zero exit status, so cron and CI notice
+                    raise CommandError(f"Ledger drift detected in {len(drift)} row(s).")
+                self.stdout.write(self.style.SUCCESS("Ledger is consistent."))
+                return
+
+            PairBalance.objects.all().delete()
+            UserBalance.objects.all().delete()
+            PairBalance.objects.bulk_create(
+                (PairBalance(user_id=user_id, other_id=other_id, amount=amount)
+                 for (user_id, other_id), amount in pairs.items()),
+                batch_size=1000,
+            )
+            UserBalance.objects.bulk_create(
+                (UserBalance(user_id=user_id, lent=lent, borrowed=borrowed)
+                 for user_id, (lent, borrowed) in totals.items()),
+                batch_size=1000,
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt ledger: {len(pairs)} pair balance(s), {len(totals)} user total(s), "
+            f"{len(drift)} row(s) corrected."
+        ))
+
+    def find_drift(self, pairs, totals):
+        zero = Decimal("0")
+        drift = []
+
+        stored_pairs = {
+            (user_id, other_id): amount
+            for user_id, other_id, amount in PairBalance.objects.values_list("user_id", "other_id", "amount")
+        }
+        for key in sorted(set(stored_pairs) | set(pairs)):
+            expected, stored = pairs.get(key, zero), stored_pairs.get(key, zero)
+            if expected != stored:
+                drift.append(f"pair {key[0]}->{key[1]}: stored {stored}, expected {expected}")
+
+        stored_totals = {
+            user_id: (lent, borrowed)
+            for user_id, lent, borrowed in UserBalance.objects.values_list("user_id", "lent", "borrowed")
+        }
+        for user_id in sorted(set(stored_totals) | set(totals)):
+            expected = tuple(totals.get(user_id, (zero, zero)))
+            stored = stored_totals.get(user_id, (zero, zero))
+            if expected != stored:
+                drift.append(f"user {user_id}: stored lent/borrowed {stored}, expected {expected}")
+        return drift
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api import instrumentation
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the per-route request timing counters of every server process, slowest total time first. "
+        "Processes share them through the cache, so this needs a cache shared between processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the counters as JSON.")
+        parser.add_argument("--limit", type=int, default=30, help="Routes to show.")
+        parser.add_argument("--reset", action="store_true", help="Clear the counters afterwards.")
+
+    def handle(self, *args, **options):
+        rows = instrumentation.collect()[:options["limit"]]
+        if options["json"]:
+            self.stdout.write(json.dumps({"routes": rows}, indent=2))
+        elif not rows:
+            self.stdout.write("No requests recorded yet.")
+        else:
+            self.stdout.write(
+                f"{'route':<48}{'requests':>10}{'mean ms':>10}{'p95 ms':>9}{'max ms':>10}"
+                f"{'queries':>9}{'db ms':>9}{'slow':>7}{'5xx':>6}"
+            )
+            for row in rows:
+                p95 = f"<{row['p95_ms']}" if row["p95_ms"] is not None else "-"
+                self.stdout.write(
+                    f"{row['route']:<48}{row['requests']:>10}{row['mean_ms']:>10.1f}{p95:>9}{row['max_ms']:>10.1f}"
+                    f"{row['queries_mean']:>9.1f}{row['query_ms_mean']:>9.1f}{row['slow']:>7}{row['errors']:>6}"
+                )
+        if options["reset"]:
+            instrumentation.stats.reset()
+            self.stdout.write("Counters cleared.")
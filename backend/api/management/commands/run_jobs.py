@@ -0,0 +1,127 @@
+import json
+import logging
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from api import jobs
+
+logger = logging.getLogger("api.jobs")
+
+
+class Counters:
+    """Per kind, the jobs done and failed since the last report, and how long they took."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.kinds = {}
+        self.reported = time.monotonic()
+
+    def record(self, kind, claimed, done, run_ms):
+        now = timezone.now()
+        # From queued to done, retries included
+        latencies = [(now - created_at).total_seconds() * 1000 for _, _, created_at, _ in done]
+        with self.lock:
+            counters = self.kinds.setdefault(
+                kind, {"batches": 0, "done": 0, "failed": 0, "run_ms": 0.0, "latency_ms": 0.0, "max_latency_ms": 0.0}
+            )
+            counters["batches"] += 1
+            counters["done"] += len(done)
+            counters["failed"] += len(claimed) - len(done)
+            counters["run_ms"] += run_ms
+            counters["latency_ms"] += sum(latencies)
+            counters["max_latency_ms"] = max([counters["max_latency_ms"], *latencies])
+
+    def take(self, interval=0):
+        """The counters, reset, if ``interval`` seconds passed since the last take; else None."""
+        with self.lock:
+            if time.monotonic() - self.reported < interval:
+                return None
+            kinds, self.kinds, self.reported = self.kinds, {}, time.monotonic()
+        return {
+            kind: {
+                "batches": counters["batches"],
+                "done": counters["done"],
+                "failed": counters["failed"],
+                "run_ms_mean": round(counters["run_ms"] / counters["batches"], 2),
+                "latency_ms_mean": round(counters["latency_ms"] / counters["done"], 1) if counters["done"] else None,
+                "latency_ms_max": round(counters["max_latency_ms"], 1),
+            }
+            for kind, counters in kinds.items()
+        }
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (see api/jobs.py) until stopped. Logs the queue depth and the jobs run, "
+        "with their latency, on the api.jobs logger every API_JOBS_STATS_INTERVAL seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=getattr(settings, "API_JOBS_THREADS", 4))
+        parser.add_argument("--batch-size", type=int, default=jobs.batch_size(), help="Jobs of one kind per batch.")
+        parser.add_argument("--kind", action="append", dest="kinds", help="Only run jobs of this kind (repeatable).")
+        parser.add_argument("--once", action="store_true", help="Exit when no job is due instead of waiting for more.")
+        parser.add_argument("--retry-failed", action="store_true", help="Make failed jobs due again first.")
+        parser.add_argument("--stats", action="store_true", help="Only print the queue depth per kind.")
+
+    def handle(self, *args, **options):
+        if options["stats"]:
+            self.stdout.write(json.dumps({"queue": jobs.queue_stats()}, indent=2))
+            return
+        if options["retry_failed"]:
+            self.stdout.write(f"{jobs.retry_failed(options['kinds'])} failed job(s) due again.")
+
+        stop = threading.Event()
+        if not options["once"]:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                # Finish the batches in hand, then exit
+                signal.signal(signum, lambda *args: stop.set())
+
+        counters = Counters()
+        if options["threads"] <= 1:
+            self.work(stop, counters, options)
+        else:
+            threads = [
+                threading.Thread(target=self.work, args=(stop, counters, options), name=f"run_jobs-{number}")
+                for number in range(options["threads"])
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                # A timeout keeps the main thread responsive to signals
+                while thread.is_alive():
+                    thread.join(1)
+
+        kinds = counters.take()
+        self.report(kinds)
+        self.stdout.write(f"Ran {sum(counters['done'] for counters in kinds.values())} job(s).")
+
+    def work(self, stop, counters, options):
+        poll_interval = getattr(settings, "API_JOBS_POLL_INTERVAL", 1.0)
+        stats_interval = getattr(settings, "API_JOBS_STATS_INTERVAL", 60)
+        try:
+            while not stop.is_set():
+                batch = jobs.claim(options["kinds"], options["batch_size"])
+                if batch is None:
+                    if options["once"]:
+                        return
+                    stop.wait(poll_interval)
+                else:
+                    started = time.perf_counter()
+                    done = jobs.run(*batch)
+                    counters.record(batch[1], batch[2], done, (time.perf_counter() - started) * 1000)
+                kinds = counters.take(stats_interval)
+                if kinds is not None:
+                    self.report(kinds)
+        finally:
+            if threading.current_thread() is not threading.main_thread():
+                connections.close_all()
+
+    def report(self, kinds):
+        logger.info(json.dumps({"event": "job_stats", "queue": jobs.queue_stats(), "kinds": kinds}))
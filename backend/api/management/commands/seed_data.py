@@ -0,0 +1,178 @@
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import timedelta
+from decimal import ROUND_DOWN, Decimal
+from io import StringIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.models import Student, Expense, ExpenseShare
+
+Friendship = Student.friends.through
+BATCH_SIZE = 5000
+
+DEPARTMENTS = (
+    ("Computer Science", 30), ("Mathematics", 15), ("Economics", 12), ("Physics", 10), ("Law", 8),
+    ("Medicine", 8), ("Biology", 5), ("History", 4), ("Chemistry", 3), ("Architecture", 2),
+    ("Music", 2), ("Philosophy", 1),
+)
+WORDS = (
+    "pizza", "rent", "groceries", "taxi", "dinner", "lunch", "coffee", "books", "tickets", "concert",
+    "trip", "hotel", "fuel", "gift", "snacks", "laundry", "internet", "electricity", "movie", "gym",
+    "brunch", "drinks", "printing", "bus", "train", "flat", "cleaning", "party", "cinema", "museum",
+)
+# How many friends an expense is split with, and how often
+PARTICIPANTS = ((0, 20), (1, 30), (2, 20), (3, 12), (4, 8), (5, 5), (6, 3), (8, 2))
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic students, friendships, expenses and shares for load testing. "
+        "Activity is skewed: a few students pay for most expenses and have most friends."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10_000)
+        parser.add_argument("--friends", type=int, default=15, help="Typical number of friends per student.")
+        parser.add_argument("--expenses-per-user", type=float, default=20, help="Average expenses paid per student.")
+        parser.add_argument("--months", type=int, default=12, help="How far back expenses go.")
+        parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of how active students are.")
+        parser.add_argument("--prefix", default="seed-", help="Username prefix of the generated students.")
+        parser.add_argument("--password", default="password", help="Password of every generated student.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        prefix, count = options["prefix"], options["users"]
+        if count < 2:
+            raise CommandError("--users must be at least 2.")
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"Users named {prefix}* already exist; pick another --prefix or a fresh database.")
+        rng = random.Random(options["seed"])
+        # Student i is the i-th most active: weight 1 / (i + 1) ** skew
+        cum_weights = list(accumulate(1 / (rank + 1) ** options["skew"] for rank in range(count)))
+        population = range(count)
+
+        def popular():
+            return rng.choices(population, cum_weights=cum_weights)[0]
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            user_ids, student_ids, departments = self.create_students(rng, prefix, count, options["password"])
+            self.stdout.write(f"{count} students ({time.perf_counter() - started:.1f} s)")
+
+            friends = self.create_friendships(rng, popular, student_ids, departments, options["friends"])
+            self.stdout.write(
+                f"{sum(map(len, friends))} friendships ({time.perf_counter() - started:.1f} s)"
+            )
+
+            expenses, shares = self.create_expenses(
+                rng, popular, user_ids, friends, round(count * options["expenses_per_user"]), options["months"]
+            )
+            self.stdout.write(f"{expenses} expenses, {shares} shares ({time.perf_counter() - started:.1f} s)")
+
+            # bulk_create skips post_save. Applying that many deltas one batch
+            # at a time is far slower than recomputing the ledger and rollups.
+            call_command("rebuild_ledger", stdout=StringIO())
+            call_command("rebuild_analytics", stdout=StringIO())
+            self.stdout.write(f"ledger and analytics rebuilt ({time.perf_counter() - started:.1f} s)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {count} students as {prefix}0..{prefix}{count - 1} in {time.perf_counter() - started:.1f} s."
+        ))
+
+    def create_students(self, rng, prefix, count, password):
+        # Every student gets the same password, so it is only hashed once
+        hashed = make_password(password)
+        names, weights = zip(*DEPARTMENTS)
+        departments = rng.choices(names, weights=weights, k=count)
+        user_ids, student_ids = [], []
+        for start in range(0, count, BATCH_SIZE):
+            users = User.objects.bulk_create(
+                User(username=f"{prefix}{i}", email=f"{prefix}{i}@example.com", password=hashed)
+                for i in range(start, min(start + BATCH_SIZE, count))
+            )
+            # bulk_create skips post_save, so profiles are inserted explicitly
+            students = Student.objects.bulk_create(
+                Student(user=user, department=departments[start + offset]) for offset, user in enumerate(users)
+            )
+            user_ids += [user.pk for user in users]
+            student_ids += [student.pk for student in students]
+        return user_ids, student_ids, departments
+
+    def create_friendships(self, rng, popular, student_ids, departments, typical):
+        count = len(student_ids)
+        by_department = defaultdict(list)
+        for index, department in enumerate(departments):
+            by_department[department].append(index)
+
+        # Mostly classmates, some popular students from anywhere; most
+        # friendships are added by both sides
+        friends = [set() for _ in range(count)]
+        for index in range(count):
+            classmates = by_department[departments[index]]
+            degree = min(int(rng.lognormvariate(math.log(typical), 0.75)), count - 1)
+            for _ in range(degree):
+                other = rng.choice(classmates) if rng.random() < 0.7 else popular()
+                if other == index:
+                    continue
+                friends[index].add(other)
+                if rng.random() < 0.6:
+                    friends[other].add(index)
+
+        links = []
+        for index, others in enumerate(friends):
+            links += (Friendship(from_student_id=student_ids[index], to_student_id=student_ids[other]) for other in others)
+            if len(links) >= BATCH_SIZE or index == count - 1:
+                Friendship.objects.bulk_create(links)
+                links = []
+        return [list(others) for others in friends]
+
+    def create_expenses(self, rng, popular, user_ids, friends, total, months):
+        now = timezone.now()
+        counts, weights = zip(*PARTICIPANTS)
+        created_shares = 0
+        for start in range(0, total, BATCH_SIZE):
+            payers, expenses, dates = [], [], []
+            for _ in range(start, min(start + BATCH_SIZE, total)):
+                payer = popular()
+                payers.append(payer)
+                # Mostly small amounts with a long tail, more of them recently
+                amount = Decimal(f"{min(max(rng.lognormvariate(math.log(15), 1), 0.5), 5000):.2f}")
+                dates.append(now - timedelta(days=months * 30 * rng.random() ** 2, seconds=rng.randrange(86400)))
+                expenses.append(Expense(
+                    payer_id=user_ids[payer],
+                    title=" ".join(rng.sample(WORDS, rng.choice((1, 1, 2, 2, 3)))),
+                    amount=amount,
+                ))
+            expenses = Expense.objects.bulk_create(expenses)
+
+            # created_at is auto_now_add, which bulk_create always sets to now
+            table = Expense._meta.db_table
+            dated = [(connection.ops.adapt_datetimefield_value(date), expense.pk) for expense, date in zip(expenses, dates)]
+            with connection.cursor() as cursor:
+                cursor.executemany(f"UPDATE {table} SET created_at = %s, updated_at = %s WHERE id = %s", [
+                    (date, date, pk) for date, pk in dated
+                ])
+
+            shares = []
+            for payer, expense in zip(payers, expenses):
+                payees = rng.sample(friends[payer], min(rng.choices(counts, weights=weights)[0], len(friends[payer])))
+                if not payees:
+                    continue
+                # An equal split, the payer keeping one part
+                amount = (expense.amount / (len(payees) + 1)).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+                if amount:
+                    shares += (ExpenseShare(expense=expense, payee_id=user_ids[payee], amount=amount) for payee in payees)
+            ExpenseShare.objects.bulk_create(shares)
+            with connection.cursor() as cursor:
+                cursor.executemany(f"UPDATE {ExpenseShare._meta.db_table} SET updated_at = %s WHERE expense_id = %s", dated)
+            created_shares += len(shares)
+        return total, created_shares
@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import ledger, settlements
+from api.models import Expense, ExpenseShare, PairBalance, Student
+
+PREFIX = "stress-settle-"
+# What each user owes every user after them, more than the threads pay back
+DEBT = Decimal("1000000.00")
+
+
+class Command(BaseCommand):
+    help = (
+        "Record settlements from many threads at once, then check that no wallet update was lost. "
+        "Creates its own users and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--settlements", type=int, default=200, help="Settlements per thread.")
+        parser.add_argument("--users", type=int, default=10, help="Fewer users means more contention.")
+        parser.add_argument("--batch", type=int, default=5, help="Transfers per call on every other thread.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--naive",
+            action="store_true",
+            help="Update wallets with an unlocked read-modify-write instead, to show the lost updates.",
+        )
+
+    def handle(self, *args, **options):
+        User.objects.filter(username__startswith=PREFIX).delete()
+        users = User.objects.bulk_create(User(username=f"{PREFIX}{i}") for i in range(options["users"]))
+        Student.objects.bulk_create(Student(user=user, department="Stress") for user in users)
+        user_ids = [user.pk for user in users]
+        # Settlements only pay debts back, so each user first owes the ones after them
+        for number, creditor in enumerate(users):
+            for debtor in users[:number]:
+                expense = Expense.objects.create(payer=creditor, title="Stress", amount=DEBT)
+                ExpenseShare.objects.create(expense=expense, payee=debtor, amount=DEBT)
+
+        try:
+            expected, calls, elapsed = self.run_threads(user_ids, options)
+            total = sum(calls.values())
+            self.stdout.write(
+                f"threads={options['threads']} users={len(user_ids)} settlements={total} "
+                f"in {elapsed:.2f} s: {total / elapsed:.0f} settlements/s"
+            )
+            self.verify(user_ids, expected)
+        finally:
+            User.objects.filter(username__startswith=PREFIX).delete()
+
+    def run_threads(self, user_ids, options):
+        expected = Counter()
+        calls = Counter()
+        lock = threading.Lock()
+        start = threading.Barrier(options["threads"] + 1)
+        errors = []
+
+        def worker(number):
+            rng = random.Random(options["seed"] * 1000 + number)
+            batch = options["batch"] if number % 2 else 1
+            deltas, count = Counter(), 0
+            try:
+                start.wait()
+                while count < options["settlements"]:
+                    size = min(batch, options["settlements"] - count)
+                    transfers = []
+                    for _ in range(size):
+                        from_id, to_id = sorted(rng.sample(user_ids, 2), key=user_ids.index)
+                        transfers.append((from_id, to_id, Decimal(rng.randint(1, 10000)) / 100))
+                    if options["naive"]:
+                        self.naive_settle(transfers)
+                    else:
+                        settlements.settle(transfers)
+                    for from_id, to_id, amount in transfers:
+                        deltas[from_id] -= amount
+                        deltas[to_id] += amount
+                    count += size
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+            with lock:
+                expected.update(deltas)
+                calls[number] = count
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(options["threads"])]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise errors[0]
+        return expected, calls, elapsed
+
+    def naive_settle(self, transfers):
+        for from_id, to_id, amount in transfers:
+            for user_id, delta in ((from_id, -amount), (to_id, amount)):
+                student = Student.objects.get(user_id=user_id)
+                student.wallet_balance += delta
+                student.save(update_fields=["wallet_balance"])
+
+    def verify(self, user_ids, expected):
+        wallets = dict(Student.objects.filter(user_id__in=user_ids).values_list("user_id", "wallet_balance"))
+        lost = {
+            user_id: wallets[user_id] - expected[user_id]
+            for user_id in user_ids
+            if wallets[user_id] != expected[user_id]
+        }
+        if sum(wallets.values()) != 0:
+            self.stdout.write(f"wallets sum to {sum(wallets.values())}, not 0")
+        if lost:
+            self.stdout.write(self.style.ERROR(f"Lost updates on {len(lost)} of {len(user_ids)} wallet(s)."))
+            for user_id, difference in sorted(lost.items()):
+                self.stdout.write(f"  user {user_id}: off by {difference}")
+            return
+
+        pairs, _ = ledger.compute_balances()
+        stored = dict(
+            ((user_id, other_id), amount)
+            for user_id, other_id, amount in PairBalance.objects.filter(user_id__in=user_ids)
+            .values_list("user_id", "other_id", "amount")
+        )
+        drift = [key for key in stored if stored[key] != pairs.get(key, 0)]
+        if drift:
+            self.stdout.write(self.style.ERROR(f"Ledger drift in {len(drift)} pair balance(s)."))
+            return
+        self.stdout.write(self.style.SUCCESS("Every wallet and pair balance matches; no updates were lost."))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['payer', '-created_at', '-id'], name='expense_payer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(fields=['payee', 'expense'], name='share_payee_expense_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def build_ledger(apps, schema_editor):
+    ExpenseShare = apps.get_model("api", "ExpenseShare")
+    PairBalance = apps.get_model("api", "PairBalance")
+    UserBalance = apps.get_model("api", "UserBalance")
+
+    pairs, totals = {}, {}
+    rows = (
+        ExpenseShare.objects.exclude(payee_id=models.F("expense__payer_id"))
+        .values_list("expense__payer_id", "payee_id")
+        .annotate(total=models.Sum("amount"))
+        .order_by()
+    )
+    for payer_id, payee_id, total in rows:
+        pairs[payer_id, payee_id] = pairs.get((payer_id, payee_id), 0) + total
+        pairs[payee_id, payer_id] = pairs.get((payee_id, payer_id), 0) - total
+        totals.setdefault(payer_id, [0, 0])[0] += total
+        totals.setdefault(payee_id, [0, 0])[1] += total
+
+    PairBalance.objects.bulk_create(
+        [PairBalance(user_id=user_id, other_id=other_id, amount=amount) for (user_id, other_id), amount in pairs.items()],
+        batch_size=1000,
+    )
+    UserBalance.objects.bulk_create(
+        [UserBalance(user_id=user_id, lent=lent, borrowed=borrowed) for user_id, (lent, borrowed) in totals.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_expense_feed_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('borrowed', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance_total', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PairBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'other'), name='unique_pair_balance')],
+            },
+        ),
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
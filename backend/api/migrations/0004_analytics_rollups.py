@@ -0,0 +1,116 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import TruncMonth
+
+
+def build_rollups(apps, schema_editor):
+    Student = apps.get_model("api", "Student")
+    Expense = apps.get_model("api", "Expense")
+    ExpenseShare = apps.get_model("api", "ExpenseShare")
+    UserMonthlySpend = apps.get_model("api", "UserMonthlySpend")
+    DepartmentMonthlySpend = apps.get_model("api", "DepartmentMonthlySpend")
+    MonthlyCoSpend = apps.get_model("api", "MonthlyCoSpend")
+
+    users, departments, pairs = {}, {}, {}
+    paid = (
+        Expense.objects.annotate(month=TruncMonth("created_at", output_field=models.DateField()))
+        .values_list("payer_id", "month")
+        .annotate(total=models.Sum("amount"))
+        .order_by()
+    )
+    for payer_id, month, total in paid:
+        users.setdefault((payer_id, month), [0, 0, 0])[0] += total
+    shares = (
+        ExpenseShare.objects.exclude(payee_id=models.F("expense__payer_id"))
+        .annotate(month=TruncMonth("expense__created_at", output_field=models.DateField()))
+        .values_list("expense__payer_id", "payee_id", "month")
+        .annotate(total=models.Sum("amount"), count=models.Count("id"))
+        .order_by()
+    )
+    for payer_id, payee_id, month, total, count in shares:
+        users.setdefault((payer_id, month), [0, 0, 0])[1] += total
+        users.setdefault((payee_id, month), [0, 0, 0])[2] += total
+        for key in ((payer_id, payee_id, month), (payee_id, payer_id, month)):
+            pair = pairs.setdefault(key, [0, 0])
+            pair[0] += total
+            pair[1] += count
+
+    department_of = dict(Student.objects.values_list("user_id", "department"))
+    for (user_id, month), values in users.items():
+        totals = departments.setdefault((department_of.get(user_id, ""), month), [0, 0, 0])
+        for i, value in enumerate(values):
+            totals[i] += value
+
+    UserMonthlySpend.objects.bulk_create(
+        [UserMonthlySpend(user_id=user_id, month=month, paid=paid, lent=lent, owed=owed)
+         for (user_id, month), (paid, lent, owed) in users.items()],
+        batch_size=1000,
+    )
+    DepartmentMonthlySpend.objects.bulk_create(
+        [DepartmentMonthlySpend(department=department, month=month, paid=paid, lent=lent, owed=owed)
+         for (department, month), (paid, lent, owed) in departments.items()],
+        batch_size=1000,
+    )
+    MonthlyCoSpend.objects.bulk_create(
+        [MonthlyCoSpend(user_id=user_id, other_id=other_id, month=month, amount=amount, shares=count)
+         for (user_id, other_id, month), (amount, count) in pairs.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_balance_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentMonthlySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department', models.CharField(max_length=100)),
+                ('month', models.DateField()),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('department', 'month'), name='unique_department_monthly_spend')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlyCoSpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('shares', models.IntegerField(default=0)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='co_spend', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'month'], name='co_spend_user_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'other', 'month'), name='unique_monthly_co_spend')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserMonthlySpend',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lent', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('owed', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_spend', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'month'), name='unique_user_monthly_spend')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
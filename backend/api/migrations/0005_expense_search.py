@@ -0,0 +1,75 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:57
+
+import api.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+# The index SQL is copied from api/search.py as it stood for this migration,
+# so later changes there cannot alter what this migration does.
+SQLITE_SQL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS api_expense_fts USING fts5("
+    "title, content='api_expense', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER IF NOT EXISTS api_expense_fts_insert AFTER INSERT ON api_expense BEGIN
+        INSERT INTO api_expense_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS api_expense_fts_delete AFTER DELETE ON api_expense BEGIN
+        INSERT INTO api_expense_fts(api_expense_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS api_expense_fts_update AFTER UPDATE OF title ON api_expense BEGIN
+        INSERT INTO api_expense_fts(api_expense_fts, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO api_expense_fts(rowid, title) VALUES (new.id, new.title);
+    END""",
+    "INSERT INTO api_expense_fts(api_expense_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS api_expense_fts_insert",
+    "DROP TRIGGER IF EXISTS api_expense_fts_delete",
+    "DROP TRIGGER IF EXISTS api_expense_fts_update",
+    "DROP TABLE IF EXISTS api_expense_fts",
+]
+
+POSTGRES_SQL = [
+    "CREATE INDEX IF NOT EXISTS api_expense_title_fts ON api_expense USING gin "
+    "(to_tsvector('simple'::regconfig, COALESCE((title)::text, '')))",
+]
+POSTGRES_REVERSE_SQL = ["DROP INDEX IF EXISTS api_expense_title_fts"]
+
+
+class VendorRunSQL(migrations.RunSQL):
+    """RunSQL that only runs on one database vendor."""
+
+    def __init__(self, vendor, *args, **kwargs):
+        self.vendor = vendor
+        super().__init__(*args, **kwargs)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == self.vendor:
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpenseSearchIndex',
+            fields=[
+                ('expense', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='api.expense')),
+                ('title', api.models.FullTextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_expense_fts',
+                'managed': False,
+            },
+        ),
+        VendorRunSQL('sqlite', SQLITE_SQL, SQLITE_REVERSE_SQL),
+        VendorRunSQL('postgresql', POSTGRES_SQL, POSTGRES_REVERSE_SQL),
+    ]
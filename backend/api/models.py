@@ -1,6 +1,7 @@
 # api/models.py
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 
 class Student(models.Model):
@@ -13,11 +14,34 @@ class Student(models.Model):
         return self.user.username
 
 
+class ExpenseQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        # Expenses the user paid or owes a share of. The share side is a
+        # subquery rather than a JOIN so the result needs no DISTINCT.
+        # Serves ArchivedExpense too, through its own share model.
+        shares = self.model._meta.get_field("shares").related_model
+        return self.filter(
+            models.Q(payer=user)
+            | models.Q(pk__in=shares.objects.filter(payee=user).values("expense_id"))
+        )
+
+
 class Expense(models.Model):
     payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="expenses_paid")
     title = models.CharField(max_length=255)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Also touched when a share gives someone new access to it, see api/sync.py
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["payer", "-created_at", "-id"], name="expense_payer_created_idx"),
+            models.Index(fields=["created_at"], name="expense_created_idx"),  # admin date hierarchy
+            models.Index(fields=["updated_at", "id"], name="expense_updated_idx"),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.amount} by {self.payer.username}"
@@ -27,7 +51,240 @@ class ExpenseShare(models.Model):
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name="shares")
     payee = models.ForeignKey(User, on_delete=models.CASCADE, related_name="shares")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    settled = models.BooleanField(default=False)  # covered by the payee's settlements, see api/settlements.py
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["payee", "expense"], name="share_payee_expense_idx"),
+            models.Index(fields=["updated_at", "id"], name="share_updated_idx"),
+        ]
 
     def __str__(self):
         return f"{self.payee.username} owes {self.amount} for {self.expense.title}"
 
+
+class ArchivedExpense(models.Model):
+    # A settled Expense moved out of the hot tables by api/archive.py, under
+    # the id it had. Read-only from then on, and still counted by the ledger
+    # and analytics rebuilds and by settlements.
+    id = models.BigIntegerField(primary_key=True)
+    payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    title = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ExpenseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["payer", "-created_at", "-id"], name="archived_payer_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.title} - {self.amount} (archived)"
+
+
+class ArchivedExpenseShare(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    expense = models.ForeignKey(ArchivedExpense, on_delete=models.CASCADE, related_name="shares")
+    payee = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    settled = models.BooleanField(default=True)  # always, or it would not have been archived
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["payee", "expense"], name="archived_share_payee_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.payee_id} owed {self.amount} for archived expense {self.expense_id}"
+
+
+class Tombstone(models.Model):
+    # An expense or share that `user` could see and no longer can, because it
+    # was deleted or they were taken off it. Kept for /sync/ (api/sync.py)
+    # until pruned. No FK constraint: rows are written while a user's own
+    # deletion cascades, and outlive them until pruned.
+    EXPENSE, SHARE = "expense", "share"
+    KIND_CHOICES = [(EXPENSE, "Expense"), (SHARE, "Share")]
+
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="+")
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "deleted_at", "id"], name="tombstone_user_deleted_idx"),
+            models.Index(fields=["deleted_at"], name="tombstone_deleted_idx"),  # pruning
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} gone for user {self.user_id}"
+
+
+class PairBalance(models.Model):
+    # Net amount `other` owes `user`. Every pair is stored in both directions
+    # (A->B and B->A with the opposite sign) so either side reads one row.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="balances")
+    other = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "other"], name="unique_pair_balance"),
+        ]
+
+    def __str__(self):
+        return f"{self.other.username} owes {self.user.username} {self.amount}"
+
+
+class UserBalance(models.Model):
+    # Running totals of what a user has lent out and borrowed through shares.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="balance_total")
+    lent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    borrowed = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    @property
+    def net(self):
+        return self.lent - self.borrowed
+
+    def __str__(self):
+        return f"{self.user.username}: {self.net}"
+
+
+class Settlement(models.Model):
+    # `from_user` paid `to_user` back outside the app. Counts against the pair
+    # balance like a negative share and moves money between the two wallets.
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="settlements_paid")
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="settlements_received")
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["from_user", "to_user"], name="settlement_pair_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.from_user.username} paid {self.to_user.username} {self.amount}"
+
+
+class UserMonthlySpend(models.Model):
+    # Per-user totals for one calendar month (the first day of it), keyed on the
+    # expense's month and maintained incrementally by api/analytics.py.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="monthly_spend")
+    month = models.DateField()
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # expenses the user paid
+    lent = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # shares of those owed by others
+    owed = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # shares the user owes others
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "month"], name="unique_user_monthly_spend"),
+        ]
+
+    @property
+    def spent(self):
+        return self.paid - self.lent + self.owed
+
+    def __str__(self):
+        return f"{self.user.username} {self.month:%Y-%m}: {self.spent}"
+
+
+class DepartmentMonthlySpend(models.Model):
+    # UserMonthlySpend summed over the students currently in the department
+    department = models.CharField(max_length=100)
+    month = models.DateField()
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["department", "month"], name="unique_department_monthly_spend"),
+        ]
+
+    @property
+    def spent(self):
+        return self.paid - self.lent + self.owed
+
+    def __str__(self):
+        return f"{self.department or '-'} {self.month:%Y-%m}: {self.spent}"
+
+
+class MonthlyCoSpend(models.Model):
+    # Shares between two users in a month, whichever way they went. Stored in
+    # both directions like PairBalance so either side reads its own rows.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="co_spend")
+    other = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    month = models.DateField()
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    shares = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "other", "month"], name="unique_monthly_co_spend"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "month"], name="co_spend_user_month_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} & {self.other.username} {self.month:%Y-%m}: {self.amount}"
+
+
+class Job(models.Model):
+    # A queued side effect (api/jobs.py), deleted once done. `run_at` is when
+    # it is next due: pushed back while a worker holds it and after each
+    # failure, and cleared once it has failed for good.
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField()
+    run_at = models.DateTimeField(null=True, blank=True, default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["run_at", "id"], name="job_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk}"
+
+
+class FullTextField(models.TextField):
+    # A column of a full-text index, queried with the "match" lookup
+    pass
+
+
+@FullTextField.register_lookup
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", (*lhs_params, *rhs_params)
+
+
+class ExpenseSearchIndex(models.Model):
+    # The SQLite FTS5 index over Expense.title (see api/search.py). Triggers
+    # keep it in sync, so it is only ever joined against, never written to.
+    expense = models.OneToOneField(
+        Expense, on_delete=models.DO_NOTHING, primary_key=True, db_column="rowid",
+        db_constraint=False, related_name="search_index",
+    )
+    title = FullTextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "api_expense_fts"
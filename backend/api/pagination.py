@@ -0,0 +1,175 @@
+from functools import partial
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination, _reverse_ordering
+
+
+class KeysetCursorPagination(CursorPagination):
+    # CursorPagination.paginate_queryset split around the one query it runs,
+    # so async views can fetch the page with the async ORM.
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    def get_paginated_data(self, data):
+        return {"next": self.get_next_link(), "previous": self.get_previous_link(), "results": data}
+
+    def page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            self.offset, self.reverse, self.current_position = 0, False, None
+        else:
+            self.offset, self.reverse, self.current_position = self.cursor
+
+        if self.reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if self.current_position is not None:
+            order = self.ordering[0]
+            order_attr = order.lstrip("-")
+            if self.cursor.reverse != order.startswith("-"):
+                queryset = queryset.filter(**{order_attr + "__lt": self.current_position})
+            else:
+                queryset = queryset.filter(**{order_attr + "__gt": self.current_position})
+
+        # One extra row tells whether another page follows
+        return queryset[self.offset:self.offset + self.page_size + 1]
+
+    def set_page(self, results):
+        self.page = results[:self.page_size]
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        has_current_position = self.current_position is not None or self.offset > 0
+        if self.reverse:
+            self.page = list(reversed(self.page))
+            self.has_next, self.has_previous = has_current_position, has_following_position
+            if self.has_next:
+                self.next_position = self.current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next, self.has_previous = has_following_position, has_current_position
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = self.current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class ExpenseCursorPagination(KeysetCursorPagination):
+    # Keyset pagination on (created_at, id) so fetching a page costs the same
+    # no matter how much history sits behind it.
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class ExpenseShareCursorPagination(KeysetCursorPagination):
+    # Shares have no timestamp of their own; they are inserted in order so the
+    # primary key is a stable cursor.
+    ordering = ("id",)
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class SettlementCursorPagination(KeysetCursorPagination):
+    ordering = ("-id",)
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+class ExpenseSearchPagination(PageNumberPagination):
+    # Results are ordered by relevance, which has no stable cursor; people
+    # rarely page far into search results anyway.
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None, count_queryset=None):
+        # Ranking joins the search index, which can make counting much slower
+        # than counting the same matches unranked
+        self.django_paginator_class = partial(CountedPaginator, count_queryset=count_queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+
+class CountedPaginator(Paginator):
+    def __init__(self, object_list, per_page, count_queryset=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_queryset = count_queryset
+
+    @cached_property
+    def count(self):
+        if self.count_queryset is None:
+            return super().count
+        return self.count_queryset.count()
+
+
+def estimated_count(queryset):
+    """
+    How many rows ``queryset``'s table holds, from the database's statistics,
+    or None where there are none to go by. Only PostgreSQL keeps them; SQLite
+    ids run ever further ahead of the row count as rows are deleted or
+    archived, so they are no estimate.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        # -1 until the table has been vacuumed or analyzed
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    # For admin changelists over very large tables. An unfiltered list is
+    # counted from the database's statistics, where it keeps them, rather
+    # than with COUNT(*), which reads the whole table; filtered lists and
+    # other databases are counted exactly.
+    estimate_threshold = 100_000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
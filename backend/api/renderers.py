@@ -0,0 +1,41 @@
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .instrumentation import phase
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    # Drop-in JSONRenderer backed by orjson. Types orjson does not handle the
+    # way DRF does (Decimal, datetimes, lazy strings, ...) are passed through
+    # to DRF's encoder so the output stays the same.
+    _encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase("render"):
+            if orjson is None:
+                return super().render(data, accepted_media_type, renderer_context)
+            if data is None:
+                return b""
+
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.get_indent(accepted_media_type, renderer_context or {}):
+                option |= orjson.OPT_INDENT_2
+            ret = orjson.dumps(data, default=self._encoder.default, option=option)
+
+            # Match JSONRenderer, which escapes these for embedding in JavaScript
+            return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+
+
+class JSONResponse(HttpResponse):
+    # What a DRF Response rendered with ORJSONRenderer comes out as, for the
+    # views in api/async_views.py that do not go through DRF.
+    def __init__(self, data=None, status=200, **kwargs):
+        content = ORJSONRenderer().render(data)
+        super().__init__(content, status=status, content_type=ORJSONRenderer.media_type, **kwargs)
+        self.data = data
@@ -0,0 +1,153 @@
+# api/response_cache.py
+"""
+Per-user cache for GET responses with strong ETags.
+
+Each (user, scope) pair has a version token; cached responses are keyed on it,
+so invalidating a scope for a user is a single cache write and stale entries
+simply stop being reachable. Signal receivers in api/signals.py decide which
+users and scopes a model change affects.
+
+Responses are cached from the primary database even in views that read from
+the replica: the first request after a write misses the cache, and a lagging
+replica would have its stale answer kept under the new version until it
+expires.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from backend.routers import read_primary
+
+from .renderers import JSONResponse, ORJSONRenderer
+
+EXPENSES = "expenses"
+FRIENDS = "friends"
+PROFILE = "profile"
+
+
+def _cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def _version_key(scope, user_id):
+    return f"api:version:{scope}:{user_id}"
+
+
+def _version(scope, user_id):
+    cache = _cache()
+    key = _version_key(scope, user_id)
+    version = cache.get(key)
+    if version is None:
+        # Never reuse an old token: an evicted version must not resurrect the
+        # entries cached under it.
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+async def _aversion(scope, user_id):
+    cache = _cache()
+    key = _version_key(scope, user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, uuid.uuid4().hex, None)
+        version = await cache.aget(key)
+    return version
+
+
+def invalidate(user_ids, *scopes):
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    # Bump versions only once the change is visible to other connections, or a
+    # concurrent request could cache the pre-commit state under the new version.
+    transaction.on_commit(lambda: _cache().set_many(
+        {_version_key(scope, user_id): uuid.uuid4().hex for scope in scopes for user_id in user_ids},
+        None,
+    ))
+
+
+def _entry_key(scope, request, version):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"api:response:{scope}:{request.user.pk}:{version}:{path}"
+
+
+def _etag(body):
+    return f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get("If-None-Match", "")
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+
+def _finish(request, data, etag, response_class=Response):
+    if _etag_matches(request, etag):
+        response = response_class(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = response_class(data)
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+def _enabled(request):
+    return getattr(settings, "API_RESPONSE_CACHE", True) and request.user.is_authenticated
+
+
+def cached_response(scope):
+    """Cache a view's successful GET response per user under ``scope``."""
+    def decorator(method):
+        if iscoroutinefunction(method):
+            return _async_cached_response(scope, method)
+
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if not _enabled(request):
+                return method(view, request, *args, **kwargs)
+
+            key = _entry_key(scope, request, _version(scope, request.user.pk))
+            entry = _cache().get(key)
+            if entry is None:
+                with read_primary():
+                    response = method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                entry = (_etag(ORJSONRenderer().render(response.data)), response.data)
+                _cache().set(key, entry, getattr(settings, "API_CACHE_TIMEOUT", 300))
+
+            etag, data = entry
+            return _finish(request, data, etag)
+        return wrapper
+    return decorator
+
+
+def _async_cached_response(scope, method):
+    # Same entries as the sync views, so both can serve the same cache
+    @wraps(method)
+    async def wrapper(view, request, *args, **kwargs):
+        if not _enabled(request):
+            return await method(view, request, *args, **kwargs)
+
+        key = _entry_key(scope, request, await _aversion(scope, request.user.pk))
+        entry = await _cache().aget(key)
+        if entry is None:
+            with read_primary():
+                response = await method(view, request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = (_etag(response.content), response.data)
+            await _cache().aset(key, entry, getattr(settings, "API_CACHE_TIMEOUT", 300))
+
+        etag, data = entry
+        return _finish(request, data, etag, JSONResponse)
+    return wrapper
@@ -0,0 +1,218 @@
+# api/search.py
+"""
+Full-text search over expense titles.
+
+The backend is picked from the database vendor, or named explicitly with the
+``API_SEARCH_BACKEND`` setting:
+
+* SQLite: an external-content FTS5 table (``api_expense_fts``) that triggers
+  keep in sync with ``api_expense``, so bulk_create, queryset updates and raw
+  SQL are all indexed. Results are ordered by bm25.
+* PostgreSQL: ``to_tsvector`` over the title, backed by a GIN expression index,
+  ordered by ``ts_rank``.
+* Anything else: unindexed ``icontains``, newest first.
+
+User input is reduced to word tokens, all of which must match; the last one
+also matches as a prefix where the backend supports it.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, FloatField, Q, Value
+from django.utils.module_loading import import_string
+
+from .models import Expense, ExpenseSearchIndex
+
+MAX_TERMS = 10
+
+SQLITE_FTS_TABLE = "api_expense_fts"
+SQLITE_FTS_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5("
+    "title, content='api_expense', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+)
+SQLITE_TRIGGER_SQL = (
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert AFTER INSERT ON api_expense BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title) VALUES (new.id, new.title);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete AFTER DELETE ON api_expense BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title) VALUES ('delete', old.id, old.title);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_update AFTER UPDATE OF title ON api_expense BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title) VALUES ('delete', old.id, old.title);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, title) VALUES (new.id, new.title);
+    END""",
+)
+SQLITE_TRIGGERS = tuple(f"{SQLITE_FTS_TABLE}_{action}" for action in ("insert", "delete", "update"))
+
+POSTGRES_INDEX = "api_expense_title_fts"
+POSTGRES_CONFIG = "simple"
+
+
+def terms(query):
+    return re.findall(r"\w+", query.lower())[:MAX_TERMS]
+
+
+class SQLiteFTSBackend:
+    def filter(self, queryset, query):
+        """``queryset`` narrowed to titles matching ``query``, unordered; cheap to count."""
+        return queryset.filter(pk__in=self.matching_ids(query))
+
+    def search(self, queryset, query):
+        """``queryset`` narrowed to titles matching ``query``, best match first."""
+        match = self.match(query)
+        if match is None:
+            return queryset.none()
+        # The rank comes from joining the index. Without the IN list, SQLite
+        # would start from the visible expenses and probe the index once per
+        # row, which is quadratic for prefix matches.
+        return (
+            self.filter(queryset, query)
+            .filter(search_index__title__match=match)
+            .annotate(rank=F("search_index__rank"))
+            .order_by("rank", "-id")
+        )
+
+    def matching_ids(self, query):
+        match = self.match(query)
+        if match is None:
+            return Expense.objects.none().values("pk")
+        return ExpenseSearchIndex.objects.filter(title__match=match).values("expense_id")
+
+    def match(self, query):
+        tokens = terms(query)
+        if not tokens:
+            return None
+        # Quoted, so FTS5 operators in the input are just words
+        return " ".join(f'"{token}"' for token in tokens) + "*"
+
+    def install(self, connection, rebuild=False):
+        with connection.cursor() as cursor:
+            for sql in SQLITE_FTS_SQL + SQLITE_TRIGGER_SQL:
+                cursor.execute(sql)
+            if rebuild:
+                cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            for trigger in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            cursor.execute(f"DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}")
+
+
+class PostgresBackend:
+    def vector(self):
+        from django.contrib.postgres.search import SearchVector
+
+        return SearchVector("title", config=POSTGRES_CONFIG)
+
+    def query(self, query):
+        from django.contrib.postgres.search import SearchQuery
+
+        tokens = terms(query)
+        if not tokens:
+            return None
+        return SearchQuery(" & ".join(tokens) + ":*", config=POSTGRES_CONFIG, search_type="raw")
+
+    def filter(self, queryset, query):
+        search_query = self.query(query)
+        if search_query is None:
+            return queryset.none()
+        return queryset.annotate(search_vector=self.vector()).filter(search_vector=search_query)
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import SearchRank
+
+        search_query = self.query(query)
+        if search_query is None:
+            return queryset.none()
+        return (
+            self.filter(queryset, query)
+            .annotate(rank=SearchRank(self.vector(), search_query))
+            .order_by("-rank", "-id")
+        )
+
+    def matching_ids(self, query):
+        search_query = self.query(query)
+        if search_query is None:
+            return Expense.objects.none().values("pk")
+        return Expense.objects.annotate(search_vector=self.vector()).filter(search_vector=search_query).values("pk")
+
+    def install(self, connection, rebuild=False):
+        # Same expression SearchVector compiles to, so the planner can use it
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {POSTGRES_INDEX} ON api_expense USING gin "
+                f"(to_tsvector('{POSTGRES_CONFIG}'::regconfig, COALESCE((title)::text, '')))"
+            )
+
+    def uninstall(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {POSTGRES_INDEX}")
+
+
+class LikeBackend:
+    def filter(self, queryset, query):
+        tokens = terms(query)
+        if not tokens:
+            return queryset.none()
+        return queryset.filter(self.condition(tokens))
+
+    def search(self, queryset, query):
+        return (
+            self.filter(queryset, query)
+            .annotate(rank=Value(0.0, output_field=FloatField()))
+            .order_by("-created_at", "-id")
+        )
+
+    def matching_ids(self, query):
+        tokens = terms(query)
+        if not tokens:
+            return Expense.objects.none().values("pk")
+        return Expense.objects.filter(self.condition(tokens)).values("pk")
+
+    def condition(self, tokens):
+        condition = Q()
+        for token in tokens:
+            condition &= Q(title__icontains=token)
+        return condition
+
+    def install(self, connection, rebuild=False):
+        pass
+
+    def uninstall(self, connection):
+        pass
+
+
+VENDOR_BACKENDS = {
+    "sqlite": SQLiteFTSBackend,
+    "postgresql": PostgresBackend,
+}
+
+
+def get_backend(using="default"):
+    path = getattr(settings, "API_SEARCH_BACKEND", None)
+    if path:
+        return import_string(path)()
+    return VENDOR_BACKENDS.get(connections[using].vendor, LikeBackend)()
+
+
+def ensure_index(using="default", **kwargs):
+    """
+    Recreate missing SQLite triggers after migrations. SQLite migrations that
+    rebuild api_expense (most field changes) drop its triggers with the old
+    table; the index is rebuilt once if that happened.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master WHERE name = %s OR (type = 'trigger' AND name IN (%s, %s, %s))",
+            [SQLITE_FTS_TABLE, *SQLITE_TRIGGERS],
+        )
+        found = cursor.fetchall()
+    if not any(kind == "table" for kind, _ in found):
+        return  # not migrated that far
+    if len(found) < 1 + len(SQLITE_TRIGGERS):
+        SQLiteFTSBackend().install(connection, rebuild=True)
@@ -1,8 +1,13 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.contrib.auth.password_validation import validate_password
-from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Student, Expense, ExpenseShare
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from . import analytics, events, friend_graph, ledger, response_cache, settlements, simplify, splits, sync
+from .authentication import CachedRefreshToken
+from .models import Student, Expense, ExpenseShare, PairBalance, UserBalance, Settlement
 
 
 # ---------------------------
@@ -17,13 +22,10 @@ class RegisterSerializer(serializers.ModelSerializer):
         fields = ("username", "email", "password")
 
     def create(self, validated_data):
-        user = User.objects.create(
-            username=validated_data["username"],
-            email=validated_data["email"]
-        )
+        # One INSERT for the user; the post_save signal inserts the Student profile
+        user = User(username=validated_data["username"], email=validated_data["email"])
         user.set_password(validated_data["password"])
         user.save()
-        Student.objects.get_or_create(user=user)  # create Student profile
         return user
 
 
@@ -36,11 +38,28 @@ class LogoutSerializer(serializers.Serializer):
 
     def save(self, **kwargs):
         try:
-            RefreshToken(self.token).blacklist()
+            CachedRefreshToken(self.token).blacklist()
         except Exception:
             self.fail("bad_token")
 
 
+class StudentTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = CachedRefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        # Extra claims let CachedJWTAuthentication skip the user lookup entirely
+        # when AUTH_TRUST_TOKEN_CLAIMS is on; they are copied to access tokens.
+        token = super().get_token(user)
+        token["username"] = user.username
+        token["student_id"] = Student.objects.filter(user=user).values_list("pk", flat=True).first()
+        return token
+
+
+class CachedTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = CachedRefreshToken
+
+
 # ---------------------------
 # User / Student
 # ---------------------------
@@ -69,18 +88,91 @@ class StudentUpdateSerializer(serializers.ModelSerializer):
         fields = ["department", "first_name", "last_name"]
 
     def update(self, instance, validated_data):
-        instance.department = validated_data.get("department", instance.department)
-        instance.save()
+        if "department" in validated_data:
+            instance.department = validated_data["department"]
+            instance.save(update_fields=["department"])
 
         user_data = validated_data.get("user", {})
-        user = instance.user
-        user.first_name = user_data.get("first_name", user.first_name)
-        user.last_name = user_data.get("last_name", user.last_name)
-        user.save()
+        if user_data:
+            user = instance.user
+            for field, value in user_data.items():
+                setattr(user, field, value)
+            user.save(update_fields=list(user_data))
 
         return instance
 
 
+class FriendBatchSerializer(serializers.Serializer):
+    """Add or remove many friends by username, reporting an outcome per username."""
+    ADDED, REMOVED = "added", "removed"
+    ALREADY_FRIENDS, NOT_FRIENDS = "already_friends", "not_friends"
+    NOT_FOUND, SELF = "not_found", "self"
+
+    usernames = serializers.ListField(
+        child=serializers.CharField(max_length=150), allow_empty=False, max_length=1000
+    )
+
+    def validate_usernames(self, value):
+        return list(dict.fromkeys(value))
+
+    def add(self, student):
+        found, current = self._resolve(student)
+        results, added = self._outcomes(student, found, current, adding=True)
+        if added:
+            friend_graph.Friendship.objects.bulk_create(
+                (friend_graph.Friendship(from_student_id=student.pk, to_student_id=pk) for pk in added),
+                ignore_conflicts=True,
+            )
+            self._friends_changed(student)
+        return results
+
+    def remove(self, student):
+        found, current = self._resolve(student)
+        results, removed = self._outcomes(student, found, current, adding=False)
+        if removed:
+            friend_graph.Friendship.objects.filter(from_student_id=student.pk, to_student_id__in=removed).delete()
+            self._friends_changed(student)
+        return results
+
+    def _resolve(self, student):
+        # One query for every username, one for which of them are friends already
+        found = dict(
+            Student.objects.filter(user__username__in=self.validated_data["usernames"])
+            .values_list("user__username", "pk")
+        )
+        current = set(
+            friend_graph.Friendship.objects.filter(from_student_id=student.pk, to_student_id__in=found.values())
+            .values_list("to_student_id", flat=True)
+        )
+        return found, current
+
+    def _outcomes(self, student, found, current, adding):
+        results, changed = [], []
+        for username in self.validated_data["usernames"]:
+            pk = found.get(username)
+            if pk is None:
+                outcome = self.NOT_FOUND
+            elif pk == student.pk:
+                outcome = self.SELF
+            elif adding:
+                outcome = self.ALREADY_FRIENDS if pk in current else self.ADDED
+            else:
+                outcome = self.REMOVED if pk in current else self.NOT_FRIENDS
+            if outcome in (self.ADDED, self.REMOVED):
+                changed.append(pk)
+            results.append({"username": username, "result": outcome})
+        return results, changed
+
+    def _friends_changed(self, student):
+        # The through-table writes above skip m2m_changed
+        response_cache.invalidate([student.user_id], response_cache.FRIENDS, response_cache.PROFILE)
+        friend_graph.invalidate([student.pk])
+
+
+class FriendSuggestionQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
 # ---------------------------
 # Expense
 # ---------------------------
@@ -100,5 +192,278 @@ class ExpenseShareSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ExpenseShare
-        fields = ["id", "expense", "payee", "payee_username", "amount"]
-        read_only_fields = ['expense']
+        fields = ["id", "expense", "payee", "payee_username", "amount", "settled"]
+        read_only_fields = ['expense', 'settled']
+
+
+class ExpenseShareInputSerializer(serializers.Serializer):
+    # Payees are resolved in bulk by ExpenseWithSharesSerializer, so this only
+    # validates the shape of a single row.
+    payee = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+
+class ExpenseWithSharesSerializer(ExpenseSerializer):
+    shares = ExpenseShareInputSerializer(many=True, write_only=True)
+
+    class Meta(ExpenseSerializer.Meta):
+        fields = ExpenseSerializer.Meta.fields + ["shares"]
+
+    def validate_shares(self, value):
+        payee_ids = [share["payee"] for share in value]
+        if len(set(payee_ids)) != len(payee_ids):
+            raise serializers.ValidationError("Each payee can only appear once.")
+
+        payees = User.objects.in_bulk(payee_ids)
+        missing = [pk for pk in payee_ids if pk not in payees]
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid payee id(s): {', '.join(str(pk) for pk in missing)}."
+            )
+
+        for share in value:
+            share["payee"] = payees[share["payee"]]
+        return value
+
+    def validate(self, attrs):
+        total = sum(share["amount"] for share in attrs["shares"])
+        if total > attrs["amount"]:
+            raise serializers.ValidationError(
+                {"shares": "Shares cannot add up to more than the expense amount."}
+            )
+        return attrs
+
+    @transaction.atomic
+    def create(self, validated_data):
+        shares_data = validated_data.pop("shares")
+        expense = Expense.objects.create(**validated_data)
+        shares = ExpenseShare.objects.bulk_create(
+            ExpenseShare(expense=expense, **share) for share in shares_data
+        )
+        # bulk_create skips post_save, so update the balance ledger and rollups directly
+        ledger.add_shares((expense.payer_id, share.payee_id, share.amount) for share in shares)
+        analytics.add(shares=[(expense.payer_id, share.payee_id, expense.created_at, share.amount) for share in shares])
+        response_cache.invalidate([expense.payer_id, *(share.payee_id for share in shares)], response_cache.EXPENSES)
+        if events.enabled():
+            # The payer already heard of the expense from its post_save
+            events.publish([
+                ([share.payee_id for share in shares], {"type": "expense.created", "id": expense.pk}),
+                *events.share_messages(
+                    "created", ((share.pk, expense.pk, expense.payer_id, share.payee_id) for share in shares)
+                ),
+            ])
+        expense.created_shares = shares
+        return expense
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["shares"] = ExpenseShareSerializer(instance.created_shares, many=True).data
+        return data
+
+
+class SplitShareSerializer(serializers.Serializer):
+    # Payees are resolved in bulk by ExpenseSplitSerializer
+    payee = serializers.IntegerField()
+    value = serializers.DecimalField(max_digits=12, decimal_places=4, min_value=Decimal("0"), required=False)
+
+
+class ExpenseSplitSerializer(serializers.Serializer):
+    """Replace every share of ``instance`` with a split worked out by api/splits.py."""
+    strategy = serializers.ChoiceField(choices=splits.STRATEGIES)
+    shares = SplitShareSerializer(many=True, allow_empty=False, max_length=1000)
+    # Equal splits only: the payer keeps a part like everyone else
+    include_payer = serializers.BooleanField(default=True)
+
+    def validate_shares(self, value):
+        payee_ids = [share["payee"] for share in value]
+        if len(set(payee_ids)) != len(payee_ids):
+            raise serializers.ValidationError("Each payee can only appear once.")
+        found = set(User.objects.filter(pk__in=payee_ids).values_list("pk", flat=True))
+        missing = [pk for pk in payee_ids if pk not in found]
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid payee id(s): {', '.join(str(pk) for pk in missing)}."
+            )
+        return value
+
+    def validate(self, attrs):
+        if attrs["strategy"] != splits.EQUAL:
+            if any("value" not in share for share in attrs["shares"]):
+                raise serializers.ValidationError({"shares": "Every share needs a value for this strategy."})
+            if attrs["strategy"] != splits.EXACT and any(share["value"] <= 0 for share in attrs["shares"]):
+                raise serializers.ValidationError({"shares": "Values must be greater than zero."})
+        return attrs
+
+    def update(self, instance, validated_data):
+        values = [(share["payee"], share.get("value")) for share in validated_data["shares"]]
+        if validated_data["strategy"] == splits.EQUAL and validated_data["include_payer"]:
+            if instance.payer_id not in {user_id for user_id, _ in values}:
+                values.append((instance.payer_id, None))
+        try:
+            return splits.resplit(instance.pk, instance.payer_id, validated_data["strategy"], values)
+        except ValueError as error:
+            raise serializers.ValidationError({"shares": [str(error)]})
+
+    def to_representation(self, instance):
+        data = ExpenseSerializer(instance).data
+        data["shares"] = ExpenseShareSerializer(
+            instance.shares.select_related("payee").order_by("id"), many=True
+        ).data
+        return data
+
+
+# ---------------------------
+# Balances
+# ---------------------------
+
+class PairBalanceSerializer(serializers.ModelSerializer):
+    user_id = serializers.IntegerField(source="other_id", read_only=True)
+    username = serializers.CharField(source="other.username", read_only=True)
+
+    class Meta:
+        model = PairBalance
+        fields = ["user_id", "username", "amount"]
+
+
+class UserBalanceSerializer(serializers.ModelSerializer):
+    net = serializers.DecimalField(max_digits=14, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = UserBalance
+        fields = ["lent", "borrowed", "net"]
+
+
+class SettlementTransferSerializer(serializers.Serializer):
+    # Same keys as SettlementInputSerializer, so a plan's rows can be posted back
+    from_user = serializers.IntegerField(source="from_user_id")
+    from_username = serializers.CharField()
+    to_user = serializers.IntegerField(source="to_user_id")
+    to_username = serializers.CharField()
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class SettlementSerializer(serializers.ModelSerializer):
+    from_user_id = serializers.IntegerField(read_only=True)
+    to_user_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Settlement
+        fields = ["id", "from_user_id", "to_user_id", "amount", "created_at"]
+
+
+class SettlementInputSerializer(serializers.Serializer):
+    # Users are checked in bulk by the caller, so this only validates one row
+    from_user = serializers.IntegerField(required=False)
+    to_user = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal("0.01"))
+
+    def validate(self, attrs):
+        user = self.context["request"].user
+        attrs.setdefault("from_user", user.pk)
+        if attrs["from_user"] == attrs["to_user"]:
+            raise serializers.ValidationError("A settlement needs two different users.")
+        if attrs["from_user"] != user.pk:
+            # Only the payer can record a payment, as it debits their wallet
+            raise serializers.ValidationError("You can only record settlements you paid.")
+        return attrs
+
+
+def _settle(request, transfers):
+    # Payments may pass through the payer's friends, like a settle-up plan
+    via = simplify.group_user_ids(request.user.student_profile)
+    return settlements.settle(
+        ((transfer["from_user"], transfer["to_user"], transfer["amount"]) for transfer in transfers), via=via
+    )
+
+
+def _check_settlement_users(transfers):
+    user_ids = {transfer[field] for transfer in transfers for field in ("from_user", "to_user")}
+    found = set(Student.objects.filter(user_id__in=user_ids).values_list("user_id", flat=True))
+    missing = sorted(user_ids - found)
+    if missing:
+        raise serializers.ValidationError(
+            f"Invalid user id(s): {', '.join(str(pk) for pk in missing)}."
+        )
+
+
+class SettlementCreateSerializer(SettlementInputSerializer):
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        _check_settlement_users([attrs])
+        return attrs
+
+    def create(self, validated_data):
+        try:
+            created = _settle(self.context["request"], [validated_data])
+        except ValueError as error:
+            raise serializers.ValidationError({"amount": [str(error)]})
+        # One settlement per link when the payment runs through friends
+        return {"settlements": created}
+
+    def to_representation(self, instance):
+        return {"settlements": SettlementSerializer(instance["settlements"], many=True).data}
+
+
+class SettlementBatchSerializer(serializers.Serializer):
+    transfers = SettlementInputSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_transfers(self, value):
+        _check_settlement_users(value)
+        return value
+
+    def create(self, validated_data):
+        # All or nothing, in one transaction
+        try:
+            created = _settle(self.context["request"], validated_data["transfers"])
+        except ValueError as error:
+            raise serializers.ValidationError({"transfers": [str(error)]})
+        return {"settlements": created}
+
+    def to_representation(self, instance):
+        return {"settlements": SettlementSerializer(instance["settlements"], many=True).data}
+
+
+# ---------------------------
+# Analytics
+# ---------------------------
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    months = serializers.IntegerField(min_value=1, max_value=36, default=12)
+
+
+class MonthlySpendSerializer(serializers.Serializer):
+    month = serializers.DateField(format="%Y-%m")
+    paid = serializers.DecimalField(max_digits=14, decimal_places=2)
+    lent = serializers.DecimalField(max_digits=14, decimal_places=2)
+    owed = serializers.DecimalField(max_digits=14, decimal_places=2)
+    spent = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class DepartmentSpendSerializer(serializers.Serializer):
+    department = serializers.CharField()
+    paid = serializers.DecimalField(max_digits=14, decimal_places=2)
+    lent = serializers.DecimalField(max_digits=14, decimal_places=2)
+    owed = serializers.DecimalField(max_digits=14, decimal_places=2)
+    spent = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class CoSpenderSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(source="other_id")
+    username = serializers.CharField(source="other__username")
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    shares = serializers.IntegerField()
+
+
+# ---------------------------
+# Sync
+# ---------------------------
+
+class SyncQuerySerializer(serializers.Serializer):
+    since = serializers.CharField(required=False)
+
+    def validate_since(self, value):
+        try:
+            sync.decode_cursor(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
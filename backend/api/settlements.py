@@ -0,0 +1,224 @@
+# api/settlements.py
+"""
+Recording payments that settle debts between students.
+
+A settlement of ``amount`` from D to C means D paid C back outside the app.
+The payment runs along debts: straight to C if D owes C, or through people
+in between, so D paying C settles D's debt to B and B's debt to C. Each
+link is stored as its own Settlement. What no chain of debts carries is
+recorded D to C directly, as long as D owes the group at least ``amount``
+and C is owed at least that much, so a settle-up plan (see api/simplify.py)
+can always be recorded and nobody can turn a payment into a debt of the
+group:
+
+* C's wallet goes up and D's goes down by ``amount``; people in between
+  pay on what they receive. Wallet rows are locked in primary-key order and
+  changed with F() expressions, so concurrent settlements neither lose
+  updates nor deadlock on each other.
+* The ledger counts each link like removing a share that its payer owed.
+* Shares are marked settled, oldest first, as far as everything paid along
+  their pair so far covers them.
+
+Transfers are ``(from_user_id, to_user_id, amount)`` tuples, so one transfer
+and a whole settle-up plan go through the same code.
+"""
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import events, ledger, response_cache
+from .authentication import invalidate_user as invalidate_cached_user
+from .models import Student, ArchivedExpenseShare, ExpenseShare, PairBalance, Settlement
+
+
+def settle(transfers, via=()):
+    """
+    Record ``transfers`` atomically and return the created Settlements, one
+    per link. Payments may pass through the users in ``via`` (usually the
+    payer's friends) and are checked against balances among them. Raises
+    ValueError, recording nothing, if a payer would pay someone more than
+    they owe them.
+    """
+    transfers = [(from_id, to_id, Decimal(amount)) for from_id, to_id, amount in transfers]
+    if not transfers:
+        return []
+
+    with transaction.atomic():
+        user_ids = set(via) | {user_id for from_id, to_id, _ in transfers for user_id in (from_id, to_id)}
+        # Lock before writing anything, always in the same order
+        list(Student.objects.select_for_update().filter(user_id__in=user_ids).order_by("pk").values_list("pk"))
+        links = _route(transfers, user_ids)
+
+        wallet_deltas = defaultdict(Decimal)
+        for (from_id, to_id), amount in links.items():
+            wallet_deltas[from_id] -= amount
+            wallet_deltas[to_id] += amount
+        wallet_deltas = {user_id: delta for user_id, delta in wallet_deltas.items() if delta}
+        if wallet_deltas:
+            Student.objects.filter(user_id__in=wallet_deltas).update(
+                wallet_balance=F("wallet_balance") + Case(
+                    *(When(user_id=user_id, then=Value(delta)) for user_id, delta in wallet_deltas.items()),
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                )
+            )
+        settlements = Settlement.objects.bulk_create(
+            Settlement(from_user_id=from_id, to_user_id=to_id, amount=amount)
+            for (from_id, to_id), amount in links.items()
+        )
+        ledger.add_settlements((from_id, to_id, amount) for (from_id, to_id), amount in links.items())
+        mark_settled_shares(links)
+        _invalidate(list({user_id for pair in links for user_id in pair}))
+    return settlements
+
+
+def _route(transfers, user_ids):
+    """
+    Split ``transfers`` into links along the debts among ``user_ids``; returns
+    ``{(from_id, to_id): amount}``. Each transfer takes the shortest chains
+    first, and may undo links of earlier transfers in the batch (max flow).
+    """
+    debts = defaultdict(Decimal)
+    neighbours = defaultdict(set)
+    nets = defaultdict(Decimal)
+    # Locked, so a share deleted meanwhile cannot lower a debt under us
+    rows = (
+        PairBalance.objects.select_for_update()
+        .filter(user_id__in=user_ids, other_id__in=user_ids, amount__gt=0)
+        .values_list("other_id", "user_id", "amount")
+    )
+    for debtor_id, creditor_id, amount in rows:
+        debts[debtor_id, creditor_id] = amount
+        neighbours[debtor_id].add(creditor_id)
+        neighbours[creditor_id].add(debtor_id)
+        nets[debtor_id] -= amount
+        nets[creditor_id] += amount
+
+    links = defaultdict(Decimal)
+
+    def room(from_id, to_id):
+        # What from_id can still pay to_id: its debt, plus links the other way to undo
+        return debts[from_id, to_id] - links[from_id, to_id] + links[to_id, from_id]
+
+    def pay(from_id, to_id, amount):
+        undone = min(amount, links[to_id, from_id])
+        links[to_id, from_id] -= undone
+        links[from_id, to_id] += amount - undone
+        neighbours[from_id].add(to_id)
+        neighbours[to_id].add(from_id)
+
+    for from_id, to_id, amount in transfers:
+        left = amount
+        while left:
+            parents = {from_id: None}
+            queue = deque([from_id])
+            while queue and to_id not in parents:
+                user_id = queue.popleft()
+                for other_id in neighbours[user_id]:
+                    if other_id not in parents and room(user_id, other_id) > 0:
+                        parents[other_id] = user_id
+                        queue.append(other_id)
+            if to_id not in parents:
+                break
+            path = [to_id]
+            while parents[path[-1]] is not None:
+                path.append(parents[path[-1]])
+            path.reverse()
+            step = min(left, *(room(a, b) for a, b in zip(path, path[1:])))
+            for a, b in zip(path, path[1:]):
+                pay(a, b, step)
+            left -= step
+
+        if left:
+            # No chain of debts carries the rest; net balances still have to
+            if amount > min(-nets[from_id], nets[to_id]):
+                can_pay = max(amount - left, min(-nets[from_id], nets[to_id]), Decimal("0"))
+                raise ValueError(f"User {from_id} owes user {to_id} {can_pay}, less than the {amount} being settled.")
+            pay(from_id, to_id, left)
+        nets[from_id] += amount
+        nets[to_id] -= amount
+    return {pair: amount for pair, amount in links.items() if amount}
+
+
+def mark_settled_shares(pairs):
+    """
+    For each ``(from_user_id, to_user_id)`` pair, mark the debtor's unsettled
+    shares on the creditor's expenses settled, oldest first, while the
+    debtor's settlements to the creditor cover them. Returns the ids of the
+    shares marked.
+    """
+    pairs = list(pairs)
+    marked = set()
+    if not pairs:
+        return marked
+    paid = defaultdict(Decimal)
+    for start in range(0, len(pairs), ledger.LOOKUP_CHUNK_SIZE):
+        chunk = pairs[start:start + ledger.LOOKUP_CHUNK_SIZE]
+        settlements = (
+            Settlement.objects.filter(_pair_condition(chunk, "from_user_id", "to_user_id"))
+            .values_list("from_user_id", "to_user_id")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        shares = ExpenseShare.objects.filter(_pair_condition(chunk, "payee_id", "expense__payer_id"))
+        covered = (
+            shares.filter(settled=True)
+            .values_list("payee_id", "expense__payer_id")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        # Archived shares were all settled, see api/archive.py
+        archived = (
+            ArchivedExpenseShare.objects.filter(_pair_condition(chunk, "payee_id", "expense__payer_id"))
+            .values_list("payee_id", "expense__payer_id")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        for from_id, to_id, total in settlements:
+            paid[from_id, to_id] += total
+        for from_id, to_id, total in (*covered, *archived):
+            paid[from_id, to_id] -= total
+
+        settled, blocked = [], set()
+        open_shares = (
+            shares.filter(settled=False)
+            .order_by("expense__created_at", "expense_id", "id")
+            .values_list("id", "expense_id", "payee_id", "expense__payer_id", "amount")
+        )
+        for share_id, expense_id, from_id, to_id, amount in open_shares:
+            pair = (from_id, to_id)
+            if pair in blocked:
+                continue
+            if paid[pair] >= amount:
+                paid[pair] -= amount
+                settled.append((share_id, expense_id, to_id, from_id))
+            else:
+                # Later shares wait until this one is covered
+                blocked.add(pair)
+        if settled:
+            ExpenseShare.objects.filter(pk__in=[row[0] for row in settled]).update(
+                settled=True, updated_at=timezone.now()
+            )
+            if events.enabled():
+                events.publish(events.share_messages("updated", settled))
+            marked.update(row[0] for row in settled)
+    return marked
+
+
+def _pair_condition(pairs, from_field, to_field):
+    condition = Q()
+    for from_id, to_id in pairs:
+        condition |= Q(**{from_field: from_id, to_field: to_id})
+    return condition
+
+
+def _invalidate(user_ids):
+    # The queryset updates above skip every post_save receiver
+    response_cache.invalidate(user_ids, response_cache.PROFILE, response_cache.EXPENSES)
+    response_cache.invalidate(
+        Student.objects.filter(friends__user_id__in=user_ids).values_list("user_id", flat=True),
+        response_cache.FRIENDS,
+    )
+    transaction.on_commit(lambda: [invalidate_cached_user(user_id) for user_id in user_ids])
@@ -1,14 +1,509 @@
-from django.db.models.signals import post_save
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import Student
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from . import analytics, events, friend_graph, ledger, response_cache, settlements, sync
+from .authentication import invalidate_user as invalidate_cached_user, mark_blacklisted
+from .models import Student, ArchivedExpense, ArchivedExpenseShare, Expense, ExpenseShare, Settlement
+
+# Expenses whose shares are being reversed in bulk, by the expense's own
+# pre_delete or by deleting_shares_in_bulk(), so the per-share post_delete
+# fired along the way must not reverse them again.
+_deleting = threading.local()
+
+
+def _deleting_expenses():
+    if not hasattr(_deleting, "expense_ids"):
+        _deleting.expense_ids = set()
+    return _deleting.expense_ids
+
+
+@contextmanager
+def deleting_shares_in_bulk(expense_ids):
+    """
+    Delete shares of ``expense_ids`` inside the block without the per-share
+    receivers; the caller updates the ledger, rollups, caches and sync
+    tombstones, and publishes events, itself.
+    """
+    expense_ids = set(expense_ids) - _deleting_expenses()
+    _deleting_expenses().update(expense_ids)
+    try:
+        yield
+    finally:
+        _deleting_expenses().difference_update(expense_ids)
+
+
+def _archiving_expenses():
+    if not hasattr(_deleting, "archived_ids"):
+        _deleting.archived_ids = set()
+    return _deleting.archived_ids
+
+
+@contextmanager
+def archiving(expense_ids):
+    """
+    Delete the expenses ``expense_ids`` and their shares inside the block
+    without any delete receivers: they moved to the archive tables (see
+    api/archive.py), so no balance, rollup or sync client loses them.
+    """
+    expense_ids = set(expense_ids)
+    _archiving_expenses().update(expense_ids)
+    try:
+        with deleting_shares_in_bulk(expense_ids):
+            yield
+    finally:
+        _archiving_expenses().difference_update(expense_ids)
+
+
+def _share_payer_id(share):
+    if ExpenseShare.expense.is_cached(share):
+        return share.expense.payer_id
+    return Expense.objects.filter(pk=share.expense_id).values_list("payer_id", flat=True).first()
+
+
+def _share_row(share):
+    # The share as an analytics row: (payer_id, payee_id, created_at, amount)
+    if ExpenseShare.expense.is_cached(share):
+        payer_id, created_at = share.expense.payer_id, share.expense.created_at
+    else:
+        payer_id, created_at = Expense.objects.filter(pk=share.expense_id).values_list("payer_id", "created_at").first()
+    return payer_id, share.payee_id, created_at, share.amount
+
 
 @receiver(post_save, sender=User)
 def create_student_profile(sender, instance, created, **kwargs):
     if created:
         Student.objects.create(user=instance)
 
+
+# ---------------------------
+# Balance ledger
+# ---------------------------
+
+@receiver(pre_save, sender=Expense)
+def remember_expense_payer(sender, instance, **kwargs):
+    instance._previous_payer_id = instance._previous_row = None
+    if instance.pk:
+        instance._previous_row = (
+            Expense.objects.filter(pk=instance.pk).values_list("payer_id", "created_at", "amount").first()
+        )
+        if instance._previous_row:
+            instance._previous_payer_id = instance._previous_row[0]
+
+
+@receiver(post_save, sender=Expense)
+def move_expense_balances(sender, instance, created, **kwargs):
+    previous_payer_id = getattr(instance, "_previous_payer_id", None)
+    if created or previous_payer_id is None or previous_payer_id == instance.payer_id:
+        return
+    shares = list(instance.shares.values_list("payee_id", "amount"))
+    ledger.remove_shares((previous_payer_id, payee_id, amount) for payee_id, amount in shares)
+    ledger.add_shares((instance.payer_id, payee_id, amount) for payee_id, amount in shares)
+
+
+@receiver(pre_delete, sender=Expense)
+def reverse_expense_balances(sender, instance, **kwargs):
+    if instance.pk in _archiving_expenses():
+        return
+    _deleting_expenses().add(instance.pk)
+    ledger.remove_shares(
+        (instance.payer_id, payee_id, amount)
+        for payee_id, amount in instance.shares.values_list("payee_id", "amount")
+    )
+
+
+@receiver(post_delete, sender=Expense)
+def forget_deleted_expense(sender, instance, **kwargs):
+    _deleting_expenses().discard(instance.pk)
+
+
+@receiver(pre_save, sender=ExpenseShare)
+def remember_share(sender, instance, **kwargs):
+    instance._previous_row = instance._previous_created_at = None
+    if instance.pk:
+        row = (
+            ExpenseShare.objects.filter(pk=instance.pk)
+            .values_list("expense__payer_id", "payee_id", "amount", "expense__created_at")
+            .first()
+        )
+        if row:
+            instance._previous_row, instance._previous_created_at = row[:3], row[3]
+
+
+@receiver(post_save, sender=ExpenseShare)
+def apply_share_balance(sender, instance, **kwargs):
+    previous_row = getattr(instance, "_previous_row", None)
+    if previous_row:
+        ledger.remove_shares([previous_row])
+    ledger.add_shares([(_share_payer_id(instance), instance.payee_id, instance.amount)])
+
+
+@receiver(post_delete, sender=ExpenseShare)
+def reverse_share_balance(sender, instance, **kwargs):
+    if instance.expense_id in _deleting_expenses():
+        return
+    ledger.remove_shares([(_share_payer_id(instance), instance.payee_id, instance.amount)])
+
+
+@receiver(post_delete, sender=Settlement)
+def reverse_settlement_balance(sender, instance, **kwargs):
+    # Settlements are only deleted with one of their users
+    ledger.remove_settlements([(instance.from_user_id, instance.to_user_id, instance.amount)])
+
+
+# ---------------------------
+# Settled shares
+# ---------------------------
+# A share stays settled only while its payee's settlements to its payer
+# cover it, see api/settlements.py. Changing who owes whom, or raising what
+# is owed, unsettles it; the pairs involved are then settled again as far
+# as their settlements go, which also uses up credit a lowered share frees.
+
+@receiver(pre_save, sender=ExpenseShare)
+def unsettle_changed_share(sender, instance, **kwargs):
+    previous_row = getattr(instance, "_previous_row", None)
+    if previous_row and (instance.payee_id != previous_row[1] or instance.amount > previous_row[2]):
+        instance.settled = False
+
+
+@receiver(post_save, sender=ExpenseShare)
+def resettle_share(sender, instance, created, **kwargs):
+    previous_row = getattr(instance, "_previous_row", None)
+    if not created and previous_row and previous_row[1:] == (instance.payee_id, instance.amount):
+        return
+    pairs = {(instance.payee_id, _share_payer_id(instance))}
+    if previous_row:
+        pairs.add((previous_row[1], previous_row[0]))
+    if instance.pk in settlements.mark_settled_shares(pairs):
+        instance.settled = True
+
+
+@receiver(post_save, sender=Expense)
+def resettle_moved_expense(sender, instance, created, **kwargs):
+    previous_payer_id = getattr(instance, "_previous_payer_id", None)
+    if created or previous_payer_id is None or previous_payer_id == instance.payer_id:
+        return
+    # The new payer was never paid for these shares
+    payee_ids = list(instance.shares.values_list("payee_id", flat=True))
+    instance.shares.filter(settled=True).update(settled=False, updated_at=timezone.now())
+    settlements.mark_settled_shares(
+        (payee_id, payer_id) for payee_id in payee_ids for payer_id in (previous_payer_id, instance.payer_id)
+    )
+
+
+# ---------------------------
+# Analytics rollups
+# ---------------------------
+
+@receiver(post_save, sender=Expense)
+def update_expense_rollups(sender, instance, created, **kwargs):
+    row = (instance.payer_id, instance.created_at, instance.amount)
+    if created:
+        analytics.add(expenses=[row])
+        return
+    previous_row = getattr(instance, "_previous_row", None)
+    if previous_row is None:
+        return
+
+    old_shares = new_shares = ()
+    if previous_row[0] != instance.payer_id:
+        # Who lent the shares changes with the payer
+        shares = list(instance.shares.values_list("payee_id", "amount"))
+        old_shares = [(previous_row[0], payee_id, previous_row[1], amount) for payee_id, amount in shares]
+        new_shares = [(instance.payer_id, payee_id, instance.created_at, amount) for payee_id, amount in shares]
+    analytics.replace([previous_row], old_shares, [row], new_shares)
+
+
+@receiver(pre_delete, sender=Expense)
+def reverse_expense_rollups(sender, instance, **kwargs):
+    # Its shares are skipped by reverse_share_rollups, see reverse_expense_balances
+    if instance.pk in _archiving_expenses():
+        return
+    analytics.remove(
+        expenses=[(instance.payer_id, instance.created_at, instance.amount)],
+        shares=[
+            (instance.payer_id, payee_id, instance.created_at, amount)
+            for payee_id, amount in instance.shares.values_list("payee_id", "amount")
+        ],
+    )
+
+
+@receiver(post_save, sender=ExpenseShare)
+def update_share_rollups(sender, instance, **kwargs):
+    previous_row = getattr(instance, "_previous_row", None)
+    old_shares = [(*previous_row[:2], instance._previous_created_at, previous_row[2])] if previous_row else []
+    analytics.replace(old_shares=old_shares, new_shares=[_share_row(instance)])
+
+
+@receiver(post_delete, sender=ExpenseShare)
+def reverse_share_rollups(sender, instance, **kwargs):
+    if instance.expense_id in _deleting_expenses():
+        return
+    analytics.remove(shares=[_share_row(instance)])
+
+
+@receiver(pre_delete, sender=User)
+def remember_deleted_user_department(sender, instance, **kwargs):
+    # The cascade may delete the profile before the shares it reverses
+    analytics.deleting_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def forget_deleted_user_department(sender, instance, **kwargs):
+    analytics.deleted_user(instance.pk)
+
+
+@receiver(pre_save, sender=Student)
+def remember_student_department(sender, instance, update_fields=None, **kwargs):
+    instance._previous_department = None
+    if instance.pk and not instance._state.adding and (update_fields is None or "department" in update_fields):
+        instance._previous_department = (
+            Student.objects.filter(pk=instance.pk).values_list("department", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Student)
+def move_department_rollups(sender, instance, created, **kwargs):
+    previous_department = getattr(instance, "_previous_department", None)
+    if not created and previous_department is not None and previous_department != instance.department:
+        analytics.move_department(instance.user_id, previous_department, instance.department)
+
+
+# ---------------------------
+# Archived history
+# ---------------------------
+# Archived rows are only deleted with one of their users. The ledger and
+# rollups still count them, so they are reversed like live ones; sync
+# clients and the event stream never saw them.
+
+@receiver(pre_delete, sender=ArchivedExpense)
+def reverse_archived_expense(sender, instance, **kwargs):
+    # Ids are shared with Expense, so its shares are skipped the same way
+    _deleting_expenses().add(instance.pk)
+    shares = list(instance.shares.values_list("payee_id", "amount"))
+    ledger.remove_shares((instance.payer_id, payee_id, amount) for payee_id, amount in shares)
+    analytics.remove(
+        expenses=[(instance.payer_id, instance.created_at, instance.amount)],
+        shares=[(instance.payer_id, payee_id, instance.created_at, amount) for payee_id, amount in shares],
+    )
+    response_cache.invalidate([instance.payer_id, *(payee_id for payee_id, _ in shares)], response_cache.EXPENSES)
+
+
+@receiver(post_delete, sender=ArchivedExpense)
+def forget_deleted_archived_expense(sender, instance, **kwargs):
+    _deleting_expenses().discard(instance.pk)
+
+
+@receiver(post_delete, sender=ArchivedExpenseShare)
+def reverse_archived_share(sender, instance, **kwargs):
+    if instance.expense_id in _deleting_expenses():
+        return
+    payer_id, created_at = (
+        ArchivedExpense.objects.filter(pk=instance.expense_id).values_list("payer_id", "created_at").first()
+    )
+    ledger.remove_shares([(payer_id, instance.payee_id, instance.amount)])
+    analytics.remove(shares=[(payer_id, instance.payee_id, created_at, instance.amount)])
+    response_cache.invalidate([payer_id, instance.payee_id], response_cache.EXPENSES)
+
+
+# ---------------------------
+# Sync tombstones
+# ---------------------------
+
+@receiver(post_save, sender=Expense)
+def record_expense_left_by_payer(sender, instance, created, **kwargs):
+    previous_payer_id = getattr(instance, "_previous_payer_id", None)
+    if not created and previous_payer_id is not None and previous_payer_id != instance.payer_id:
+        sync.record_left_expenses([(instance.pk, previous_payer_id)])
+
+
+@receiver(pre_delete, sender=Expense)
+def record_deleted_expense(sender, instance, **kwargs):
+    # Its shares go with it, see reverse_expense_balances
+    if instance.pk in _archiving_expenses():
+        return
+    payee_ids = list(instance.shares.values_list("payee_id", flat=True))
+    sync.record_deleted_expenses([(instance.pk, [instance.payer_id, *payee_ids])])
+
+
+@receiver(post_save, sender=ExpenseShare)
+def touch_expense_for_new_payee(sender, instance, created, **kwargs):
+    previous_row = getattr(instance, "_previous_row", None)
+    previous_payee_id = previous_row[1] if previous_row else None
+    if created or previous_payee_id != instance.payee_id:
+        # So the payee's next sync brings the expense along with the share
+        sync.touch_expenses([instance.expense_id])
+    if previous_payee_id is not None and previous_payee_id != instance.payee_id:
+        sync.record_left_expenses([(instance.expense_id, previous_payee_id)])
+
+
+@receiver(post_delete, sender=ExpenseShare)
+def record_deleted_share(sender, instance, **kwargs):
+    if instance.expense_id in _deleting_expenses():
+        return
+    sync.record_deleted_shares([(instance.pk, instance.expense_id, instance.payee_id)])
+
+
+# ---------------------------
+# Event stream
+# ---------------------------
+
+@receiver(post_save, sender=Expense)
+def push_expense(sender, instance, created, **kwargs):
+    if not events.enabled():
+        return
+    payee_ids = [] if created else list(instance.shares.values_list("payee_id", flat=True))
+    events.publish([(
+        [instance.payer_id, getattr(instance, "_previous_payer_id", None), *payee_ids],
+        {"type": "expense.created" if created else "expense.updated", "id": instance.pk},
+    )])
+
+
+@receiver(pre_delete, sender=Expense)
+def push_deleted_expense(sender, instance, **kwargs):
+    # Its shares go with it, see reverse_expense_balances
+    if instance.pk in _archiving_expenses() or not events.enabled():
+        return
+    payee_ids = list(instance.shares.values_list("payee_id", flat=True))
+    events.publish([([instance.payer_id, *payee_ids], {"type": "expense.deleted", "id": instance.pk})])
+
+
+@receiver(post_save, sender=ExpenseShare)
+def push_share(sender, instance, created, **kwargs):
+    if not events.enabled():
+        return
+    previous_row = getattr(instance, "_previous_row", None) or (None, None, None)
+    events.publish([(
+        [_share_payer_id(instance), instance.payee_id, previous_row[1]],
+        {"type": "share.created" if created else "share.updated", "id": instance.pk, "expense": instance.expense_id},
+    )])
+
+
+@receiver(post_delete, sender=ExpenseShare)
+def push_deleted_share(sender, instance, **kwargs):
+    if instance.expense_id in _deleting_expenses() or not events.enabled():
+        return
+    events.publish([(
+        [_share_payer_id(instance), instance.payee_id],
+        {"type": "share.deleted", "id": instance.pk, "expense": instance.expense_id},
+    )])
+
+
+# ---------------------------
+# Response cache invalidation
+# ---------------------------
+
+def _friend_of_user_ids(student_ids):
+    # Users whose friend list includes any of these students
+    return Student.objects.filter(friends__in=student_ids).values_list("user_id", flat=True)
+
+
+@receiver(post_save, sender=Expense)
+def invalidate_expense(sender, instance, created, **kwargs):
+    payee_ids = [] if created else list(instance.shares.values_list("payee_id", flat=True))
+    previous_payer_id = getattr(instance, "_previous_payer_id", None)
+    response_cache.invalidate([instance.payer_id, previous_payer_id, *payee_ids], response_cache.EXPENSES)
+
+
+@receiver(pre_delete, sender=Expense)
+def invalidate_deleted_expense(sender, instance, **kwargs):
+    if instance.pk in _archiving_expenses():
+        return
+    payee_ids = list(instance.shares.values_list("payee_id", flat=True))
+    response_cache.invalidate([instance.payer_id, *payee_ids], response_cache.EXPENSES)
+
+
+@receiver(post_save, sender=ExpenseShare)
+@receiver(post_delete, sender=ExpenseShare)
+def invalidate_share(sender, instance, **kwargs):
+    if instance.expense_id in _deleting_expenses():
+        return
+    previous_row = getattr(instance, "_previous_row", None) or (None, None, None)
+    response_cache.invalidate(
+        [_share_payer_id(instance), instance.payee_id, previous_row[1]],
+        response_cache.EXPENSES,
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_user(sender, instance, created, **kwargs):
+    if created:
+        return
+    response_cache.invalidate([instance.pk], response_cache.PROFILE)
+    response_cache.invalidate(
+        _friend_of_user_ids(Student.objects.filter(user=instance).values("pk")), response_cache.FRIENDS
+    )
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_student(sender, instance, created=False, **kwargs):
+    response_cache.invalidate([instance.user_id], response_cache.PROFILE)
+    if not created:
+        # A brand-new profile is in nobody's friend list yet
+        response_cache.invalidate(_friend_of_user_ids([instance.pk]), response_cache.FRIENDS)
+
+
+@receiver(m2m_changed, sender=Student.friends.through)
+def invalidate_friendship(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and reverse:
+        # The students losing `instance` as a friend are unknown after the clear
+        instance._cleared_friend_of = list(instance.friend_of.values_list("pk", flat=True))
+        return
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if reverse:
+        student_ids = pk_set if action != "post_clear" else getattr(instance, "_cleared_friend_of", [])
+        user_ids = list(Student.objects.filter(pk__in=student_ids).values_list("user_id", flat=True))
+    else:
+        user_ids = [instance.user_id]
+    response_cache.invalidate(user_ids, response_cache.FRIENDS, response_cache.PROFILE)
+
+
+# ---------------------------
+# Friend graph cache
+# ---------------------------
+
+@receiver(m2m_changed, sender=Student.friends.through)
+def invalidate_friend_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # See invalidate_friendship for _cleared_friend_of
+        friend_graph.invalidate(pk_set if action != "post_clear" else getattr(instance, "_cleared_friend_of", []))
+    else:
+        friend_graph.invalidate([instance.pk])
+
+
+@receiver(pre_delete, sender=Student)
+def invalidate_deleted_student_friend_ids(sender, instance, **kwargs):
+    # The cascade removes its friendships without m2m_changed
+    friend_graph.invalidate([instance.pk, *instance.friend_of.values_list("pk", flat=True)])
+
+
+# ---------------------------
+# Authentication cache
+# ---------------------------
+
 @receiver(post_save, sender=User)
-def save_student_profile(sender, instance, **kwargs):
-    if hasattr(instance, "student_profile"):
-        instance.student_profile.save()
+@receiver(post_delete, sender=User)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=Student)
+@receiver(post_delete, sender=Student)
+def invalidate_authenticated_student(sender, instance, **kwargs):
+    invalidate_cached_user(instance.user_id)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def cache_blacklisted_token(sender, instance, created, **kwargs):
+    # Covers tokens blacklisted outside CachedRefreshToken, e.g. from the admin
+    if created:
+        mark_blacklisted(instance.token.jti, instance.token.expires_at.timestamp())
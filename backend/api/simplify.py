@@ -0,0 +1,79 @@
+# api/simplify.py
+"""
+Debt simplification: turn a group's net balances into a short list of
+settlement transfers.
+
+Balances are aggregated in the database from the pair ledger and handled as
+integer cents in flat arrays, which keeps the arithmetic exact without paying
+for Decimal objects in the inner loop.
+"""
+import heapq
+from array import array
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from .models import PairBalance
+
+CENTS = Decimal("0.01")
+
+
+def group_user_ids(student):
+    # The student's user plus the users behind everyone in their friends list
+    return [student.user_id, *student.friends.values_list("user_id", flat=True)]
+
+
+def net_balances(user_ids):
+    """
+    Return ``(user_ids, nets)`` arrays where ``nets[i]`` is what the group owes
+    ``user_ids[i]`` in cents (negative when they owe the group). Only debts
+    between members of the group are counted; zero balances are dropped.
+    """
+    user_ids = list(user_ids)
+    rows = (
+        PairBalance.objects.filter(user_id__in=user_ids, other_id__in=user_ids)
+        .values_list("user_id")
+        .annotate(net=Sum("amount"))
+        .order_by()
+    )
+    ids, nets = array("q"), array("q")
+    for user_id, net in rows:
+        cents = int(net.quantize(CENTS) * 100)
+        if cents:
+            ids.append(user_id)
+            nets.append(cents)
+    return ids, nets
+
+
+def simplify(ids, nets):
+    """
+    Greedy minimum cash flow: repeatedly settle the largest debtor against the
+    largest creditor. Every transfer clears at least one side, so a group of n
+    people needs at most n - 1 transfers. Returns ``(from_id, to_id, cents)``.
+    """
+    creditors = [(-net, user_id) for user_id, net in zip(ids, nets) if net > 0]
+    debtors = [(net, user_id) for user_id, net in zip(ids, nets) if net < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return transfers
+
+
+def settle_up(user_ids):
+    # Transfers between users who owe each other nothing directly are still
+    # recorded along the debts behind them, see api/settlements.py
+    transfers = simplify(*net_balances(user_ids))
+    return [
+        {"from_user_id": debtor, "to_user_id": creditor, "amount": Decimal(cents) / 100}
+        for debtor, creditor, cents in transfers
+    ]
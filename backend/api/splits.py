@@ -0,0 +1,146 @@
+# api/splits.py
+"""
+Splitting an expense into shares on the server.
+
+Participants come as ``(user_id, value)`` pairs, and the payer can be one of
+them: their part is what they keep and never becomes a share.
+
+* equal: the same part for everyone; ``value`` is ignored.
+* weighted: parts proportional to ``value``.
+* percentage: ``value`` percent each; whatever is left is the payer's.
+* exact: ``value`` is the amount itself, in whole cents.
+
+Except for exact splits, amounts are worked out in whole cents and add up to
+the expense amount: every part is rounded down, then the cents left over go
+one each to the largest remainders, ties to whoever is listed first. The same
+input always gives the same split.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import analytics, events, ledger, response_cache, settlements, sync
+from .models import Expense, ExpenseShare
+from .signals import deleting_shares_in_bulk
+
+EQUAL, WEIGHTED, PERCENTAGE, EXACT = "equal", "weighted", "percentage", "exact"
+STRATEGIES = (EQUAL, WEIGHTED, PERCENTAGE, EXACT)
+
+CENTS = Decimal("0.01")
+HUNDRED = Decimal("100")
+
+
+def split(amount, strategy, values):
+    """
+    ``{user_id: amount}`` for ``values``, a list of ``(user_id, value)``
+    pairs, in the same order. Raises ValueError for a split that cannot be
+    made.
+    """
+    if strategy == EXACT:
+        amounts = {user_id: Decimal(value) for user_id, value in values}
+        if any(value != value.quantize(CENTS) for value in amounts.values()):
+            raise ValueError("Exact amounts must be in whole cents.")
+        if sum(amounts.values()) > amount:
+            raise ValueError("Shares cannot add up to more than the expense amount.")
+        return amounts
+
+    user_ids = [user_id for user_id, _ in values]
+    if strategy == EQUAL:
+        weights = [1] * len(values)
+    elif strategy == WEIGHTED:
+        weights = [Decimal(value) for _, value in values]
+    elif strategy == PERCENTAGE:
+        weights = [Decimal(value) for _, value in values]
+        rest = HUNDRED - sum(weights)
+        if rest < 0:
+            raise ValueError("Percentages cannot add up to more than 100.")
+        # The payer's part, dropped below
+        user_ids.append(None)
+        weights.append(rest)
+    else:
+        raise ValueError(f"Unknown split strategy: {strategy}.")
+    if sum(weights) <= 0:
+        raise ValueError("Weights must add up to more than zero.")
+
+    amounts = {}
+    for user_id, cents in zip(user_ids, apportion(int(amount / CENTS), weights)):
+        if user_id is not None:
+            amounts[user_id] = amounts.get(user_id, 0) + Decimal(cents) * CENTS
+    return amounts
+
+
+def apportion(total, weights):
+    """Split the integer ``total`` in proportion to ``weights`` by largest remainder."""
+    weight_sum = sum(weights)
+    parts = [int(total * weight // weight_sum) for weight in weights]
+    remainders = [total * weight % weight_sum for weight in weights]
+    # sorted() is stable, so equal remainders keep the listed order
+    for index in sorted(range(len(weights)), key=lambda i: -remainders[i])[:total - sum(parts)]:
+        parts[index] += 1
+    return parts
+
+
+def resplit(expense_id, payer_id, strategy, values):
+    """
+    Replace every share of the payer's expense with a split of its amount,
+    in one transaction, and return the expense. Payees whose amount is
+    unchanged keep their share as it is; changed shares are unsettled and
+    settled again as far as the payee's settlements cover them.
+
+    Raises Expense.DoesNotExist unless ``payer_id`` paid the expense, and
+    ValueError for a split that cannot be made.
+    """
+    with transaction.atomic():
+        expense = (
+            Expense.objects.select_related("payer").select_for_update(of=("self",))
+            .get(pk=expense_id, payer_id=payer_id)
+        )
+        amounts = split(expense.amount, strategy, values)
+        amounts.pop(payer_id, None)
+        amounts = {payee_id: amount for payee_id, amount in amounts.items() if amount}
+
+        kept, stale = {}, []
+        for share in expense.shares.order_by("id"):
+            if share.payee_id in amounts and share.payee_id not in kept:
+                kept[share.payee_id] = share
+            else:
+                stale.append(share)
+        changed = [share for payee_id, share in kept.items() if share.amount != amounts[payee_id]]
+        old_rows = [(share.payee_id, share.amount) for share in stale + changed]
+        now = timezone.now()
+        for share in changed:
+            share.amount, share.settled, share.updated_at = amounts[share.payee_id], False, now
+        created = [
+            ExpenseShare(expense=expense, payee_id=payee_id, amount=amount)
+            for payee_id, amount in amounts.items() if payee_id not in kept
+        ]
+
+        with deleting_shares_in_bulk([expense.pk]):
+            ExpenseShare.objects.filter(pk__in=[share.pk for share in stale]).delete()
+        ExpenseShare.objects.bulk_update(changed, ["amount", "settled", "updated_at"])
+        ExpenseShare.objects.bulk_create(created)
+        if created:
+            sync.touch_expenses([expense.pk])
+
+        # None of the writes above went through the per-share receivers
+        new_rows = [(share.payee_id, share.amount) for share in changed + created]
+        ledger.remove_shares((payer_id, payee_id, amount) for payee_id, amount in old_rows)
+        ledger.add_shares((payer_id, payee_id, amount) for payee_id, amount in new_rows)
+        analytics.replace(
+            old_shares=[(payer_id, payee_id, expense.created_at, amount) for payee_id, amount in old_rows],
+            new_shares=[(payer_id, payee_id, expense.created_at, amount) for payee_id, amount in new_rows],
+        )
+        payee_ids = {payee_id for payee_id, _ in old_rows + new_rows}
+        settlements.mark_settled_shares((payee_id, payer_id) for payee_id in payee_ids)
+        sync.record_deleted_shares((share.pk, expense.pk, share.payee_id) for share in stale)
+        if events.enabled():
+            events.publish([
+                message
+                for kind, shares in (("deleted", stale), ("updated", changed), ("created", created))
+                for message in events.share_messages(
+                    kind, ((share.pk, expense.pk, payer_id, share.payee_id) for share in shares)
+                )
+            ])
+        response_cache.invalidate([payer_id, *payee_ids], response_cache.EXPENSES)
+    return expense
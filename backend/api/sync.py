@@ -0,0 +1,242 @@
+# api/sync.py
+"""
+Delta sync: what changed in a user's expenses since their last sync.
+
+Expenses and shares carry ``updated_at``, and a Tombstone is written for
+every user who loses sight of an expense or share, whether it was deleted
+(cascades included) or they were taken off it. ``changes()`` reads three
+streams, each ordered by ``(timestamp, id)`` and resumed from its own
+position in the cursor:
+
+* expenses visible to the user, updated since;
+* shares of those expenses, updated since;
+* the user's tombstones.
+
+Each stream only scans rows changed since its position, through the
+``updated_at`` and tombstone indexes, so the work follows recent activity
+rather than the size of the history.
+
+Adding a share, or giving it to another payee, touches its expense, so the
+payee also receives the expense. A deleted expense takes its shares along:
+clients drop them with it. A tombstone for a row the user can see again
+(e.g. they were put back on the expense) is left out.
+
+A stream that was read to the end moves its position to
+``now - API_SYNC_SETTLE_SECONDS`` rather than to its last row: a
+transaction that stamped its rows earlier but committed later is still
+picked up, at the cost of sending recent rows twice. Clients apply rows as
+upserts, then the deletions, so repeats are harmless; ``has_more`` means
+another request is needed before the client is consistent.
+"""
+import base64
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import fast_serializers
+from .models import Expense, ExpenseShare, Tombstone
+
+STREAMS = ("expenses", "shares", "deleted")
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class CursorExpired(Exception):
+    """The cursor is older than the kept tombstones; the client must sync from scratch."""
+
+
+def page_size():
+    return getattr(settings, "API_SYNC_PAGE_SIZE", 500)
+
+
+def tombstone_cutoff():
+    return timezone.now() - timedelta(days=getattr(settings, "API_SYNC_TOMBSTONE_DAYS", 90))
+
+
+# ---------------------------
+# Cursors
+# ---------------------------
+
+def encode_cursor(positions):
+    # Whole microseconds, so positions survive the round trip exactly
+    data = {stream: [(stamp - EPOCH) // MICROSECOND, pk] for stream, (stamp, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """``{stream: (datetime, id)}`` for a cursor from ``encode_cursor``; ValueError if it is not one."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return {
+            stream: (EPOCH + int(data[stream][0]) * MICROSECOND, int(data[stream][1])) for stream in STREAMS
+        }
+    except (ValueError, TypeError, KeyError, IndexError, OverflowError):
+        raise ValueError("Invalid cursor.")
+
+
+def settled_position():
+    return timezone.now() - timedelta(seconds=getattr(settings, "API_SYNC_SETTLE_SECONDS", 2)), 0
+
+
+# ---------------------------
+# Reading changes
+# ---------------------------
+
+def _visible_expenses(user):
+    # Unlike Expense.objects.visible_to, checked per candidate row through
+    # share_payee_expense_idx instead of collecting every expense the user is on
+    return Expense.objects.filter(
+        Q(payer=user) | Exists(ExpenseShare.objects.filter(expense_id=OuterRef("pk"), payee=user))
+    )
+
+
+def _visible_shares(user):
+    return ExpenseShare.objects.filter(
+        Q(expense__payer=user) | Exists(ExpenseShare.objects.filter(expense_id=OuterRef("expense_id"), payee=user))
+    )
+
+
+def _after(queryset, field, position):
+    stamp, pk = position
+    return (
+        queryset.filter(**{f"{field}__gte": stamp})
+        .exclude(**{field: stamp, "pk__lte": pk})
+        .order_by(field, "pk")
+    )
+
+
+def changes(user, cursor=None):
+    """
+    Everything that changed for ``user`` since ``cursor``, as a dict with the
+    next cursor. Without a cursor, nothing yet: just a cursor for the present,
+    to take before downloading the full lists.
+    """
+    if cursor is None:
+        positions = dict.fromkeys(STREAMS, settled_position())
+        return {
+            "cursor": encode_cursor(positions), "has_more": False,
+            "expenses": [], "shares": [], "deleted": {"expenses": [], "shares": []},
+        }
+
+    positions = decode_cursor(cursor)
+    if positions["deleted"][0] < tombstone_cutoff():
+        raise CursorExpired
+
+    limit = page_size()
+    settled = settled_position()
+    expenses = list(
+        _after(_visible_expenses(user), "updated_at", positions["expenses"])
+        .values(*fast_serializers.EXPENSE_FIELDS, "updated_at")[:limit + 1]
+    )
+    shares = list(
+        _after(_visible_shares(user), "updated_at", positions["shares"])
+        .values(*fast_serializers.SHARE_FIELDS, "updated_at")[:limit + 1]
+    )
+    tombstones = list(
+        _after(Tombstone.objects.filter(user=user), "deleted_at", positions["deleted"])
+        .values_list("id", "kind", "object_id", "deleted_at")[:limit + 1]
+    )
+
+    has_more = False
+    for stream, rows, position_of in (
+        ("expenses", expenses, lambda row: (row["updated_at"], row["id"])),
+        ("shares", shares, lambda row: (row["updated_at"], row["id"])),
+        ("deleted", tombstones, lambda row: (row[3], row[0])),
+    ):
+        if len(rows) > limit:
+            del rows[limit:]
+            positions[stream] = position_of(rows[-1])
+            has_more = True
+        else:
+            positions[stream] = max(positions[stream], settled)
+
+    deleted = {Tombstone.EXPENSE: set(), Tombstone.SHARE: set()}
+    for _, kind, object_id, _ in tombstones:
+        deleted[kind].add(object_id)
+    # Rows the user can see again are not gone
+    deleted[Tombstone.EXPENSE] -= set(
+        _visible_expenses(user).filter(pk__in=deleted[Tombstone.EXPENSE]).values_list("pk", flat=True)
+    )
+    deleted[Tombstone.SHARE] -= set(
+        _visible_shares(user).filter(pk__in=deleted[Tombstone.SHARE]).values_list("pk", flat=True)
+    )
+
+    return {
+        "cursor": encode_cursor(positions),
+        "has_more": has_more,
+        "expenses": fast_serializers.expenses_data(expenses),
+        "shares": fast_serializers.shares_data(shares),
+        "deleted": {
+            "expenses": sorted(deleted[Tombstone.EXPENSE]),
+            "shares": sorted(deleted[Tombstone.SHARE]),
+        },
+    }
+
+
+# ---------------------------
+# Recording what is gone
+# ---------------------------
+
+def _participants(expense_ids):
+    # {expense_id: user ids on it now}, payer included
+    participants = {}
+    for expense_id, payer_id in Expense.objects.filter(pk__in=expense_ids).values_list("pk", "payer_id"):
+        participants[expense_id] = {payer_id}
+    for expense_id, payee_id in ExpenseShare.objects.filter(expense_id__in=expense_ids).values_list(
+        "expense_id", "payee_id"
+    ):
+        participants.setdefault(expense_id, set()).add(payee_id)
+    return participants
+
+
+def record_deleted_expenses(expenses):
+    """Tombstones for deleted expenses, given as ``(expense_id, user_ids)`` of everyone who was on them."""
+    Tombstone.objects.bulk_create(
+        Tombstone(user_id=user_id, kind=Tombstone.EXPENSE, object_id=expense_id)
+        for expense_id, user_ids in expenses
+        for user_id in set(user_ids)
+    )
+
+
+def record_deleted_shares(shares):
+    """
+    Tombstones for deleted ``(share_id, expense_id, payee_id)`` shares, for
+    the payee and everyone still on the expense. A payee no longer on the
+    expense at all loses the expense too.
+    """
+    shares = list(shares)
+    if not shares:
+        return
+    participants = _participants({expense_id for _, expense_id, _ in shares})
+    tombstones = []
+    for share_id, expense_id, payee_id in shares:
+        for user_id in participants.get(expense_id, set()) | {payee_id}:
+            tombstones.append(Tombstone(user_id=user_id, kind=Tombstone.SHARE, object_id=share_id))
+    Tombstone.objects.bulk_create(tombstones)
+    record_left_expenses(((expense_id, payee_id) for _, expense_id, payee_id in shares), participants)
+
+
+def record_left_expenses(pairs, participants=None):
+    """Tombstones for ``(expense_id, user_id)`` pairs where the user is no longer on the existing expense."""
+    pairs = set(pairs)
+    if participants is None:
+        participants = _participants({expense_id for expense_id, _ in pairs})
+    Tombstone.objects.bulk_create(
+        Tombstone(user_id=user_id, kind=Tombstone.EXPENSE, object_id=expense_id)
+        for expense_id, user_id in pairs
+        if expense_id in participants and user_id not in participants[expense_id]
+    )
+
+
+def touch_expenses(expense_ids):
+    # For writes that skip auto_now: queryset updates and bulk_update
+    Expense.objects.filter(pk__in=expense_ids).update(updated_at=timezone.now())
+
+
+def prune(before=None):
+    """Delete tombstones older than ``before`` (default: the retention), returning how many."""
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=before or tombstone_cutoff()).delete()
+    return deleted
@@ -1,3 +1,1856 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from backend.routers import REPLICA, ReadReplicaRouter
+
+from . import (
+    analytics, archive, async_views, events, export, friend_graph, instrumentation, jobs, ledger, pagination, settlements, simplify, splits, sync, urls,
+)
+from .authentication import CachedRefreshToken
+from .management.commands import bench_api
+from .models import (
+    Student, Expense, ExpenseShare, ArchivedExpense, ArchivedExpenseShare, Job, PairBalance, Settlement, Tombstone,
+    UserBalance, UserMonthlySpend,
+)
+from .renderers import ORJSONRenderer
+from .serializers import ExpenseWithSharesSerializer, StudentTokenObtainPairSerializer
+
+
+@override_settings(DATABASE_REPLICA_READS=False)
+class BaseTestCase(TestCase):
+    # Keep every query on "default" so query budgets hold with a replica configured
+    pass
+
+
+def seed_users(count, prefix="user"):
+    # bulk_create skips the post_save signal, so create profiles explicitly
+    users = User.objects.bulk_create(User(username=f"{prefix}{i}") for i in range(count))
+    Student.objects.bulk_create(Student(user=user, department="CS") for user in users)
+    return users
+
+
+# ---------------------------
+# Query budgets
+# ---------------------------
+
+class QueryBudgetTests(BaseTestCase):
+    """
+    Every endpoint must load its related data with a fixed number of queries,
+    however many rows it returns. Authentication is forced so the budgets only
+    cover the view itself.
+    """
+
+    ROWS = 150
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="pw")
+        cls.others = seed_users(cls.ROWS)
+        others_students = Student.objects.filter(user__in=cls.others)
+
+        student = cls.user.student_profile
+        student.friends.add(*others_students)
+        for other in others_students[:20]:
+            other.friends.add(*others_students[:20])
+
+        paid = Expense.objects.bulk_create(
+            Expense(payer=cls.user, title=f"Paid {i}", amount=100) for i in range(cls.ROWS)
+        )
+        owed = Expense.objects.bulk_create(
+            Expense(payer=other, title=f"Owed {i}", amount=10) for i, other in enumerate(cls.others)
+        )
+        cls.expense = paid[0]
+        ExpenseShare.objects.bulk_create(
+            ExpenseShare(expense=cls.expense, payee=other, amount=1) for other in cls.others
+        )
+        ExpenseShare.objects.bulk_create(
+            ExpenseShare(expense=expense, payee=cls.user, amount=5) for expense in owed
+        )
+        cls.share = cls.expense.shares.first()
+        ledger.add_shares(ExpenseShare.objects.values_list("expense__payer_id", "payee_id", "amount"))
+
+    def setUp(self):
+        cache.clear()
+        # A fresh instance, as authentication would load, with no cached relations
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+
+    def assertBudget(self, budget, method, url, **kwargs):
+        with self.assertNumQueries(budget):
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_profile(self):
+        response = self.assertBudget(2, "get", reverse("profile"))
+        self.assertEqual(len(response.data["friends"]), self.ROWS)
+
+    def test_friend_list(self):
+        response = self.assertBudget(2, "get", reverse("friend-list"))
+        self.assertEqual(len(response.data), self.ROWS)
+
+    def test_add_friend(self):
+        User.objects.create_user("newcomer")
+        self.assertBudget(5, "post", reverse("friend-add"), data={"username": "newcomer"})
+
+    def test_remove_friend(self):
+        friend = Student.objects.get(user=self.others[0])
+        self.assertBudget(4, "delete", reverse("friend-remove", args=[friend.pk]))
+
+    def test_batch_friends(self):
+        newcomers = [user.username for user in seed_users(self.ROWS, prefix="newcomer")]
+        usernames = newcomers + [self.others[0].username, "owner", "nobody"]
+        self.assertBudget(4, "post", reverse("friend-add-batch"), data={"usernames": usernames}, format="json")
+        # The profile is cached on the authenticated user by now
+        self.assertBudget(3, "post", reverse("friend-remove-batch"), data={"usernames": usernames}, format="json")
+
+    def test_settlement_batch(self):
+        transfers = [{"to_user": other.pk, "amount": "0.25"} for other in self.others]
+        # The payer's friends, wallets, debts owed, settlements, ledger and settled shares, however many transfers
+        response = self.assertBudget(
+            23, "post", reverse("settlement-batch"), data={"transfers": transfers}, format="json"
+        )
+        self.assertEqual(len(response.data["settlements"]), self.ROWS)
+
+    def test_friend_suggestions(self):
+        # Every friend is already added; the friends' friends are loaded in one query
+        response = self.assertBudget(3, "get", reverse("friend-suggestions"))
+        self.assertEqual(response.data, [])
+
+    def test_expense_feed(self):
+        response = self.assertBudget(1, "get", reverse("expense-list-create"), data={"page_size": 200})
+        self.assertEqual(len(response.data["results"]), 200)
+
+    def test_expense_detail(self):
+        self.assertBudget(1, "get", reverse("expense-detail", args=[self.expense.pk]))
+
+    def test_share_list(self):
+        response = self.assertBudget(
+            2, "get", reverse("expense-share-list-create", args=[self.expense.pk]), data={"page_size": 500}
+        )
+        self.assertEqual(len(response.data["results"]), self.ROWS)
+
+    def test_share_detail(self):
+        self.assertBudget(1, "get", reverse("expense-share-detail", args=[self.share.pk]))
+
+    def test_bulk_create(self):
+        shares = [{"payee": other.pk, "amount": "0.50"} for other in self.others]
+        # 14 for the expense, its shares and the ledger, 4 to queue the analytics rollups
+        response = self.assertBudget(
+            18,
+            "post",
+            reverse("expense-bulk-create"),
+            data={"title": "Trip", "amount": "100.00", "shares": shares},
+            format="json",
+        )
+        self.assertEqual(len(response.data["shares"]), self.ROWS)
+
+    def test_balances(self):
+        response = self.assertBudget(2, "get", reverse("balances"))
+        self.assertEqual(len(response.data["balances"]), self.ROWS)
+
+    def test_settle_up(self):
+        self.assertBudget(4, "get", reverse("balances-settle-up"))
+
+    def test_sync(self):
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+        cursor = sync.encode_cursor(dict.fromkeys(sync.STREAMS, (yesterday, 0)))
+        # One query per stream, however much changed
+        response = self.assertBudget(3, "get", reverse("sync"), data={"since": cursor})
+        self.assertEqual(len(response.data["expenses"]), 2 * self.ROWS)
+        self.assertEqual(len(response.data["shares"]), 2 * self.ROWS)
+
+
+# ---------------------------
+# Pagination
+# ---------------------------
+
+@override_settings(API_RESPONSE_CACHE=False)
+class CursorPaginationTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.other = seed_users(2)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_expenses(self, count, created_at=None):
+        expenses = [Expense.objects.create(payer=self.user, title=f"Expense {i}", amount=1) for i in range(count)]
+        if created_at is not None:
+            Expense.objects.filter(pk__in=[expense.pk for expense in expenses]).update(created_at=created_at)
+        return [expense.pk for expense in expenses]
+
+    def pages(self, url, **params):
+        pages = []
+        data = self.client.get(url, params).data
+        while True:
+            pages.append([row["id"] for row in data["results"]])
+            if data["next"] is None:
+                return pages, data
+            data = self.client.get(data["next"]).data
+
+    def test_page_boundaries(self):
+        ids = self.add_expenses(5)[::-1]
+        pages, last = self.pages(reverse("expense-list-create"), page_size=2)
+        self.assertEqual(pages, [ids[0:2], ids[2:4], ids[4:]])
+        self.assertEqual([row["id"] for row in self.client.get(last["previous"]).data["results"]], ids[2:4])
+
+        # A last page that is exactly full has no next page
+        Expense.objects.filter(pk=ids[4]).delete()
+        pages, _ = self.pages(reverse("expense-list-create"), page_size=2)
+        self.assertEqual(pages, [ids[0:2], ids[2:4]])
+
+        expense = Expense.objects.get(pk=ids[0])
+        share_ids = [ExpenseShare.objects.create(expense=expense, payee=self.other, amount=1).pk for _ in range(3)]
+        pages, _ = self.pages(reverse("expense-share-list-create", args=[expense.pk]), page_size=2)
+        self.assertEqual(pages, [share_ids[0:2], share_ids[2:]])
+
+    def test_ties_on_created_at(self):
+        # Bulk imports give many expenses the same timestamp
+        tied = self.add_expenses(5, created_at=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        older = self.add_expenses(1, created_at=datetime(2023, 1, 1, tzinfo=timezone.utc))
+        pages, _ = self.pages(reverse("expense-list-create"), page_size=2)
+        self.assertEqual([expense_id for page in pages for expense_id in page], tied[::-1] + older)
+        self.assertEqual([len(page) for page in pages], [2, 2, 2])
+
+    def test_cursor_is_stable_when_rows_are_added_between_pages(self):
+        ids = self.add_expenses(4)[::-1]
+        first = self.client.get(reverse("expense-list-create"), {"page_size": 2}).data
+        self.assertEqual([row["id"] for row in first["results"]], ids[:2])
+        # Newer expenses show up on a fresh first page, not shifted into this one
+        self.add_expenses(3)
+        second = self.client.get(first["next"]).data
+        self.assertEqual([row["id"] for row in second["results"]], ids[2:])
+        self.assertIsNone(second["next"])
+
+
+# ---------------------------
+# Balance ledger
+# ---------------------------
+
+class LedgerTests(BaseTestCase):
+    """Every write keeps the ledger where rebuild_ledger would put it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.a, cls.b, cls.c = seed_users(3)
+        cls.expense = Expense.objects.create(payer=cls.a, title="Dinner", amount=30)
+        cls.share = ExpenseShare.objects.create(expense=cls.expense, payee=cls.b, amount=10)
+
+    def owed(self, user, other):
+        # What `other` owes `user`
+        return PairBalance.objects.filter(user=user, other=other).values_list("amount", flat=True).first() or 0
+
+    def totals(self, user):
+        return UserBalance.objects.filter(user=user).values_list("lent", "borrowed").first() or (0, 0)
+
+    def assertConsistent(self):
+        out = io.StringIO()
+        call_command("rebuild_ledger", "--verify", stdout=out)
+        self.assertIn("Ledger is consistent.", out.getvalue())
+
+    def test_share_amount_update(self):
+        self.share.amount = Decimal("12.50")
+        self.share.save()
+        self.assertEqual((self.owed(self.a, self.b), self.owed(self.b, self.a)), (Decimal("12.50"), Decimal("-12.50")))
+        self.assertEqual(self.totals(self.a), (Decimal("12.50"), 0))
+        self.assertConsistent()
+
+    def test_payee_change(self):
+        self.share.payee = self.c
+        self.share.save()
+        self.assertEqual((self.owed(self.a, self.b), self.owed(self.a, self.c)), (0, Decimal("10")))
+        self.assertEqual((self.totals(self.b), self.totals(self.c)), ((0, 0), (0, Decimal("10"))))
+        self.assertConsistent()
+
+    def test_payer_change(self):
+        self.expense.payer = self.c
+        self.expense.save()
+        self.assertEqual((self.owed(self.a, self.b), self.owed(self.c, self.b)), (0, Decimal("10")))
+        self.assertEqual((self.totals(self.a), self.totals(self.c)), ((0, 0), (Decimal("10"), 0)))
+        self.assertConsistent()
+
+    def test_expense_deletion(self):
+        ExpenseShare.objects.create(expense=self.expense, payee=self.c, amount=5)
+        self.expense.delete()
+        self.assertEqual((self.owed(self.a, self.b), self.owed(self.a, self.c)), (0, 0))
+        self.assertEqual(self.totals(self.a), (0, 0))
+        self.assertConsistent()
+
+    def test_verify_fails_on_drift(self):
+        PairBalance.objects.filter(user=self.a, other=self.b).update(amount=11)
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, "Ledger drift detected in 1 row(s)."):
+            call_command("rebuild_ledger", "--verify", stdout=out)
+        self.assertIn(f"pair {self.a.pk}->{self.b.pk}: stored 11.00", out.getvalue())
+        call_command("rebuild_ledger", stdout=io.StringIO())
+        self.assertConsistent()
+
+    def test_user_cascade(self):
+        owed_by_c = Expense.objects.create(payer=self.b, title="Taxi", amount=8)
+        ExpenseShare.objects.create(expense=owed_by_c, payee=self.c, amount=4)
+        ExpenseShare.objects.create(expense=self.expense, payee=self.c, amount=6)
+        # b both owes and is owed
+        b_id = self.b.pk
+        self.b.delete()
+        self.assertFalse(PairBalance.objects.filter(Q(user_id=b_id) | Q(other_id=b_id)).exists())
+        self.assertEqual(self.owed(self.a, self.c), Decimal("6"))
+        self.assertEqual((self.totals(self.a), self.totals(self.c)), ((Decimal("6"), 0), (0, Decimal("6"))))
+        self.assertConsistent()
+
+
+# ---------------------------
+# Bulk create
+# ---------------------------
+
+class ExpenseBulkCreateTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.a, cls.b = seed_users(3)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, amount, shares):
+        return self.client.post(
+            reverse("expense-bulk-create"), {"title": "Trip", "amount": amount, "shares": shares}, format="json"
+        )
+
+    def test_creates_expense_and_shares(self):
+        response = self.post("90.00", [{"payee": self.a.pk, "amount": "30.00"}, {"payee": self.b.pk, "amount": "60.00"}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([share["payee"] for share in response.data["shares"]], [self.a.pk, self.b.pk])
+        self.assertEqual(ExpenseShare.objects.filter(expense_id=response.data["id"]).count(), 2)
+        out = io.StringIO()
+        call_command("rebuild_ledger", "--verify", stdout=out)
+        self.assertIn("Ledger is consistent.", out.getvalue())
+
+    def test_invalid_requests_write_nothing(self):
+        cases = {
+            "duplicate payee": ("90.00", [{"payee": self.a.pk, "amount": "10.00"}, {"payee": self.a.pk, "amount": "10.00"}]),
+            "unknown payee": ("90.00", [{"payee": self.a.pk, "amount": "10.00"}, {"payee": 999_999, "amount": "10.00"}]),
+            "shares above amount": ("90.00", [{"payee": self.a.pk, "amount": "50.00"}, {"payee": self.b.pk, "amount": "40.01"}]),
+        }
+        for name, (amount, shares) in cases.items():
+            with self.subTest(name):
+                response = self.post(amount, shares)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("shares", response.data)
+                self.assertFalse(Expense.objects.exists())
+                self.assertFalse(ExpenseShare.objects.exists())
+                self.assertFalse(PairBalance.objects.exists())
+
+
+# ---------------------------
+# Fast read path
+# ---------------------------
+
+@override_settings(API_RESPONSE_CACHE=False)
+class FastReadParityTests(BaseTestCase):
+    """The fast read path must render exactly what the serializers render."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", first_name="Zoë", last_name="O'Neil")
+        cls.others = seed_users(30)
+        student = cls.user.student_profile
+        student.department = "Électronique"
+        student.wallet_balance = Decimal("12.5")
+        student.save()
+        others_students = list(Student.objects.filter(user__in=cls.others))
+        student.friends.add(*others_students)
+        others_students[0].friends.add(*others_students[1:5], student)
+
+        cls.expense = Expense.objects.create(payer=cls.user, title="Dîner \u2028 ünïcode", amount="99.90")
+        for i, other in enumerate(cls.others):
+            ExpenseShare.objects.create(expense=cls.expense, payee=other, amount=Decimal("1.1") * i)
+            Expense.objects.create(payer=other, title=f"Owed {i}", amount=i + 0.5)
+        for expense in Expense.objects.exclude(payer=cls.user)[:10]:
+            ExpenseShare.objects.create(expense=expense, payee=cls.user, amount="0.33")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertParity(self, url, **params):
+        with override_settings(API_FAST_READS=False):
+            expected = self.client.get(url, params)
+        with override_settings(API_FAST_READS=True):
+            actual = self.client.get(url, params)
+        self.assertEqual(expected.status_code, 200)
+        self.assertEqual(actual.status_code, 200)
+        self.assertEqual(actual.content, expected.content)
+        return json.loads(actual.content)
+
+    def test_expense_feed(self):
+        data = self.assertParity(reverse("expense-list-create"), page_size=7)
+        # Follow the cursor so pagination over values() rows is covered too
+        self.assertParity(data["next"])
+
+    def test_share_list(self):
+        self.assertParity(reverse("expense-share-list-create", args=[self.expense.pk]))
+
+    def test_friend_list(self):
+        self.assertParity(reverse("friend-list"))
+
+    def test_profile(self):
+        self.assertParity(reverse("profile"))
+
+
+class ORJSONRendererTests(BaseTestCase):
+    def test_matches_json_renderer(self):
+        data = {
+            "amount": Decimal("10.50"),
+            "created_at": datetime(2025, 9, 21, 4, 17, 0, 123456, tzinfo=timezone.utc),
+            "title": "caf\u00e9 \u2028 \u2029",
+            "nested": [{"id": 1, "value": None, "flag": True, "ratio": 0.1}],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+# ---------------------------
+# Response cache
+# ---------------------------
+
+class ResponseCacheTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer = User.objects.create_user("payer")
+        cls.payee = User.objects.create_user("payee")
+        cls.expense = Expense.objects.create(payer=cls.payer, title="Lunch", amount=20)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.payee)
+
+    def test_conditional_get(self):
+        url = reverse("expense-list-create")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_share_invalidates_payee(self):
+        url = reverse("expense-list-create")
+        self.assertEqual(self.client.get(url).data["results"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ExpenseShare.objects.create(expense=self.expense, payee=self.payee, amount=5)
+        response = self.client.get(url)
+        self.assertEqual([row["id"] for row in response.data["results"]], [self.expense.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.expense.delete()
+        self.assertEqual(self.client.get(url).data["results"], [])
+
+    @override_settings(DATABASE_REPLICA_READS=True)
+    def test_cache_fills_read_from_the_primary(self):
+        chosen = []
+        db_for_read = ReadReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            chosen.append(db_for_read(router, model, **hints))
+            # There is no replica connection in tests
+            return None
+
+        url = reverse("expense-list-create")
+        with (
+            mock.patch.dict(settings.DATABASES, {REPLICA: settings.DATABASES["default"]}),
+            mock.patch.object(ReadReplicaRouter, "db_for_read", record),
+        ):
+            self.client.get(url)
+            self.assertEqual(set(chosen), {None})
+            chosen.clear()
+            with override_settings(API_RESPONSE_CACHE=False):
+                self.client.get(url)
+            self.assertEqual(set(chosen), {REPLICA})
+
+    def test_friend_change_invalidates_friend_list(self):
+        self.payee.student_profile.friends.add(self.payer.student_profile)
+        url = reverse("friend-list")
+        self.assertEqual(self.client.get(url).data[0]["department"], "")
+
+        student = self.payer.student_profile
+        student.department = "Physics"
+        with self.captureOnCommitCallbacks(execute=True):
+            student.save()
+        self.assertEqual(self.client.get(url).data[0]["department"], "Physics")
+
+
+# ---------------------------
+# Authentication
+# ---------------------------
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class CachedAuthenticationTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner", password="s3cret-pass")
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        response = self.client.post(reverse("login"), {"username": "owner", "password": "s3cret-pass"})
+        self.tokens = response.data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def test_token_carries_student_claims(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        token = AccessToken(self.tokens["access"])
+        self.assertEqual(token["username"], "owner")
+        self.assertEqual(token["student_id"], self.user.student_profile.pk)
+
+    def test_user_and_profile_are_cached(self):
+        url = reverse("balances-settle-up")
+        self.client.get(url)
+        # Only the view's own queries remain once user and profile are cached
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    @override_settings(AUTH_TRUST_TOKEN_CLAIMS=True)
+    def test_trusted_claims_skip_lookup(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("balances-settle-up"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_change_invalidates_cached_user(self):
+        self.client.get(reverse("balances"))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.user.refresh_from_db()
+        self.user.save()
+        self.assertEqual(self.client.get(reverse("balances")).status_code, 401)
+
+    def test_blacklisted_refresh_token_is_rejected(self):
+        refresh = {"refresh": self.tokens["refresh"]}
+        self.assertEqual(self.client.post(reverse("token-refresh"), refresh).status_code, 200)
+        self.assertEqual(self.client.post(reverse("logout"), refresh).status_code, 204)
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse("token-refresh"), refresh)
+        self.assertEqual(response.status_code, 401)
+
+
+# ---------------------------
+# Registration and import
+# ---------------------------
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class RegistrationTests(BaseTestCase):
+    def test_register_creates_user_and_profile(self):
+        # The username check, the user INSERT and the profile INSERT from post_save
+        with self.assertNumQueries(3):
+            response = APIClient().post(
+                reverse("register"), {"username": "new", "email": "new@example.com", "password": "s3cret-pass!"}
+            )
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(username="new")
+        self.assertTrue(user.check_password("s3cret-pass!"))
+        self.assertTrue(Student.objects.filter(user=user).exists())
+
+    def import_students(self, text, suffix=".csv"):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / f"students{suffix}"
+            path.write_text(text)
+            out = io.StringIO()
+            call_command("import_students", str(path), "--workers", "1", "--chunk-size", "2", stdout=out)
+        return out.getvalue()
+
+    def test_import_creates_students(self):
+        out = self.import_students(
+            "username,email,password,department,first_name,last_name\n"
+            "ada,ada@example.com,pw-ada,CS,Ada,Lovelace\n"
+            "alan,,pw-alan,Math,Alan,Turing\n"
+            "grace,,,,,\n"
+        )
+        self.assertIn("Imported 3 student(s)", out)
+        self.assertEqual(
+            list(Student.objects.order_by("user__username").values_list("user__username", "department")),
+            [("ada", "CS"), ("alan", "Math"), ("grace", "")],
+        )
+        ada = User.objects.get(username="ada")
+        self.assertEqual((ada.email, ada.first_name, ada.last_name), ("ada@example.com", "Ada", "Lovelace"))
+        self.assertTrue(ada.check_password("pw-ada"))
+        # No password means the account cannot log in until one is set
+        self.assertFalse(User.objects.get(username="grace").has_usable_password())
+
+    def test_import_skips_duplicate_and_existing_usernames(self):
+        User.objects.create_user("taken")
+        out = self.import_students(
+            '{"username": "taken", "department": "CS"}\n'
+            '{"username": "fresh", "department": "CS"}\n'
+            "\n"
+            '{"username": " fresh ", "department": "Math"}\n'
+            '{"username": "", "department": "Math"}\n'
+            '{"username": "other"}\n',
+            suffix=".jsonl",
+        )
+        self.assertIn("Imported 2 student(s)", out)
+        self.assertIn("skipped 3", out)
+        self.assertEqual(User.objects.filter(username__in=["taken", "fresh", "other"]).count(), 3)
+        # The first row for a username wins
+        self.assertEqual(Student.objects.get(user__username="fresh").department, "CS")
+        self.assertEqual(Student.objects.filter(user__username="taken").count(), 1)
+
+
+# ---------------------------
+# Async views
+# ---------------------------
+
+class AsyncViewTests(BaseTestCase):
+    """The async views must answer exactly like the DRF views they replace."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner")
+        cls.others = seed_users(12)
+        student = cls.user.student_profile
+        student.friends.add(*Student.objects.filter(user__in=cls.others))
+        cls.expense = Expense.objects.create(payer=cls.user, title="Rent", amount="120.00")
+        for i, other in enumerate(cls.others):
+            ExpenseShare.objects.create(expense=cls.expense, payee=other, amount=i + 1)
+            owed = Expense.objects.create(payer=other, title=f"Owed {i}", amount=i + 0.5)
+            ExpenseShare.objects.create(expense=owed, payee=cls.user, amount="0.25")
+
+    def setUp(self):
+        cache.clear()
+        self.token = str(StudentTokenObtainPairSerializer.get_token(self.user).access_token)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+    def async_request(self, view, url, method="get", data=None, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        factory = AsyncRequestFactory()
+        if method == "get":
+            request = factory.get(url, data, headers=headers)
+        else:
+            request = getattr(factory, method)(url, data, content_type="application/json", headers=headers)
+        response = async_to_sync(view.as_view())(request, **kwargs)
+        if hasattr(response, "render"):
+            response.render()
+        return response
+
+    def assertParity(self, view, url, **kwargs):
+        for fast in (False, True):
+            with self.subTest(fast=fast), override_settings(API_FAST_READS=fast, API_RESPONSE_CACHE=False):
+                expected = self.client.get(url)
+                actual = self.async_request(view, url, **kwargs)
+                self.assertEqual(actual.status_code, expected.status_code)
+                self.assertEqual(actual.content, expected.content)
+        return json.loads(actual.content)
+
+    def test_expense_feed(self):
+        url = reverse("expense-list-create")
+        data = self.assertParity(async_views.ExpenseListCreateView, f"{url}?page_size=5")
+        data = self.assertParity(async_views.ExpenseListCreateView, data["next"])
+        self.assertParity(async_views.ExpenseListCreateView, data["previous"])
+
+    def test_expense_detail(self):
+        self.assertParity(async_views.ExpenseDetailView, reverse("expense-detail", args=[self.expense.pk]), pk=self.expense.pk)
+        self.assertParity(async_views.ExpenseDetailView, reverse("expense-detail", args=[0]), pk=0)
+
+    def test_friend_list(self):
+        self.assertParity(async_views.FriendListView, reverse("friend-list"))
+
+    def test_profile(self):
+        self.assertParity(async_views.StudentProfileView, reverse("profile"))
+
+    def test_unauthenticated(self):
+        self.token = None
+        self.client.credentials()
+        response = self.assertParity(async_views.FriendListView, reverse("friend-list"))
+        self.assertEqual(response["detail"], "Authentication credentials were not provided.")
+
+    def test_shares_cache_with_sync_views(self):
+        url = reverse("expense-list-create")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.async_request(async_views.ExpenseListCreateView, url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_fall_back_to_sync_view(self):
+        response = self.async_request(
+            async_views.ExpenseListCreateView, reverse("expense-list-create"), "post", {"title": "Books", "amount": "15.00"}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Expense.objects.filter(payer=self.user, title="Books").exists())
+
+
+# ---------------------------
+# Export
+# ---------------------------
+
+class ExportTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner")
+        cls.others = seed_users(6)
+        cls.rent = Expense.objects.create(payer=cls.user, title="Rent, \"shared\"", amount=300)
+        for i, other in enumerate(cls.others):
+            ExpenseShare.objects.create(expense=cls.rent, payee=other, amount=10 + i)
+        cls.solo = Expense.objects.create(payer=cls.user, title="Solo", amount="4.20")
+        cls.owed = Expense.objects.create(payer=cls.others[0], title="Taxi", amount=30)
+        ExpenseShare.objects.create(expense=cls.owed, payee=cls.others[1], amount=10)
+        ExpenseShare.objects.create(expense=cls.owed, payee=cls.user, amount=10)
+        Expense.objects.create(payer=cls.others[2], title="Hidden", amount=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, fmt):
+        response = self.client.get(reverse("expense-export", args=[fmt]))
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in self.export("ndjson").splitlines()]
+        self.assertEqual(
+            [(line["type"], line["id"]) for line in lines if line["type"] == "expense"],
+            [("expense", self.rent.pk), ("expense", self.solo.pk), ("expense", self.owed.pk)],
+        )
+        self.assertEqual(len(lines), 3 + 6 + 2)
+        self.assertEqual(lines[0], {"type": "expense", **self.client.get(reverse("expense-detail", args=[self.rent.pk])).data})
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export("csv"))))
+        self.assertEqual(rows[0][:3], ["expense_id", "title", "amount"])
+        self.assertEqual(len(rows), 1 + 6 + 1 + 2)
+        self.assertEqual(rows[1][1], "Rent, \"shared\"")
+        self.assertEqual(rows[7][:3] + rows[7][6:], [str(self.solo.pk), "Solo", "4.20", "", "", "", "", ""])
+
+    def test_batches_do_not_change_output(self):
+        expected = self.export("ndjson"), self.export("csv")
+        with mock.patch.object(export, "EXPENSE_BATCH_SIZE", 2), mock.patch.object(export, "SHARE_BATCH_SIZE", 4):
+            self.assertEqual((self.export("ndjson"), self.export("csv")), expected)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get(reverse("expense-export", args=["xml"])).status_code, 404)
+
+
+# ---------------------------
+# Archive
+# ---------------------------
+
+class ArchiveTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer, cls.debtor, cls.other, cls.stranger = seed_users(4)
+        cls.old = Expense.objects.create(payer=cls.payer, title="Old trip", amount=30)
+        for payee in (cls.debtor, cls.other):
+            ExpenseShare.objects.create(expense=cls.old, payee=payee, amount=10)
+        cls.open = Expense.objects.create(payer=cls.payer, title="Old lunch", amount=10)
+        ExpenseShare.objects.create(expense=cls.open, payee=cls.debtor, amount=5)
+        cls.recent = Expense.objects.create(payer=cls.payer, title="Coffee", amount=3)
+        Expense.objects.exclude(pk=cls.recent.pk).update(created_at=datetime.now(timezone.utc) - timedelta(days=400))
+        settlements.settle([(cls.debtor.pk, cls.payer.pk, Decimal("10")), (cls.other.pk, cls.payer.pk, Decimal("10"))])
+        call_command("rebuild_analytics", stdout=io.StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.debtor)
+
+    def test_settled_history_moves_to_the_archive(self):
+        self.assertEqual(self.client.get(reverse("expense-history")).data["results"], [])
+        out = io.StringIO()
+        call_command("archive_expenses", "--dry-run", stdout=out)
+        self.assertIn("1 expense(s) would be archived.", out.getvalue())
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("archive_expenses", stdout=out)
+        self.assertIn("Archived 1 expense(s) and 2 share(s) in 1 batch(es)", out.getvalue())
+        self.assertIn("freed for new rows", out.getvalue())
+        self.assertEqual(set(Expense.objects.values_list("pk", flat=True)), {self.open.pk, self.recent.pk})
+        self.assertEqual(ArchivedExpense.objects.get().pk, self.old.pk)
+        self.assertEqual(ArchivedExpenseShare.objects.count(), 2)
+        self.assertFalse(Tombstone.objects.exists())
+        for command in ("rebuild_ledger", "rebuild_analytics"):
+            out = io.StringIO()
+            call_command(command, "--verify", stdout=out)
+            self.assertIn("consistent", out.getvalue())
+
+        # Archived shares still count as covered by the debtor's settlements
+        settlements.settle([(self.debtor.pk, self.payer.pk, Decimal("1"))])
+        self.assertFalse(ExpenseShare.objects.get(expense=self.open).settled)
+
+        results = self.client.get(reverse("expense-history")).data["results"]
+        self.assertEqual([(row["id"], row["title"]) for row in results], [(self.old.pk, "Old trip")])
+        self.assertEqual([(share["payee"], share["settled"]) for share in results[0]["shares"]], [
+            (self.debtor.pk, True), (self.other.pk, True),
+        ])
+        self.assertEqual(self.client.get(reverse("expense-detail", args=[self.old.pk])).status_code, 404)
+        self.assertEqual(
+            [data["id"] for kind, data in export.history(self.debtor) if kind == "expense"], [self.old.pk, self.open.pk]
+        )
+        self.client.force_authenticate(self.stranger)
+        self.assertEqual(self.client.get(reverse("expense-history")).data["results"], [])
+
+    def test_deleting_users_reverses_their_archived_rows(self):
+        archive.archive_batch([self.old.pk], datetime.now(timezone.utc))
+        # A payee of an archived expense, then its payer
+        for user in (self.debtor, self.payer):
+            user.delete()
+            for command in ("rebuild_ledger", "rebuild_analytics"):
+                out = io.StringIO()
+                call_command(command, "--verify", stdout=out)
+                self.assertIn("consistent", out.getvalue())
+        self.assertFalse(ArchivedExpenseShare.objects.exists())
+
+    def test_batches_check_again_what_they_move(self):
+        self.assertEqual(list(archive.archive(datetime.now(timezone.utc) - timedelta(days=365), batch_size=1)), [(1, 2)])
+        # Only expenses still settled when their batch runs move
+        self.assertEqual(archive.archive_batch([self.open.pk, self.recent.pk], datetime.now(timezone.utc)), (1, 0))
+        self.assertEqual(set(ArchivedExpense.objects.values_list("pk", flat=True)), {self.old.pk, self.recent.pk})
+
+
+# ---------------------------
+# Analytics
+# ---------------------------
+
+class AnalyticsTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner")
+        cls.others = seed_users(4)
+        Student.objects.filter(user=cls.user).update(department="Math")
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertRollupsConsistent(self):
+        out = io.StringIO()
+        call_command("rebuild_analytics", "--verify", stdout=out)
+        self.assertIn("Rollups are consistent.", out.getvalue())
+
+    def test_incremental_updates_match_rebuild(self):
+        a, b, c, d = self.others
+        self.client.post(
+            reverse("expense-bulk-create"),
+            {"title": "Trip", "amount": "90.00", "shares": [{"payee": a.pk, "amount": "30.00"}, {"payee": b.pk, "amount": "30.00"}]},
+            format="json",
+        )
+        dinner = Expense.objects.create(payer=a, title="Dinner", amount=40)
+        share = ExpenseShare.objects.create(expense=dinner, payee=self.user, amount=20)
+        ExpenseShare.objects.create(expense=dinner, payee=c, amount=10)
+        self.assertRollupsConsistent()
+
+        share.amount = 15
+        share.save()
+        dinner.payer = d
+        dinner.amount = 45
+        dinner.save()
+        ExpenseShare.objects.filter(payee=b).get().delete()
+        self.assertRollupsConsistent()
+
+        student = a.student_profile
+        student.department = "Physics"
+        student.save()
+        self.assertRollupsConsistent()
+
+        dinner.delete()
+        Expense.objects.get(title="Trip").delete()
+        self.assertRollupsConsistent()
+
+    def test_verify_fails_on_drift(self):
+        Expense.objects.create(payer=self.user, title="Lunch", amount=12)
+        self.assertRollupsConsistent()
+        UserMonthlySpend.objects.filter(user=self.user).update(paid=13)
+        with self.assertRaisesMessage(CommandError, "Rollup drift detected in 1 row(s)."):
+            call_command("rebuild_analytics", "--verify", stdout=io.StringIO())
+        call_command("rebuild_analytics", stdout=io.StringIO())
+        self.assertRollupsConsistent()
+
+    def test_endpoint(self):
+        a, b = self.others[:2]
+        self.client.post(
+            reverse("expense-bulk-create"),
+            {"title": "Trip", "amount": "90.00", "shares": [{"payee": a.pk, "amount": "30.00"}, {"payee": b.pk, "amount": "20.00"}]},
+            format="json",
+        )
+        lunch = Expense.objects.create(payer=b, title="Lunch", amount=12)
+        ExpenseShare.objects.create(expense=lunch, payee=self.user, amount=6)
+        with self.assertLogs("api.jobs"):
+            call_command("run_jobs", "--once", "--threads", "1", stdout=io.StringIO())
+
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse("analytics"), {"months": 3})
+        data = response.data
+        self.assertEqual(len(data["months"]), 3)
+        self.assertEqual(data["months"][0]["paid"], "0.00")
+        self.assertEqual(
+            {key: data["months"][-1][key] for key in ("paid", "lent", "owed", "spent")},
+            {"paid": "90.00", "lent": "50.00", "owed": "6.00", "spent": "46.00"},
+        )
+        self.assertEqual(data["department"]["name"], "Math")
+        self.assertEqual(data["department"]["months"][-1]["spent"], "46.00")
+        self.assertEqual([row["department"] for row in data["departments"]], ["CS", "Math"])
+        self.assertEqual(
+            [(row["username"], row["amount"], row["shares"]) for row in data["top_co_spenders"]],
+            [(a.username, "30.00", 1), (b.username, "26.00", 2)],
+        )
+        self.assertEqual(self.client.get(reverse("analytics"), {"months": 0}).status_code, 400)
+
+
+# ---------------------------
+# Background jobs
+# ---------------------------
+
+class JobTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer, cls.payee = seed_users(2)
+
+    def flaky_handler(self):
+        # Fails any batch holding a "bad" payload
+        batches = []
+
+        @jobs.handler("test.flaky")
+        def run(payloads):
+            batches.append(payloads)
+            if "bad" in payloads:
+                raise ValueError("bad payload")
+
+        self.addCleanup(jobs._handlers.pop, "test.flaky")
+        return batches
+
+    def test_rollups_wait_for_the_worker(self):
+        Expense.objects.create(payer=self.payer, title="Lunch", amount=10)
+        with contextlib.suppress(ValueError), transaction.atomic():
+            Expense.objects.create(payer=self.payer, title="Rolled back", amount=99)
+            raise ValueError
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertFalse(UserMonthlySpend.objects.exists())
+
+        out = io.StringIO()
+        with self.assertLogs("api.jobs") as logs:
+            call_command("run_jobs", "--once", "--threads", "1", stdout=out)
+        self.assertIn("Ran 1 job(s).", out.getvalue())
+        stats = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((stats["queue"], stats["kinds"][analytics.ROLLUP_JOB]["done"]), ([], 1))
+        self.assertEqual(UserMonthlySpend.objects.get(user=self.payer).paid, Decimal("10.00"))
+        self.assertFalse(Job.objects.exists())
+
+        # A user deleted before the reversal of their expenses is applied still leaves their department
+        gone = User.objects.create_user("gone")
+        Student.objects.filter(user=gone).update(department="Art")
+        expense = Expense.objects.create(payer=gone, title="Paint", amount=20)
+        ExpenseShare.objects.create(expense=expense, payee=self.payee, amount=5)
+        jobs.run_pending()
+        gone.delete()
+        out = io.StringIO()
+        call_command("rebuild_analytics", "--verify", stdout=out)
+        self.assertIn("Rollups are consistent.", out.getvalue())
+
+        # Also when the cascade deletes their profile before their shares
+        gone = User.objects.create_user("gone")
+        Student.objects.filter(user=gone).update(department="Music")
+        expense = Expense.objects.create(payer=self.payee, title="Tickets", amount=30)
+        ExpenseShare.objects.create(expense=expense, payee=gone, amount=15)
+        jobs.run_pending()
+        gone.delete()
+        out = io.StringIO()
+        call_command("rebuild_analytics", "--verify", stdout=out)
+        self.assertIn("Rollups are consistent.", out.getvalue())
+
+    def test_failed_batches_are_retried_job_by_job(self):
+        batches = self.flaky_handler()
+        for payload in ("first", "bad", "last"):
+            jobs.enqueue("test.flaky", payload)
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertEqual(batches, [["first", "bad", "last"], ["first"], ["bad"], ["last"]])
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_at, datetime.now(timezone.utc))
+        self.assertIn("ValueError: bad payload", job.last_error)
+
+        # Until it runs out of attempts
+        Job.objects.update(run_at=datetime.now(timezone.utc))
+        with override_settings(API_JOBS_MAX_ATTEMPTS=2):
+            self.assertEqual(jobs.run_pending(), 0)
+        job.refresh_from_db()
+        self.assertIsNone(job.run_at)
+        self.assertIsNotNone(job.failed_at)
+        self.assertEqual(
+            jobs.queue_stats(), [{"kind": "test.flaky", "queued": 0, "due": 0, "failed": 1, "oldest": None}]
+        )
+        self.assertEqual(jobs.retry_failed(), 1)
+        self.assertEqual(Job.objects.get().attempts, 0)
+
+    def test_expired_leases_are_claimed_again(self):
+        batches = self.flaky_handler()
+        jobs.enqueue("test.flaky", "slow")
+        stalled = jobs.claim()
+        self.assertIsNone(jobs.claim())
+        Job.objects.update(run_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        taken_over = jobs.claim()
+        self.assertEqual(jobs.run(*stalled), [])
+        self.assertEqual(len(jobs.run(*taken_over)), 1)
+        self.assertEqual(batches, [["slow"]])
+        self.assertFalse(Job.objects.exists())
+
+
+# ---------------------------
+# Search
+# ---------------------------
+
+class SearchTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner")
+        cls.other = User.objects.create_user("other")
+        cls.pizza = Expense.objects.create(payer=cls.user, title="Pizza night", amount=20)
+        cls.party = Expense.objects.create(payer=cls.user, title="Pizza pizza party", amount=50)
+        cls.cafe = Expense.objects.create(payer=cls.other, title="Café and pizzeria", amount=8)
+        ExpenseShare.objects.create(expense=cls.cafe, payee=cls.user, amount=4)
+        Expense.objects.create(payer=cls.other, title="Pizza for someone else", amount=9)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, query):
+        response = self.client.get(reverse("expense-search"), {"q": query})
+        self.assertEqual(response.status_code, 200)
+        ids = [row["id"] for row in response.data["results"]]
+        self.assertEqual(response.data["count"], len(ids))
+        return ids
+
+    def test_ranked_and_visible_only(self):
+        self.assertEqual(self.search("pizza"), [self.party.pk, self.pizza.pk])
+        self.assertEqual(self.search("piz"), [self.party.pk, self.pizza.pk, self.cafe.pk])
+        self.assertEqual(self.search("CAFE"), [self.cafe.pk])
+        self.assertEqual(self.search('pizza" OR * NEAR(('), [])
+        self.assertEqual(self.client.get(reverse("expense-search")).status_code, 400)
+
+    def test_index_follows_writes(self):
+        self.pizza.title = "Sushi night"
+        self.pizza.save()
+        Expense.objects.filter(pk=self.party.pk).update(title="Sushi party")
+        Expense.objects.bulk_create([Expense(payer=self.user, title="More sushi", amount=1)])
+        self.cafe.delete()
+        self.assertEqual(len(self.search("sushi")), 3)
+        self.assertEqual(self.search("pizza"), [])
+
+    def test_admin_uses_index(self):
+        from django.contrib.admin.sites import site
+
+        model_admin = site._registry[Expense]
+        results, _ = model_admin.get_search_results(None, Expense.objects.all(), "pizz")
+        self.assertEqual(results.count(), 4)
+        results, _ = model_admin.get_search_results(None, Expense.objects.all(), "other")
+        self.assertEqual(results.count(), 2)
+
+
+# ---------------------------
+# Friend graph
+# ---------------------------
+
+class FriendGraphTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = seed_users(6)
+        a, b, c, d, e, f = cls.students = list(Student.objects.filter(user__in=cls.users).order_by("pk"))
+        a.friends.add(b, c, d)
+        b.friends.add(c, d, e)
+        c.friends.add(d, e)
+        d.friends.add(f)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def suggestions(self):
+        response = self.client.get(reverse("friend-suggestions"))
+        self.assertEqual(response.status_code, 200)
+        return [(row["student"]["id"], row["mutual_friends"]) for row in response.data]
+
+    def test_mutual_friends(self):
+        a, b, c, d, e, f = self.students
+        response = self.client.get(reverse("friend-mutual", args=[b.pk]))
+        self.assertEqual([row["id"] for row in response.data], [c.pk, d.pk])
+        self.assertEqual(response.data[0]["user"]["username"], "user2")
+        self.assertEqual(self.client.get(reverse("friend-mutual", args=[0])).status_code, 404)
+
+    def test_suggestions_ranked_by_mutual_friends(self):
+        a, b, c, d, e, f = self.students
+        self.assertEqual(self.suggestions(), [(e.pk, 2), (f.pk, 1)])
+        response = self.client.get(reverse("friend-suggestions"), {"limit": 1})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(self.client.get(reverse("friend-suggestions"), {"limit": 0}).status_code, 400)
+
+    def test_cache_follows_friend_changes(self):
+        a, b, c, d, e, f = self.students
+        self.assertEqual(self.suggestions(), [(e.pk, 2), (f.pk, 1)])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(friend_graph.friend_ids([a.pk])[a.pk]), [b.pk, c.pk, d.pk])
+            self.assertEqual(friend_graph.suggestions(a.pk, 10), [(e.pk, 2), (f.pk, 1)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("friend-add"), {"username": "user4"})
+        self.assertEqual(self.suggestions(), [(f.pk, 1)])
+
+        # From the other side of the relation
+        with self.captureOnCommitCallbacks(execute=True):
+            e.friend_of.remove(a)
+            d.friends.clear()
+        self.assertEqual(self.suggestions(), [(e.pk, 2)])
+
+    def test_batch_add_and_remove(self):
+        a, b, c, d, e, f = self.students
+        usernames = ["user4", "user1", "user0", "ghost", "user4", "user5"]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("friend-add-batch"), {"usernames": usernames}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["username"], row["result"]) for row in response.data["results"]],
+            [("user4", "added"), ("user1", "already_friends"), ("user0", "self"), ("ghost", "not_found"),
+             ("user5", "added")],
+        )
+        self.assertEqual(list(friend_graph.friend_ids([a.pk])[a.pk]), [b.pk, c.pk, d.pk, e.pk, f.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("friend-remove-batch"), {"usernames": ["user1", "user2", "user0"]}, format="json"
+            )
+        self.assertEqual([row["result"] for row in response.data["results"]], ["removed", "removed", "self"])
+        self.assertEqual(list(friend_graph.friend_ids([a.pk])[a.pk]), [d.pk, e.pk, f.pk])
+        response = self.client.post(reverse("friend-remove-batch"), {"usernames": ["user1"]}, format="json")
+        self.assertEqual(response.data["results"], [{"username": "user1", "result": "not_friends"}])
+        self.assertEqual(self.client.get(reverse("friend-list")).data[0]["id"], d.pk)
+
+        response = self.client.post(reverse("friend-add-batch"), {"usernames": []}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+# ---------------------------
+# Debt simplification
+# ---------------------------
+
+class SimplifyTests(BaseTestCase):
+    def assertSettles(self, ids, nets, transfers):
+        balances = dict(zip(ids, nets))
+        for debtor, creditor, cents in transfers:
+            self.assertGreater(cents, 0)
+            balances[debtor] += cents
+            balances[creditor] -= cents
+        self.assertEqual(set(balances.values()), {0} if balances else set())
+        self.assertLessEqual(len(transfers), max(len(ids) - 1, 0))
+
+    def test_transfers_clear_every_balance(self):
+        rng = random.Random(0)
+        for size in (0, 2, 3, 10, 200):
+            with self.subTest(size=size):
+                nets = [rng.randint(-50_000, 50_000) for _ in range(size - 1)]
+                nets.append(-sum(nets))
+                ids = list(range(1, size + 1))
+                self.assertSettles(ids, nets, simplify.simplify(ids, nets))
+
+    def test_odd_cents_come_out_exact(self):
+        payer, *friends = seed_users(4)
+        student = Student.objects.get(user=payer)
+        student.friends.add(*Student.objects.filter(user__in=friends))
+        # 10.00 three ways and 0.05 two ways leave odd cents everywhere
+        pizza = Expense.objects.create(payer=payer, title="Pizza", amount=Decimal("10.00"))
+        splits.resplit(pizza.pk, payer.pk, splits.EQUAL, [(friend.pk, None) for friend in friends])
+        gum = Expense.objects.create(payer=friends[0], title="Gum", amount=Decimal("0.05"))
+        splits.resplit(gum.pk, friends[0].pk, splits.EQUAL, [(friends[1].pk, None), (friends[2].pk, None)])
+
+        user_ids = simplify.group_user_ids(student)
+        ids, nets = simplify.net_balances(user_ids)
+        self.assertEqual(
+            dict(zip(ids, nets)),
+            {payer.pk: 1000, friends[0].pk: -334 + 5, friends[1].pk: -333 - 3, friends[2].pk: -333 - 2},
+        )
+        transfers = simplify.settle_up(user_ids)
+        self.assertSettles(
+            ids, nets,
+            [(row["from_user_id"], row["to_user_id"], int(row["amount"] * 100)) for row in transfers],
+        )
+        for row in transfers:
+            self.assertEqual(row["amount"], row["amount"].quantize(Decimal("0.01")))
+
+
+# ---------------------------
+# Settlements
+# ---------------------------
+
+class SettlementTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.creditor = User.objects.create_user("creditor")
+        cls.debtor = User.objects.create_user("debtor")
+        cls.bystander = User.objects.create_user("bystander")
+        cls.shares = []
+        for amount in (10, 20):
+            expense = Expense.objects.create(payer=cls.creditor, title=f"Lunch {amount}", amount=amount * 2)
+            cls.shares.append(ExpenseShare.objects.create(expense=expense, payee=cls.debtor, amount=amount))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.debtor)
+
+    def settle(self, amount, **data):
+        return self.client.post(reverse("settlement-list-create"), {"to_user": self.creditor.pk, "amount": amount, **data})
+
+    def wallet(self, user):
+        return Student.objects.get(user=user).wallet_balance
+
+    def test_settlement_moves_money_and_settles_shares(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.settle("15.00")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((self.wallet(self.debtor), self.wallet(self.creditor)), (Decimal("-15"), Decimal("15")))
+        self.assertEqual(PairBalance.objects.get(user=self.creditor, other=self.debtor).amount, Decimal("15"))
+        self.assertEqual([share.settled for share in ExpenseShare.objects.order_by("pk")], [True, False])
+        self.assertEqual(self.client.get(reverse("profile")).data["wallet_balance"], "-15.00")
+
+        # What is left over from the first payment counts towards the next share
+        self.settle("15.00")
+        self.assertEqual([share.settled for share in ExpenseShare.objects.order_by("pk")], [True, True])
+        self.assertEqual(self.client.get(reverse("balances")).data["balances"], [])
+        self.assertEqual(len(self.client.get(reverse("settlement-list-create")).data["results"]), 2)
+
+        out = io.StringIO()
+        call_command("rebuild_ledger", "--verify", stdout=out)
+        self.assertIn("Ledger is consistent", out.getvalue())
+
+    def test_batch_is_all_or_nothing(self):
+        transfers = [
+            {"to_user": self.creditor.pk, "amount": "5.00"},
+            {"from_user": self.bystander.pk, "to_user": self.creditor.pk, "amount": "5.00"},
+        ]
+        response = self.client.post(reverse("settlement-batch"), {"transfers": transfers}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Settlement.objects.exists())
+
+        # Only the payer records a payment, even one the other way round
+        transfers[1] = {"from_user": self.creditor.pk, "to_user": self.debtor.pk, "amount": "2.00"}
+        response = self.client.post(reverse("settlement-batch"), {"transfers": transfers}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Settlement.objects.exists())
+
+        # Together the transfers pay more than the 30.00 owed
+        transfers[1] = {"to_user": self.creditor.pk, "amount": "25.01"}
+        response = self.client.post(reverse("settlement-batch"), {"transfers": transfers}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Settlement.objects.exists())
+
+        transfers[1] = {"to_user": self.creditor.pk, "amount": "2.00"}
+        response = self.client.post(reverse("settlement-batch"), {"transfers": transfers}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((self.wallet(self.debtor), self.wallet(self.creditor)), (Decimal("-7"), Decimal("7")))
+
+    def test_deleting_a_user_reverses_their_settlements(self):
+        expense = Expense.objects.create(payer=self.creditor, title="Taxi", amount=14)
+        ExpenseShare.objects.create(expense=expense, payee=self.bystander, amount=7)
+        self.settle("15.00")
+        self.debtor.delete()
+        self.assertEqual(UserBalance.objects.get(user=self.creditor).lent, 7)
+        out = io.StringIO()
+        call_command("rebuild_ledger", "--verify", stdout=out)
+        self.assertIn("Ledger is consistent", out.getvalue())
+
+    def test_raising_a_settled_share_unsettles_it(self):
+        self.settle("10.00")
+        share = self.shares[0]
+        url = reverse("expense-share-detail", args=[share.pk])
+        self.assertTrue(ExpenseShare.objects.get(pk=share.pk).settled)
+
+        payer = APIClient()
+        payer.force_authenticate(self.creditor)
+        response = payer.patch(url, {"amount": "25.00"})
+        self.assertFalse(response.data["settled"])
+        self.assertEqual(PairBalance.objects.get(user=self.creditor, other=self.debtor).amount, Decimal("35"))
+        # Its expense still has 15.00 unpaid, so it must not be archived
+        later = datetime.now(timezone.utc) + timedelta(days=1)
+        self.assertEqual(list(archive.archive(before=later)), [])
+
+        # Lowering it back below what was paid settles it again
+        response = payer.patch(url, {"amount": "8.00"})
+        self.assertTrue(response.data["settled"])
+        self.assertEqual(list(archive.archive(before=later)), [(1, 1)])
+        self.assertEqual(ArchivedExpenseShare.objects.get().pk, share.pk)
+
+        # The 2.00 the lowered share left over goes to the next one
+        self.settle("18.00")
+        self.assertTrue(ExpenseShare.objects.get(pk=self.shares[1].pk).settled)
+        # Lowering a paid-off share leaves credit that settles a new one at once
+        response = payer.patch(reverse("expense-share-detail", args=[self.shares[1].pk]), {"amount": "15.00"})
+        self.assertTrue(response.data["settled"])
+        expense = Expense.objects.create(payer=self.creditor, title="Snack", amount=4)
+        response = payer.post(
+            reverse("expense-share-list-create", args=[expense.pk]), {"payee": self.debtor.pk, "amount": "2.00"}
+        )
+        self.assertTrue(response.data["settled"])
+        out = io.StringIO()
+        call_command("rebuild_ledger", "--verify", stdout=out)
+        self.assertIn("Ledger is consistent", out.getvalue())
+
+    def test_settle_up_plan_can_be_recorded(self):
+        a, b, c, d = seed_users(4, prefix="friend")
+        students = {student.user_id: student for student in Student.objects.filter(user__in=[a, b, c, d])}
+        for student in students.values():
+            student.friends.add(*(other for other in students.values() if other != student))
+
+        def owe(debtor, creditor, amount):
+            expense = Expense.objects.create(payer=creditor, title="Dinner", amount=amount)
+            ExpenseShare.objects.create(expense=expense, payee=debtor, amount=amount)
+
+        def pay_my_part(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            plan = client.get(reverse("balances-settle-up")).data
+            transfers = [row for row in plan if row["from_user"] == user.pk]
+            return client.post(reverse("settlement-batch"), {"transfers": transfers}, format="json")
+
+        def assertAllSettled():
+            self.assertFalse(PairBalance.objects.filter(user__in=[a, b, c, d]).exclude(amount=0).exists())
+            self.assertFalse(ExpenseShare.objects.filter(payee__in=[a, b, c, d], settled=False).exists())
+            out = io.StringIO()
+            call_command("rebuild_ledger", "--verify", stdout=out)
+            self.assertIn("Ledger is consistent", out.getvalue())
+
+        # a pays c what a owes b and b owes c; b's debt is settled on the way
+        owe(a, b, 10)
+        owe(b, c, 10)
+        response = pay_my_part(a)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            {(row["from_user_id"], row["to_user_id"], row["amount"]) for row in response.data["settlements"]},
+            {(a.pk, b.pk, "10.00"), (b.pk, c.pk, "10.00")},
+        )
+        self.assertEqual([self.wallet(user) for user in (a, b, c)], [-10, 0, 10])
+        assertAllSettled()
+
+        # No chain of debts leads from a to c, but a owes the group what c is owed
+        owe(a, b, 10)
+        owe(d, c, 10)
+        response = self.client.post(reverse("settlement-list-create"), {"to_user": c.pk, "amount": "10.00"})
+        # The test's debtor owes c nothing, directly or through friends
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(a)
+        response = self.client.post(reverse("settlement-list-create"), {"to_user": c.pk, "amount": "10.01"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse("settlement-list-create"), {"to_user": c.pk, "amount": "10.00"})
+        self.assertEqual(response.status_code, 201)
+        # which leaves d owing b, through c and a
+        self.assertEqual(pay_my_part(d).status_code, 201)
+        self.assertEqual([self.wallet(user) for user in (a, b, c, d)], [-20, 10, 20, -10])
+        assertAllSettled()
+
+    def test_invalid_settlements(self):
+        self.assertEqual(self.settle("1.00", to_user=self.debtor.pk).status_code, 400)
+        self.assertEqual(self.settle("1.00", to_user=0).status_code, 400)
+        self.assertEqual(self.settle("0.00").status_code, 400)
+        # More than is owed, or nothing owed at all
+        self.assertEqual(self.settle("30.01").status_code, 400)
+        self.assertEqual(self.settle("1.00", to_user=self.bystander.pk).status_code, 400)
+        self.client.force_authenticate(self.creditor)
+        self.assertEqual(self.settle("1.00", from_user=self.debtor.pk).status_code, 400)
+        self.assertFalse(Settlement.objects.exists())
+        self.assertEqual(self.wallet(self.debtor), 0)
+
+
+# ---------------------------
+# Splits
+# ---------------------------
+
+class SplitTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer, *cls.friends = seed_users(4)
+        cls.expense = Expense.objects.create(payer=cls.payer, title="Groceries", amount=Decimal("100.00"))
+        for friend in cls.friends[:2]:
+            ExpenseShare.objects.create(expense=cls.expense, payee=friend, amount=Decimal("30.00"))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.payer)
+
+    def resplit(self, strategy, shares, **data):
+        url = reverse("expense-split", args=[self.expense.pk])
+        return self.client.put(url, {"strategy": strategy, "shares": shares, **data}, format="json")
+
+    def shares(self):
+        return dict(self.expense.shares.values_list("payee_id", "amount"))
+
+    def test_strategies_distribute_every_cent(self):
+        a, b, c = (friend.pk for friend in self.friends)
+        cases = [
+            (splits.EQUAL, [(a, None), (b, None), (c, None)], {a: "33.34", b: "33.33", c: "33.33"}),
+            (splits.WEIGHTED, [(a, 1), (b, 1), (c, 1)], {a: "33.34", b: "33.33", c: "33.33"}),
+            (splits.WEIGHTED, [(a, 2), (b, 1)], {a: "66.67", b: "33.33"}),
+            # The payer keeps what the percentages leave
+            (splits.PERCENTAGE, [(a, "12.5"), (b, "33.333")], {a: "12.50", b: "33.33"}),
+            (splits.EXACT, [(a, "0.01"), (b, "99.99")], {a: "0.01", b: "99.99"}),
+        ]
+        for strategy, values, expected in cases:
+            with self.subTest(strategy=strategy, values=values):
+                amounts = splits.split(Decimal("100.00"), strategy, values)
+                self.assertEqual(amounts, {user_id: Decimal(amount) for user_id, amount in expected.items()})
+        self.assertEqual(splits.apportion(5, [1, 1, 1]), [2, 2, 1])
+
+        for strategy, values in (
+            (splits.PERCENTAGE, [(a, 60), (b, 41)]),
+            (splits.EXACT, [(a, "60.00"), (b, "40.01")]),
+            (splits.EXACT, [(a, "0.001")]),
+        ):
+            with self.assertRaises(ValueError):
+                splits.split(Decimal("100.00"), strategy, values)
+
+    def test_resplit_replaces_the_share_set(self):
+        a, b, c = (friend.pk for friend in self.friends)
+        settlements.settle([(a, self.payer.pk, "30.00")])
+        self.assertTrue(ExpenseShare.objects.get(payee_id=a).settled)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.resplit("equal", [{"payee": a}, {"payee": b}, {"payee": c}])
+        self.assertEqual(response.status_code, 200, response.content)
+        # The payer keeps a quarter
+        self.assertEqual(self.shares(), {a: Decimal("25.00"), b: Decimal("25.00"), c: Decimal("25.00")})
+        self.assertEqual([share["payee"] for share in response.data["shares"]], [a, b, c])
+        # a's settlement still covers the smaller share
+        self.assertTrue(ExpenseShare.objects.get(payee_id=a).settled)
+        self.assertFalse(ExpenseShare.objects.get(payee_id=c).settled)
+
+        share_id = ExpenseShare.objects.get(payee_id=a).pk
+        response = self.resplit("exact", [{"payee": a, "value": "25.00"}, {"payee": b, "value": "50.00"}])
+        self.assertEqual(response.status_code, 200, response.content)
+        # Unchanged shares are kept as they are
+        self.assertEqual(ExpenseShare.objects.get(payee_id=a).pk, share_id)
+        self.assertEqual(self.shares(), {a: Decimal("25.00"), b: Decimal("50.00")})
+
+        for command in ("rebuild_ledger", "rebuild_analytics"):
+            out = io.StringIO()
+            call_command(command, "--verify", stdout=out)
+            self.assertIn("consistent", out.getvalue())
+
+    def test_invalid_resplits_change_nothing(self):
+        a, b, _ = (friend.pk for friend in self.friends)
+        before = self.shares()
+        for strategy, shares in (
+            ("exact", [{"payee": a, "value": "60.00"}, {"payee": b, "value": "40.01"}]),
+            ("percentage", [{"payee": a}]),
+            ("weighted", [{"payee": a, "value": "0"}]),
+            ("equal", [{"payee": a}, {"payee": a}]),
+            ("equal", [{"payee": 0}]),
+            ("halves", [{"payee": a}]),
+        ):
+            with self.subTest(strategy=strategy, shares=shares):
+                self.assertEqual(self.resplit(strategy, shares).status_code, 400)
+        self.assertEqual(self.shares(), before)
+
+        self.client.force_authenticate(self.friends[0])
+        self.assertEqual(self.resplit("equal", [{"payee": b}]).status_code, 403)
+        self.client.force_authenticate(self.friends[2])
+        self.assertEqual(self.resplit("equal", [{"payee": b}]).status_code, 404)
+
+
+# ---------------------------
+# Sync
+# ---------------------------
+
+@override_settings(API_SYNC_SETTLE_SECONDS=0)
+class SyncTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer, cls.a, cls.b, cls.c = seed_users(4)
+        cls.rent = Expense.objects.create(payer=cls.payer, title="Rent", amount=Decimal("90.00"))
+        cls.a_share = ExpenseShare.objects.create(expense=cls.rent, payee=cls.a, amount=Decimal("30.00"))
+        cls.b_share = ExpenseShare.objects.create(expense=cls.rent, payee=cls.b, amount=Decimal("30.00"))
+        cls.taxi = Expense.objects.create(payer=cls.payer, title="Taxi", amount=Decimal("20.00"))
+        ExpenseShare.objects.create(expense=cls.taxi, payee=cls.b, amount=Decimal("10.00"))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def sync(self, user, cursor=None):
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse("sync"), {"since": cursor} if cursor else {})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.data
+
+    def test_only_changes_since_the_cursor(self):
+        cursors = {user: self.sync(user)["cursor"] for user in (self.a, self.b, self.c)}
+
+        self.client.force_authenticate(self.payer)
+        self.client.patch(reverse("expense-detail", args=[self.rent.pk]), {"title": "Rent March"})
+        self.client.delete(reverse("expense-share-detail", args=[self.a_share.pk]))
+        self.client.delete(reverse("expense-detail", args=[self.taxi.pk]))
+        c_share = self.client.post(
+            reverse("expense-share-list-create", args=[self.rent.pk]), {"payee": self.c.pk, "amount": "30.00"}
+        ).data
+
+        # Taken off the rent: it is gone for a, along with the share
+        changes = self.sync(self.a, cursors[self.a])
+        self.assertEqual((changes["expenses"], changes["shares"]), ([], []))
+        self.assertEqual(changes["deleted"], {"expenses": [self.rent.pk], "shares": [self.a_share.pk]})
+
+        # The taxi's shares go with it
+        changes = self.sync(self.b, cursors[self.b])
+        self.assertEqual([(row["id"], row["title"]) for row in changes["expenses"]], [(self.rent.pk, "Rent March")])
+        self.assertEqual([row["id"] for row in changes["shares"]], [c_share["id"]])
+        self.assertEqual(changes["deleted"], {"expenses": [self.taxi.pk], "shares": [self.a_share.pk]})
+        self.assertFalse(changes["has_more"])
+        again = self.sync(self.b, changes["cursor"])
+        self.assertEqual((again["expenses"], again["shares"], again["deleted"]), ([], [], {"expenses": [], "shares": []}))
+
+        # A new payee gets the expense with the share
+        changes = self.sync(self.c, cursors[self.c])
+        self.assertEqual([row["id"] for row in changes["expenses"]], [self.rent.pk])
+        self.assertEqual(changes["shares"][0], c_share)
+
+    def test_bulk_writes_and_cascades(self):
+        cursor = self.sync(self.b)["cursor"]
+        splits.resplit(self.rent.pk, self.payer.pk, splits.EQUAL, [(self.a.pk, None), (self.c.pk, None)])
+        changes = self.sync(self.b, cursor)
+        self.assertEqual(changes["deleted"], {"expenses": [self.rent.pk], "shares": [self.b_share.pk]})
+
+        # Put back on it, b sees the expense again rather than a deletion
+        splits.resplit(self.rent.pk, self.payer.pk, splits.EQUAL, [(self.b.pk, None)])
+        changes = self.sync(self.b, cursor)
+        self.assertEqual([row["id"] for row in changes["expenses"]], [self.rent.pk])
+        self.assertEqual(changes["deleted"]["expenses"], [])
+
+        cursor = self.sync(self.b)["cursor"]
+        self.payer.delete()
+        changes = self.sync(self.b, cursor)
+        self.assertEqual(changes["deleted"]["expenses"], [self.rent.pk, self.taxi.pk])
+
+    @override_settings(API_SYNC_PAGE_SIZE=2)
+    def test_pages_and_invalid_cursors(self):
+        cursor = self.sync(self.payer)["cursor"]
+        created = [Expense.objects.create(payer=self.payer, title=f"Lunch {i}", amount=5).pk for i in range(5)]
+        seen = []
+        while True:
+            changes = self.sync(self.payer, cursor)
+            seen += [row["id"] for row in changes["expenses"]]
+            cursor = changes["cursor"]
+            if not changes["has_more"]:
+                break
+        self.assertEqual(seen, created)
+
+        self.client.force_authenticate(self.payer)
+        self.assertEqual(self.client.get(reverse("sync"), {"since": "not-a-cursor"}).status_code, 400)
+        expired = datetime.now(timezone.utc) - timedelta(days=365)
+        response = self.client.get(
+            reverse("sync"), {"since": sync.encode_cursor(dict.fromkeys(sync.STREAMS, (expired, 0)))}
+        )
+        self.assertEqual(response.status_code, 410)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(reverse("sync")).status_code, 401)
+
+
+# ---------------------------
+# Event stream
+# ---------------------------
+
+@override_settings(API_EVENTS_KEEPALIVE=0.05)
+class EventStreamTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.payer, cls.payee, cls.stranger = seed_users(3)
+        cls.expense = Expense.objects.create(payer=cls.payer, title="Pizza", amount=Decimal("30.00"))
+
+    def setUp(self):
+        cache.clear()
+        self.tokens = {
+            user: str(CachedRefreshToken.for_user(user).access_token) for user in (self.payee, self.stranger)
+        }
+
+    async def open(self, user, token=True):
+        # Consumed by a task the way the ASGI handler does, which cancels it on disconnect
+        query = {"token": self.tokens[user]} if token else {}
+        response = await async_views.EventStreamView.as_view()(AsyncRequestFactory().get("/api/events/", query))
+        if response.status_code != 200:
+            return response
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        chunks = asyncio.Queue()
+
+        async def consume():
+            async for chunk in response.streaming_content:
+                chunks.put_nowait(chunk)
+
+        consumer = asyncio.create_task(consume())
+        self.assertEqual(await asyncio.wait_for(chunks.get(), 1), b": connected\n\n")
+        return consumer, chunks
+
+    async def receive(self, chunks):
+        while True:
+            chunk = await asyncio.wait_for(chunks.get(), 1)
+            if not chunk.startswith(b":"):  # keepalive
+                return json.loads(chunk.removeprefix(b"data: "))
+
+    async def close(self, *consumers):
+        for consumer in consumers:
+            consumer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await consumer
+
+    @sync_to_async
+    def write(self, function, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return function(*args, **kwargs)
+
+    def test_changes_reach_the_users_they_concern(self):
+        async def scenario():
+            response = await self.open(self.payee, token=False)
+            self.assertEqual(response.status_code, 401)
+
+            (payee, payee_chunks), (stranger, stranger_chunks) = [
+                await self.open(user) for user in (self.payee, self.stranger)
+            ]
+            share = await self.write(ExpenseShare.objects.create, expense=self.expense, payee=self.payee, amount=10)
+            self.assertEqual(
+                await self.receive(payee_chunks), {"type": "share.created", "id": share.pk, "expense": self.expense.pk}
+            )
+            await self.write(splits.resplit, self.expense.pk, self.payer.pk, splits.EQUAL, [(self.payee.pk, None)])
+            self.assertEqual((await self.receive(payee_chunks))["type"], "share.updated")
+            await self.write(lambda: Expense.objects.get(pk=self.expense.pk).delete())
+            self.assertEqual(await self.receive(payee_chunks), {"type": "expense.deleted", "id": self.expense.pk})
+
+            # Nothing concerned the stranger
+            self.assertEqual(await asyncio.wait_for(stranger_chunks.get(), 1), b": keepalive\n\n")
+            self.assertTrue(stranger_chunks.empty())
+            await self.close(payee, stranger)
+            self.assertEqual(len(events.hub), 0)
+
+        async_to_sync(scenario)()
+
+    @override_settings(
+        API_EVENTS_BROKER="api.events.CacheBroker", API_EVENTS_POLL_INTERVAL=0.01, API_EVENTS_QUEUE_SIZE=3
+    )
+    def test_cache_broker(self):
+        # The local cache stands in for the shared one processes relay events through
+        async def scenario():
+            consumer, chunks = await self.open(self.payee)
+            shares = [{"payee": self.payee.pk, "amount": "1.00"}, {"payee": self.stranger.pk, "amount": "1.00"}]
+            serializer = ExpenseWithSharesSerializer(data={"title": "Taxi", "amount": "5.00", "shares": shares})
+            await sync_to_async(serializer.is_valid)(raise_exception=True)
+            expense = await self.write(serializer.save, payer=self.payer)
+            self.assertEqual(await self.receive(chunks), {"type": "expense.created", "id": expense.pk})
+            self.assertEqual((await self.receive(chunks))["type"], "share.created")
+
+            # A stream that falls behind is told to resync instead
+            await sync_to_async(events.get_broker().publish)([([self.payee.pk], {"type": "test"})] * 5)
+            self.assertEqual(await self.receive(chunks), events.RESYNC)
+            await self.close(consumer)
+            # The poller stops with the loop's last stream
+            await asyncio.wait_for(events.get_broker().pollers[asyncio.get_running_loop()], 1)
+
+        async_to_sync(scenario)()
+
+
+# ---------------------------
+# Admin
+# ---------------------------
+
+class AdminTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        cls.users = seed_users(5)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        for i in range(count):
+            expense = Expense.objects.create(payer=self.users[i % 5], title=f"Expense {i}", amount=10)
+            ExpenseShare.objects.create(expense=expense, payee=self.users[(i + 1) % 5], amount=5)
+        Student.objects.get(user=self.users[0]).friends.add(*Student.objects.exclude(user=self.users[0]))
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        urls = [
+            reverse(f"admin:{name}_changelist")
+            for name in ("api_expense", "api_expenseshare", "api_student", "api_settlement", "auth_user")
+        ]
+        self.add_rows(2)
+        before = [self.changelist_queries(url) for url in urls]
+        self.add_rows(20)
+        self.assertEqual([self.changelist_queries(url) for url in urls], before)
+
+    def test_estimated_count(self):
+        self.add_rows(3)
+        paginator = pagination.EstimatedCountPaginator(Expense.objects.order_by("pk"), 100)
+        self.assertEqual(paginator.count, 3)
+        Expense.objects.filter(pk=Expense.objects.order_by("pk").first().pk).delete()
+        with mock.patch.object(pagination.EstimatedCountPaginator, "estimate_threshold", 1):
+            # SQLite keeps no statistics, and deleted ids must not count as rows
+            self.assertIsNone(pagination.estimated_count(Expense.objects.all()))
+            self.assertEqual(pagination.EstimatedCountPaginator(Expense.objects.order_by("pk"), 100).count, 2)
+            with mock.patch.object(pagination, "estimated_count", return_value=5):
+                self.assertEqual(pagination.EstimatedCountPaginator(Expense.objects.order_by("pk"), 100).count, 5)
+                filtered = Expense.objects.filter(payer=self.users[1]).order_by("pk")
+                self.assertEqual(pagination.EstimatedCountPaginator(filtered, 100).count, 1)
+
+    def test_friends_use_autocomplete(self):
+        self.add_rows(2)
+        student = Student.objects.get(user=self.users[0])
+        student.friends.remove(Student.objects.get(user=self.admin))
+        response = self.client.get(reverse("admin:api_student_change", args=[student.pk]))
+        self.assertContains(response, "admin-autocomplete")
+        # Only the selected friends are rendered, not every student
+        self.assertContains(response, ">user4</option>")
+        self.assertNotContains(response, ">admin</option>")
+
+
+# ---------------------------
+# Seed data and benchmarks
+# ---------------------------
+
+@override_settings(PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"])
+class BenchmarkCommandTests(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seed_data_keeps_ledger_and_rollups_consistent(self):
+        call_command("seed_data", "--users", "30", "--expenses-per-user", "4", stdout=io.StringIO())
+        self.assertEqual(User.objects.filter(username__startswith="seed-").count(), 30)
+        self.assertTrue(ExpenseShare.objects.exists())
+        # Expenses are spread over past months rather than all created now
+        self.assertGreater(Expense.objects.dates("created_at", "month").count(), 1)
+        for command in ("rebuild_ledger", "rebuild_analytics"):
+            out = io.StringIO()
+            call_command(command, "--verify", stdout=out)
+            self.assertIn("consistent", out.getvalue())
+
+    def test_bench_api_drives_every_route(self):
+        call_command("seed_data", "--users", "30", "--expenses-per-user", "4", stdout=io.StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "results.json"
+            call_command(
+                "bench_api", "--concurrency", "1", "--requests", "1", "--warmup", "0", "--output", str(path),
+                stdout=io.StringIO(), stderr=io.StringIO(),
+            )
+            results = json.loads(path.read_text())["routes"]
+        self.assertEqual(
+            {row["route"] for row in results},
+            {pattern.name for pattern in urls.urlpatterns} - set(bench_api.SKIPPED_ROUTES),
+        )
+        self.assertEqual([row for row in results if row["errors"]], [])
+        self.assertTrue(all(row["queries_max"] < 50 for row in results))
+
+
+# ---------------------------
+# Request timing
+# ---------------------------
+
+class RequestTimingTests(BaseTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner")
+        cls.staff = User.objects.create_user("staff", is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.stats.reset()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {CachedRefreshToken.for_user(self.user).access_token}")
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("balances"))
+        metrics = {metric.split(";")[0] for metric in response["Server-Timing"].split(", ")}
+        self.assertEqual(metrics, {"db", "auth", "render", "total"})
+        self.assertIn('desc="', response["Server-Timing"])
+
+    @override_settings(API_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.assertLogs("api.requests", "WARNING") as logs:
+            self.client.get(reverse("balances"), {"token": "secret-token"})
+        self.assertNotIn("secret-token", logs.output[0])
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["route"], "GET /api/balances/")
+        self.assertEqual(entry["path"], "/api/balances/")
+        self.assertEqual(entry["user_id"], self.user.pk)
+        self.assertGreater(entry["queries"], 0)
+        self.assertTrue(entry["top_sql"][0]["sql"].startswith("SELECT"))
+
+    def test_stats_are_staff_only_and_per_route(self):
+        for _ in range(3):
+            self.client.get(reverse("balances"))
+        self.client.get(reverse("expense-detail", args=[12345]))
+        self.assertEqual(self.client.get(reverse("request-stats")).status_code, 403)
+
+        self.client.force_authenticate(self.staff)
+        rows = {row["route"]: row for row in self.client.get(reverse("request-stats")).data["routes"]}
+        self.assertEqual(rows["GET /api/balances/"]["requests"], 3)
+        self.assertEqual(rows["GET /api/expenses/<int:pk>/"]["requests"], 1)
+        self.assertIsNotNone(rows["GET /api/balances/"]["p95_ms"])
+
+        out = io.StringIO()
+        call_command("request_stats", "--reset", stdout=out)
+        self.assertIn("GET /api/balances/", out.getvalue())
+        self.assertEqual(instrumentation.collect(), [])
+
+    def test_async_requests_run_concurrently_and_count_queries_in_other_threads(self):
+        def query():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        async def view(request):
+            await asyncio.sleep(0.2)
+            # Run on a thread, and connection, of its own
+            await sync_to_async(query, thread_sensitive=False)()
+            return HttpResponse()
+
+        middleware = instrumentation.RequestTimingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+        async def requests():
+            return await asyncio.gather(*(middleware(AsyncRequestFactory().get("/")) for _ in range(5)))
+
+        started = time.perf_counter()
+        responses = async_to_sync(requests)()
+        self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertTrue(all('desc="1 queries"' in response["Server-Timing"] for response in responses))
+
+    @override_settings(API_REQUEST_TIMING=False)
+    def test_turned_off(self):
+        response = self.client.get(reverse("balances"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(instrumentation.collect(), [])
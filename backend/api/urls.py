@@ -1,19 +1,36 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from . import async_views, views
 from .views import (
     RegisterView,
     LogoutView,
-    StudentProfileView,
     StudentUpdateProfileView,
-    FriendListView,
     AddFriendView,
     RemoveFriendView,
-    ExpenseListCreateView,
-    ExpenseDetailView,
+    BatchAddFriendsView,
+    BatchRemoveFriendsView,
+    MutualFriendsView,
+    FriendSuggestionsView,
+    ExpenseBulkCreateView,
+    ExpenseSearchView,
+    ExpenseExportView,
+    ExpenseHistoryView,
+    ExpenseSplitView,
     ExpenseShareListCreateView,
     ExpenseShareDetailView,
+    BalanceView,
+    SettleUpView,
+    SettlementListCreateView,
+    SettlementBatchView,
+    AnalyticsView,
+    SyncView,
+    RequestStatsView,
 )
 
+# The read-heavy views: the same URLs, served with the async ORM under ASGI
+read_views = async_views if settings.API_ASYNC_VIEWS else views
+
 urlpatterns = [
     # Authentication
     path("register/", RegisterView.as_view(), name="register"),
@@ -22,19 +39,47 @@ urlpatterns = [
     path("logout/", LogoutView.as_view(), name="logout"),
 
     # Student profile
-    path("profile/", StudentProfileView.as_view(), name="profile"),
+    path("profile/", read_views.StudentProfileView.as_view(), name="profile"),
     path("profile/update/", StudentUpdateProfileView.as_view(), name="profile-update"),
 
     # Friends
-    path("friends/", FriendListView.as_view(), name="friend-list"),   
+    path("friends/", read_views.FriendListView.as_view(), name="friend-list"),   
     path("friends/add/", AddFriendView.as_view(), name="friend-add"),
     path("friends/remove/<int:pk>/", RemoveFriendView.as_view(), name="friend-remove"),
+    path("friends/add/batch/", BatchAddFriendsView.as_view(), name="friend-add-batch"),
+    path("friends/remove/batch/", BatchRemoveFriendsView.as_view(), name="friend-remove-batch"),
+    path("friends/mutual/<int:pk>/", MutualFriendsView.as_view(), name="friend-mutual"),
+    path("friends/suggestions/", FriendSuggestionsView.as_view(), name="friend-suggestions"),
 
     # Expenses
-    path("expenses/", ExpenseListCreateView.as_view(), name="expense-list-create"),
-    path("expenses/<int:pk>/", ExpenseDetailView.as_view(), name="expense-detail"),
+    path("expenses/", read_views.ExpenseListCreateView.as_view(), name="expense-list-create"),
+    path("expenses/bulk/", ExpenseBulkCreateView.as_view(), name="expense-bulk-create"),
+    path("expenses/search/", ExpenseSearchView.as_view(), name="expense-search"),
+    path("expenses/export/<str:fmt>/", ExpenseExportView.as_view(), name="expense-export"),
+    path("expenses/history/", ExpenseHistoryView.as_view(), name="expense-history"),
+    path("expenses/<int:pk>/", read_views.ExpenseDetailView.as_view(), name="expense-detail"),
+    path("expenses/<int:pk>/split/", ExpenseSplitView.as_view(), name="expense-split"),
 
     # Expense Shares
     path("expenses/<int:expense_id>/shares/", ExpenseShareListCreateView.as_view(), name="expense-share-list-create"),
     path("shares/<int:pk>/", ExpenseShareDetailView.as_view(), name="expense-share-detail"),
+
+    # Balances
+    path("balances/", BalanceView.as_view(), name="balances"),
+    path("balances/settle-up/", SettleUpView.as_view(), name="balances-settle-up"),
+    path("balances/settlements/", SettlementListCreateView.as_view(), name="settlement-list-create"),
+    path("balances/settlements/batch/", SettlementBatchView.as_view(), name="settlement-batch"),
+
+    # Analytics
+    path("analytics/", AnalyticsView.as_view(), name="analytics"),
+
+    # Sync
+    path("sync/", SyncView.as_view(), name="sync"),
+
+    # Monitoring
+    path("stats/requests/", RequestStatsView.as_view(), name="request-stats"),
 ]
+
+if settings.API_ASYNC_VIEWS:
+    # Server-sent events, see api/events.py; a stream would tie up a WSGI worker
+    urlpatterns.append(path("events/", async_views.EventStreamView.as_view(), name="events"))
@@ -1,20 +1,48 @@
+from collections import defaultdict
+
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
 from rest_framework import generics, status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.exceptions import PermissionDenied
-from django.db.models import Q
+from rest_framework.exceptions import NotFound, PermissionDenied
+from django.db.models import Prefetch, Q, Sum
+
+from backend.routers import reads_from_replica
 
-from .models import Student, Expense, ExpenseShare
+from . import analytics, export, fast_serializers, friend_graph, instrumentation, search, simplify, sync
+from .response_cache import EXPENSES, FRIENDS, PROFILE, cached_response
+from .models import (
+    Student, Expense, ExpenseShare, ArchivedExpense, ArchivedExpenseShare, PairBalance, UserBalance, Settlement,
+    UserMonthlySpend, DepartmentMonthlySpend, MonthlyCoSpend,
+)
+from .pagination import (
+    ExpenseCursorPagination, ExpenseSearchPagination, ExpenseShareCursorPagination, SettlementCursorPagination,
+)
 from .serializers import (
     RegisterSerializer,
     LogoutSerializer,
     StudentSerializer,
     StudentUpdateSerializer,
+    FriendBatchSerializer,
+    FriendSuggestionQuerySerializer,
     ExpenseSerializer,
     ExpenseShareSerializer,
+    ExpenseWithSharesSerializer,
+    ExpenseSplitSerializer,
+    PairBalanceSerializer,
+    UserBalanceSerializer,
+    SettlementTransferSerializer,
+    SettlementSerializer,
+    SettlementCreateSerializer,
+    SettlementBatchSerializer,
+    AnalyticsQuerySerializer,
+    MonthlySpendSerializer,
+    DepartmentSpendSerializer,
+    CoSpenderSerializer,
+    SyncQuerySerializer,
 )
 
 # ---------------------------
@@ -41,10 +69,28 @@ class StudentProfileView(generics.RetrieveAPIView):
     serializer_class = StudentSerializer
     permission_classes = [IsAuthenticated]
 
+    @cached_response(PROFILE)
+    @reads_from_replica
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
     def get_object(self):
-        if not hasattr(self.request.user, "student_profile"):
+        try:
+            return (
+                Student.objects.select_related("user")
+                .prefetch_related(Prefetch("friends", queryset=Student.objects.order_by("pk")))
+                .get(user=self.request.user)
+            )
+        except Student.DoesNotExist:
             raise PermissionDenied("Profile does not exist.")
-        return self.request.user.student_profile
+
+    def retrieve(self, request, *args, **kwargs):
+        if fast_serializers.enabled():
+            data = fast_serializers.students_data(Student.objects.filter(user=request.user))
+            if not data:
+                raise PermissionDenied("Profile does not exist.")
+            return Response(data[0])
+        return super().retrieve(request, *args, **kwargs)
 
 
 class StudentUpdateProfileView(generics.UpdateAPIView):
@@ -52,9 +98,10 @@ class StudentUpdateProfileView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        if not hasattr(self.request.user, "student_profile"):
+        try:
+            return Student.objects.select_related("user").get(user=self.request.user)
+        except Student.DoesNotExist:
             raise PermissionDenied("Profile does not exist.")
-        return self.request.user.student_profile
 
 
 # ---------------------------
@@ -64,9 +111,15 @@ class StudentUpdateProfileView(generics.UpdateAPIView):
 class FriendListView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @cached_response(FRIENDS)
+    @reads_from_replica
     def get(self, request):
-        student = request.user.student_profile
-        friends = student.friends.all()
+        friends = Student.objects.filter(friend_of__user=request.user)
+        if fast_serializers.enabled():
+            return Response(fast_serializers.students_data(friends))
+        friends = friends.select_related("user").prefetch_related(
+            Prefetch("friends", queryset=Student.objects.order_by("pk"))
+        )
         serializer = StudentSerializer(friends, many=True)
         return Response(serializer.data)
 
@@ -81,9 +134,8 @@ class AddFriendView(APIView):
 
         student = request.user.student_profile
         try:
-            friend_user = User.objects.get(username=username)
-            friend = friend_user.student_profile
-        except (User.DoesNotExist, Student.DoesNotExist):
+            friend = Student.objects.select_related("user").get(user__username=username)
+        except Student.DoesNotExist:
             return Response({"detail": "User not found or has no profile."}, status=status.HTTP_404_NOT_FOUND)
 
         if friend == student:
@@ -101,13 +153,76 @@ class RemoveFriendView(APIView):
 
     def delete(self, request, pk):
         student = request.user.student_profile
-        friend = get_object_or_404(Student, pk=pk)
+        friend = get_object_or_404(Student.objects.select_related("user"), pk=pk)
         if not student.friends.filter(pk=friend.pk).exists():
             return Response({"detail": "Not in your friends list."}, status=status.HTTP_400_BAD_REQUEST)
         student.friends.remove(friend)
         return Response({"detail": f"{friend.user.username} removed from friends"}, status=status.HTTP_204_NO_CONTENT)
 
 
+class BatchAddFriendsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # A whole roster in a fixed handful of queries
+        serializer = FriendBatchSerializer(data=request.data)
+        if serializer.is_valid():
+            return Response({"results": serializer.add(request.user.student_profile)})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BatchRemoveFriendsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = FriendBatchSerializer(data=request.data)
+        if serializer.is_valid():
+            return Response({"results": serializer.remove(request.user.student_profile)})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def students_by_id(ids):
+    students = Student.objects.filter(pk__in=ids)
+    if fast_serializers.enabled():
+        data = fast_serializers.students_data(students)
+    else:
+        students = students.select_related("user").prefetch_related(
+            Prefetch("friends", queryset=Student.objects.order_by("pk"))
+        )
+        data = StudentSerializer(students, many=True).data
+    return {student["id"]: student for student in data}
+
+
+class MutualFriendsView(APIView):
+    # Served from the friend graph cache; not response-cached, since the other
+    # student's friend list changing does not invalidate this user's scopes.
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        student = request.user.student_profile
+        if not Student.objects.filter(pk=pk).exists():
+            raise NotFound("Student not found.")
+        ids = friend_graph.mutual_friends(student.pk, pk)
+        students = students_by_id(ids)
+        return Response([students[student_id] for student_id in ids if student_id in students])
+
+
+class FriendSuggestionsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = FriendSuggestionQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        student = request.user.student_profile
+        suggestions = friend_graph.suggestions(student.pk, query.validated_data["limit"])
+        students = students_by_id([student_id for student_id, _ in suggestions])
+        return Response([
+            {"student": students[student_id], "mutual_friends": mutual}
+            for student_id, mutual in suggestions
+            if student_id in students
+        ])
+
+
 # ---------------------------
 # Expenses
 # ---------------------------
@@ -115,15 +230,18 @@ class RemoveFriendView(APIView):
 class ExpenseListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @cached_response(EXPENSES)
+    @reads_from_replica
     def get(self, request):
         # Show expenses where user is payer OR payee
-        expenses = (
-            Expense.objects.filter(Q(payer=request.user) | Q(shares__payee=request.user))
-            .distinct()
-            .order_by("-created_at")
-        )
-        serializer = ExpenseSerializer(expenses, many=True)
-        return Response(serializer.data)
+        expenses = Expense.objects.visible_to(request.user)
+        paginator = ExpenseCursorPagination()
+        if fast_serializers.enabled():
+            page = paginator.paginate_queryset(fast_serializers.expense_values(expenses), request, view=self)
+            return paginator.get_paginated_response(fast_serializers.expenses_data(page))
+        page = paginator.paginate_queryset(expenses.select_related("payer"), request, view=self)
+        serializer = ExpenseSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request):
         serializer = ExpenseSerializer(data=request.data)
@@ -133,15 +251,91 @@ class ExpenseListCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ExpenseBulkCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Create an expense together with all of its shares in one transaction
+        serializer = ExpenseWithSharesSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(payer=request.user)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ExpenseSearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @cached_response(EXPENSES)
+    @reads_from_replica
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"q": ["This query parameter is required."]}, status=status.HTTP_400_BAD_REQUEST)
+
+        backend = search.get_backend()
+        visible = Expense.objects.visible_to(request.user)
+        expenses, matches = backend.search(visible, query), backend.filter(visible, query)
+        paginator = ExpenseSearchPagination()
+        if fast_serializers.enabled():
+            page = paginator.paginate_queryset(
+                fast_serializers.expense_values(expenses), request, view=self, count_queryset=matches
+            )
+            return paginator.get_paginated_response(fast_serializers.expenses_data(page))
+        page = paginator.paginate_queryset(
+            expenses.select_related("payer"), request, view=self, count_queryset=matches
+        )
+        serializer = ExpenseSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ExpenseExportView(APIView):
+    permission_classes = [IsAuthenticated]
+    formats = {
+        "csv": (export.csv_chunks, "text/csv; charset=utf-8"),
+        "ndjson": (export.ndjson_chunks, "application/x-ndjson"),
+    }
+
+    def get(self, request, fmt):
+        # Streams the full history in constant memory instead of building one list
+        if fmt not in self.formats:
+            raise NotFound("Unknown export format.")
+        chunks, content_type = self.formats[fmt]
+        response = StreamingHttpResponse(
+            export.streaming_content(request._request, chunks(request.user)), content_type=content_type
+        )
+        response["Content-Disposition"] = f'attachment; filename="expenses.{fmt}"'
+        return response
+
+
+class ExpenseHistoryView(APIView):
+    # Archived expenses (see api/archive.py), read-only, each with its shares
+    permission_classes = [IsAuthenticated]
+
+    @cached_response(EXPENSES)
+    @reads_from_replica
+    def get(self, request):
+        expenses = ArchivedExpense.objects.visible_to(request.user)
+        paginator = ExpenseCursorPagination()
+        # Archived rows have no ModelSerializer; values() rows give the same shape
+        page = paginator.paginate_queryset(fast_serializers.expense_values(expenses), request, view=self)
+        shares = defaultdict(list)
+        archived_shares = ArchivedExpenseShare.objects.filter(expense_id__in=[row["id"] for row in page]).order_by("id")
+        for row in fast_serializers.share_values(archived_shares):
+            shares[row["expense_id"]].append(fast_serializers.share_data(row))
+        return paginator.get_paginated_response(
+            [{**fast_serializers.expense_data(row), "shares": shares[row["id"]]} for row in page]
+        )
+
+
 class ExpenseDetailView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self, pk, user):
-        return get_object_or_404(
-            Expense.objects.filter(Q(payer=user) | Q(shares__payee=user)).distinct(),
-            pk=pk,
-        )
+        return get_object_or_404(Expense.objects.visible_to(user).select_related("payer"), pk=pk)
 
+    @cached_response(EXPENSES)
+    @reads_from_replica
     def get(self, request, pk):
         expense = self.get_object(pk, request.user)
         serializer = ExpenseSerializer(expense)
@@ -175,6 +369,21 @@ class ExpenseDetailView(APIView):
         return Response({"detail": "Expense deleted"}, status=status.HTTP_204_NO_CONTENT)
 
 
+class ExpenseSplitView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, pk):
+        # Replaces the whole share set in one transaction (see api/splits.py)
+        expense = get_object_or_404(Expense.objects.visible_to(request.user), pk=pk)
+        if expense.payer_id != request.user.pk:
+            raise PermissionDenied("Only the payer can split this expense.")
+        serializer = ExpenseSplitSerializer(expense, data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 # ---------------------------
 # Expense Shares
 # ---------------------------
@@ -182,15 +391,18 @@ class ExpenseDetailView(APIView):
 class ExpenseShareListCreateView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @cached_response(EXPENSES)
+    @reads_from_replica
     def get(self, request, expense_id):
         # Allow payer and payees to see shares
-        expense = get_object_or_404(
-            Expense.objects.filter(Q(payer=request.user) | Q(shares__payee=request.user)).distinct(),
-            pk=expense_id,
-        )
-        shares = expense.shares.all()
-        serializer = ExpenseShareSerializer(shares, many=True)
-        return Response(serializer.data)
+        expense = get_object_or_404(Expense.objects.visible_to(request.user), pk=expense_id)
+        paginator = ExpenseShareCursorPagination()
+        if fast_serializers.enabled():
+            page = paginator.paginate_queryset(fast_serializers.share_values(expense.shares.all()), request, view=self)
+            return paginator.get_paginated_response(fast_serializers.shares_data(page))
+        page = paginator.paginate_queryset(expense.shares.select_related("payee"), request, view=self)
+        serializer = ExpenseShareSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
     def post(self, request, expense_id):
         # Only payer can add shares
@@ -207,10 +419,11 @@ class ExpenseShareDetailView(APIView):
 
     def get_object(self, pk, user):
         return get_object_or_404(
-            ExpenseShare.objects.filter(Q(expense__payer=user) | Q(payee=user)).distinct(),
+            ExpenseShare.objects.filter(Q(expense__payer=user) | Q(payee=user)).select_related("expense", "payee"),
             pk=pk,
         )
 
+    @reads_from_replica
     def get(self, request, pk):
         share = self.get_object(pk, request.user)
         serializer = ExpenseShareSerializer(share)
@@ -242,3 +455,162 @@ class ExpenseShareDetailView(APIView):
             raise PermissionDenied("Only the payer can delete shares.")
         share.delete()
         return Response({"detail": "Expense share deleted"}, status=status.HTTP_204_NO_CONTENT)
+
+
+# ---------------------------
+# Balances
+# ---------------------------
+
+class BalanceView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @reads_from_replica
+    def get(self, request):
+        # Reads the materialized ledger: one row per counterparty, not per share
+        totals = UserBalance.objects.filter(user=request.user).first() or UserBalance(user=request.user)
+        balances = (
+            PairBalance.objects.filter(user=request.user)
+            .exclude(amount=0)
+            .select_related("other")
+            .order_by("-amount", "other_id")
+        )
+        data = UserBalanceSerializer(totals).data
+        data["balances"] = PairBalanceSerializer(balances, many=True).data
+        return Response(data)
+
+
+class SettleUpView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @reads_from_replica
+    def get(self, request):
+        # Fewest transfers that settle all debts between the user and their friends
+        transfers = simplify.settle_up(simplify.group_user_ids(request.user.student_profile))
+        user_ids = {t["from_user_id"] for t in transfers} | {t["to_user_id"] for t in transfers}
+        usernames = dict(User.objects.filter(pk__in=user_ids).values_list("id", "username"))
+        for transfer in transfers:
+            transfer["from_username"] = usernames.get(transfer["from_user_id"])
+            transfer["to_username"] = usernames.get(transfer["to_user_id"])
+        return Response(SettlementTransferSerializer(transfers, many=True).data)
+
+
+class SettlementListCreateView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @reads_from_replica
+    def get(self, request):
+        settlements = Settlement.objects.filter(Q(from_user=request.user) | Q(to_user=request.user))
+        paginator = SettlementCursorPagination()
+        page = paginator.paginate_queryset(settlements, request, view=self)
+        return paginator.get_paginated_response(SettlementSerializer(page, many=True).data)
+
+    def post(self, request):
+        # Record a payment the user made to someone they owe, directly or through friends
+        serializer = SettlementCreateSerializer(data=request.data, context={"request": request})
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SettlementBatchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # e.g. the user paying back several friends at once
+        serializer = SettlementBatchSerializer(data=request.data, context={"request": request})
+        if serializer.is_valid():
+            serializer.save()
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# ---------------------------
+# Analytics
+# ---------------------------
+
+class AnalyticsView(APIView):
+    permission_classes = [IsAuthenticated]
+    top_co_spenders = 10
+
+    @reads_from_replica
+    def get(self, request):
+        # Reads only the monthly rollups, never Expense or ExpenseShare
+        query = AnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        months = analytics.recent_months(query.validated_data["months"])
+
+        department = Student.objects.filter(user=request.user).values_list("department", flat=True).first() or ""
+        user_rows = {
+            row.month: row
+            for row in UserMonthlySpend.objects.filter(user=request.user, month__gte=months[0])
+        }
+        department_rows = {
+            row.month: row
+            for row in DepartmentMonthlySpend.objects.filter(department=department, month__gte=months[0])
+        }
+
+        departments = []
+        totals = (
+            DepartmentMonthlySpend.objects.filter(month__gte=months[0])
+            .values("department")
+            .annotate(paid=Sum("paid"), lent=Sum("lent"), owed=Sum("owed"))
+            .order_by("department")
+        )
+        for row in totals:
+            if any(row[field] for field in analytics.TOTAL_FIELDS):
+                departments.append({**row, "spent": row["paid"] - row["lent"] + row["owed"]})
+        departments.sort(key=lambda row: row["spent"], reverse=True)
+
+        co_spenders = (
+            MonthlyCoSpend.objects.filter(user=request.user, month__gte=months[0], shares__gt=0)
+            .values("other_id", "other__username")
+            .annotate(amount=Sum("amount"), shares=Sum("shares"))
+            .order_by("-amount", "other_id")[:self.top_co_spenders]
+        )
+
+        return Response({
+            "months": MonthlySpendSerializer(
+                [user_rows.get(month) or UserMonthlySpend(month=month) for month in months], many=True
+            ).data,
+            "department": {
+                "name": department,
+                "months": MonthlySpendSerializer(
+                    [department_rows.get(month) or DepartmentMonthlySpend(month=month) for month in months],
+                    many=True,
+                ).data,
+            },
+            "departments": DepartmentSpendSerializer(departments, many=True).data,
+            "top_co_spenders": CoSpenderSerializer(co_spenders, many=True).data,
+        })
+
+
+# ---------------------------
+# Sync
+# ---------------------------
+
+class SyncView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    # Never from the replica: positions taken from a lagging one would skip rows
+    def get(self, request):
+        query = SyncQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        try:
+            return Response(sync.changes(request.user, query.validated_data.get("since")))
+        except sync.CursorExpired:
+            return Response(
+                {"detail": "This cursor has expired; sync from scratch."}, status=status.HTTP_410_GONE
+            )
+
+
+# ---------------------------
+# Monitoring
+# ---------------------------
+
+class RequestStatsView(APIView):
+    # Per-route timing counters from api/instrumentation.py, for staff only
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"routes": instrumentation.collect()})
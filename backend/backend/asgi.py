@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+# Serve the read-heavy endpoints with the async views (api/async_views.py)
+# and mount the server-sent event stream at /api/events/ (api/events.py)
+os.environ.setdefault('API_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
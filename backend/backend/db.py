@@ -0,0 +1,66 @@
+"""
+Database configuration for the backend project, read from the environment.
+
+    DATABASE_ENGINE         Django backend (default: django.db.backends.sqlite3)
+    DATABASE_NAME           SQLite file or database name (default: db.sqlite3)
+    DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_PORT
+    DATABASE_CONN_MAX_AGE   seconds to keep a connection open (default: 600)
+    DATABASE_REPLICA_NAME   enables the "replica" alias used by read-only views;
+                            DATABASE_REPLICA_* falls back to DATABASE_* for
+                            anything not set
+
+SQLite connections are opened in WAL mode so readers never block the writer,
+with synchronous=NORMAL (safe in WAL), a busy timeout so concurrent writers
+queue instead of failing with "database is locked", and memory-mapped reads.
+Transactions start IMMEDIATE so a read-then-write transaction takes the write
+lock up front instead of failing when it tries to upgrade.
+"""
+from decouple import config
+
+SQLITE_BUSY_TIMEOUT = 20  # seconds
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+)
+
+SQLITE_OPTIONS = {
+    "timeout": SQLITE_BUSY_TIMEOUT,
+    "transaction_mode": "IMMEDIATE",
+    "init_command": ";".join(SQLITE_PRAGMAS),
+}
+
+
+def database_config(prefix, default_name, fallback=None):
+    fallback = fallback or {}
+
+    def setting(name, default=""):
+        return config(f"{prefix}_{name}", default=fallback.get(name, default))
+
+    engine = setting("ENGINE", "django.db.backends.sqlite3")
+    database = {
+        "ENGINE": engine,
+        "NAME": setting("NAME", default_name),
+        "CONN_MAX_AGE": config(f"{prefix}_CONN_MAX_AGE", default=fallback.get("CONN_MAX_AGE", 600), cast=int),
+        "CONN_HEALTH_CHECKS": True,
+    }
+    if engine == "django.db.backends.sqlite3":
+        database["OPTIONS"] = dict(SQLITE_OPTIONS)
+    else:
+        for name in ("USER", "PASSWORD", "HOST", "PORT"):
+            database[name] = setting(name)
+    return database
+
+
+def get_databases(base_dir):
+    default = database_config("DATABASE", str(base_dir / "db.sqlite3"))
+    databases = {"default": default}
+
+    if config("DATABASE_REPLICA_NAME", default=""):
+        replica = database_config("DATABASE_REPLICA", default["NAME"], fallback=default)
+        # Tests run against the primary; the replica alias just points at it
+        replica["TEST"] = {"MIRROR": "default"}
+        databases["replica"] = replica
+    return databases
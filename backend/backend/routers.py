@@ -0,0 +1,78 @@
+"""
+Routes reads made inside read-only views to the "replica" database alias.
+
+Views opt in with ``reads_from_replica``; everything else, including every
+write, stays on "default", so code outside those views never sees replication
+lag. ``read_primary`` keeps a block on "default" even inside such a view, for
+results that outlive the request (see api/response_cache.py). Without a
+configured replica, or with ``DATABASE_REPLICA_READS = False`` (e.g. while
+the replica is lagging), the router is a no-op.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+REPLICA = "replica"
+
+_use_replica = ContextVar("use_replica", default=False)
+_use_primary = ContextVar("use_primary", default=False)
+
+
+@contextmanager
+def read_replica():
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+@contextmanager
+def read_primary():
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+def reads_from_replica(method):
+    if iscoroutinefunction(method):
+        @wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            # The async ORM runs queries in a thread that inherits this context
+            with read_replica():
+                return await method(*args, **kwargs)
+        return async_wrapper
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with read_replica():
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (
+            _use_replica.get()
+            and not _use_primary.get()
+            and REPLICA in settings.DATABASES
+            and getattr(settings, "DATABASE_REPLICA_READS", True)
+        ):
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema through replication
+        return db != REPLICA
@@ -12,6 +12,10 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from decouple import config
+
+from .db import get_databases
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,11 +56,35 @@ CORS_ALLOWED_ORIGINS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
 }
 
+SIMPLE_JWT = {
+    'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.StudentTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.CachedTokenRefreshSerializer',
+}
+
+# Seconds an authenticated user/profile stays cached (see api/authentication.py)
+AUTH_CACHE_TTL = 60
+# Authenticate from the token's username/student_id claims without a lookup
+AUTH_TRUST_TOKEN_CLAIMS = False
+
+# Serve the expense feed, share lists, friend list and profile from values()
+# rows instead of ModelSerializer instances (see api/fast_serializers.py).
+API_FAST_READS = True
+
+# Mount the async versions of the read-heavy views (see api/async_views.py).
+# backend/asgi.py turns this on; it stays off under WSGI.
+API_ASYNC_VIEWS = config('API_ASYNC_VIEWS', default=False, cast=bool)
+
 MIDDLEWARE = [
+    # First, so its timings cover every other middleware too
+    'api.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -69,6 +97,8 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+# Lets the frontend read the request timing breakdown
+CORS_EXPOSE_HEADERS = ["Server-Timing"]
 
 ROOT_URLCONF = 'backend.urls'
 
@@ -93,13 +123,89 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# Configured from DATABASE_* environment variables, see backend/db.py
+
+DATABASES = get_databases(BASE_DIR)
+
+DATABASE_ROUTERS = ['backend.routers.ReadReplicaRouter']
+
+# Send reads from read-only views to the "replica" alias when it is configured
+DATABASE_REPLICA_READS = config('DATABASE_REPLICA_READS', default=True, cast=bool)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# locmem is per process: point CACHE_BACKEND/CACHE_LOCATION at a shared cache
+# (Redis, Memcached, ...) when running more than one worker.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='students-expense'),
     }
 }
 
+# Per-user GET response cache with ETags (see api/response_cache.py)
+API_RESPONSE_CACHE = True
+API_CACHE_ALIAS = 'default'
+API_CACHE_TIMEOUT = 300
+
+# Cached friend id arrays (see api/friend_graph.py); invalidated on change
+API_FRIEND_GRAPH_TIMEOUT = 60 * 60 * 24
+
+# Server-Timing headers, slow-request log and per-route counters
+# (see api/instrumentation.py). Requests over either threshold are logged
+# with their most expensive SQL on the "api.requests" logger.
+API_REQUEST_TIMING = config('API_REQUEST_TIMING', default=True, cast=bool)
+API_SLOW_REQUEST_MS = config('API_SLOW_REQUEST_MS', default=500, cast=int)
+API_SLOW_REQUEST_QUERIES = config('API_SLOW_REQUEST_QUERIES', default=50, cast=int)
+# Seconds between writes of each process's counters to the cache
+API_REQUEST_STATS_FLUSH = 10
+
+# Delta sync (see api/sync.py): rows per stream and response, seconds a
+# position stays behind the present, and days tombstones are kept; older
+# cursors get 410 Gone and clients sync from scratch.
+API_SYNC_PAGE_SIZE = 500
+API_SYNC_SETTLE_SECONDS = 2
+API_SYNC_TOMBSTONE_DAYS = 90
+
+# Server-sent events at /api/events/, served under ASGI only (see
+# api/events.py). LocalBroker reaches the streams of its own process; use
+# api.events.CacheBroker with a shared cache when running more than one.
+API_EVENTS_BROKER = config('API_EVENTS_BROKER', default='api.events.LocalBroker')
+API_EVENTS_KEEPALIVE = 15
+API_EVENTS_POLL_INTERVAL = 0.25
+API_EVENTS_QUEUE_SIZE = 100
+
+# Settled expenses older than this move to the archive tables when
+# `manage.py archive_expenses` runs (see api/archive.py)
+API_ARCHIVE_AFTER_DAYS = config('API_ARCHIVE_AFTER_DAYS', default=365, cast=int)
+API_ARCHIVE_BATCH_SIZE = 500
+
+# Background jobs (see api/jobs.py), run by `manage.py run_jobs`: the
+# `worker` process of the Procfile, deployed next to `web`. Without it the
+# analytics rollups stop updating and the job table keeps growing.
+API_JOBS_THREADS = config('API_JOBS_THREADS', default=4, cast=int)
+API_JOBS_BATCH_SIZE = 100
+API_JOBS_POLL_INTERVAL = 1.0
+API_JOBS_LEASE = 300  # seconds before the jobs of a worker that died are due again
+API_JOBS_MAX_ATTEMPTS = 8
+API_JOBS_RETRY_DELAY = 5  # seconds before the first retry, doubling with each failure
+API_JOBS_MAX_RETRY_DELAY = 60 * 60
+API_JOBS_STATS_INTERVAL = 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.requests': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'api.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -13,15 +13,26 @@ const authHeader = () => {
   };
 };
 
+// ---------------- Helper for Paginated Lists ----------------
+// List endpoints are cursor-paginated: { next, previous, results }
+const fetchAllPages = async (url) => {
+  const results = [];
+  while (url) {
+    const res = await axios.get(url, authHeader());
+    results.push(...res.data.results);
+    url = res.data.next;
+  }
+  return results;
+};
+
 // ---------------- Thunks ----------------
 
-// Fetch all expenses
+// Fetch all expenses, following the feed page by page
 export const fetchExpenses = createAsyncThunk(
   "expenses/fetchExpenses",
   async (_, { rejectWithValue }) => {
     try {
-      const res = await axios.get(API_URL, authHeader());
-      return res.data;
+      return await fetchAllPages(API_URL);
     } catch (err) {
       return rejectWithValue(err.response?.data || "Error fetching expenses");
     }
@@ -46,21 +46,18 @@ const Expenses = () => {
     setLoading(true);
 
     try {
-      const expenseRes = await api.post("/expenses/", {
-        title: formData.title,
-        amount: formData.amount,
-      });
-
-      const expenseId = expenseRes.data.id;
       const totalParticipants = formData.payees.length + 1;
       const shareAmount = parseFloat(formData.amount) / totalParticipants;
 
-      for (const payeeId of formData.payees) {
-        await api.post(`/expenses/${expenseId}/shares/`, {
+      // Expense and all shares are created together in a single request
+      await api.post("/expenses/bulk/", {
+        title: formData.title,
+        amount: formData.amount,
+        shares: formData.payees.map((payeeId) => ({
           payee: payeeId,
           amount: shareAmount.toFixed(2),
-        });
-      }
+        })),
+      });
 
       // Reset form
       setFormData({ title: "", amount: "", payees: [] });
@@ -13,16 +13,28 @@ const Expenses = () => {
     },
   });
 
+  // List endpoints are cursor-paginated: { next, previous, results }.
+  // `next` is an absolute URL, which axios uses as is.
+  const fetchAllPages = async (url) => {
+    const results = [];
+    while (url) {
+      const { data } = await api.get(url);
+      results.push(...data.results);
+      url = data.next;
+    }
+    return results;
+  };
+
   const fetchExpenses = async () => {
     setLoading(true);
     setError(null);
     try {
-      const { data: expensesData } = await api.get("/expenses/");
+      const allExpenses = await fetchAllPages("/expenses/");
 
       const withShares = await Promise.all(
-        expensesData.map(async (exp) => {
+        allExpenses.map(async (exp) => {
           try {
-            const { data: shares } = await api.get(`/expenses/${exp.id}/shares/`);
+            const shares = await fetchAllPages(`/expenses/${exp.id}/shares/`);
             return { ...exp, shares };
           } catch {
             return { ...exp, shares: [] };